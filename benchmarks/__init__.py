@@ -0,0 +1,10 @@
+"""
+    Export benchmarks.
+    Runs synthetic workloads through every export stage and records wall
+        time, peak RSS and traced allocations per stage. Results are saved
+        as JSON and compared to a stored baseline to flag regressions.
+
+    Usage:
+        python -m benchmarks.run --output results.json
+        python -m benchmarks.run --baseline results.json
+"""
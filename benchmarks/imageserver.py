@@ -0,0 +1,79 @@
+import zlib
+import struct
+import threading
+
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+"""
+    Local HTTP stand-in for image hosts, so image workloads measure
+        the export and not the network.
+"""
+
+
+__all__ = [
+    'make_png', 'ImageServer'
+]
+
+
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return (struct.pack('>I', len(data)) + chunk
+            + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff))
+
+
+def make_png(width=64, height=64):
+    """ Solid grey RGB PNG of the given size. """
+    row = b'\x00' + b'\x80\x80\x80' * width
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(row * height)),
+        _png_chunk(b'IEND', b''),
+    ))
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.image
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections of the prefetch pool
+    request_queue_size = 64
+
+
+class ImageServer(object):
+    """
+        Serves the same PNG for every path on a random local port.
+        Use as a context manager, url(name) gives a distinct image URL.
+    """
+    def __init__(self, image=None):
+        self.image = image or make_png()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _ImageHandler)
+        self._server.image = self.image
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def url(self, name):
+        return 'http://127.0.0.1:%d/%s.png' % (self._server.server_port, name)
@@ -0,0 +1,50 @@
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from excelsior.instrumentation import peak_rss
+
+"""
+    Stage measurement helpers.
+    Wall time and traced allocations are taken in separate runs, tracing
+        slows allocation-heavy code down too much to time it.
+"""
+
+
+__all__ = [
+    'peak_rss', 'timed', 'traced'
+]
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def timed(func):
+    """ Returns (result, seconds). """
+    gc.collect()
+    start = _clock()
+    result = func()
+    return result, _clock() - start
+
+
+def traced(func):
+    """
+        Returns (result, peak bytes allocated while func ran),
+            the peak is None without tracemalloc.
+    """
+    if tracemalloc is None:
+        return func(), None
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, peak
@@ -0,0 +1,283 @@
+import io
+import sys
+import copy
+import json
+import platform
+import argparse
+import tempfile
+
+from .imageserver import ImageServer
+from .measure import peak_rss, timed, traced
+from .workloads import WORKLOADS, get_workload
+
+"""
+    Benchmark runner.
+    Every workload goes through the export stages in order:
+        write_row                     building the schema via Worksheet
+        serializer                    ExcelExportSerializer validation
+        validate_schema               fast path validation
+        create_sheet                  rendering with constant_memory into
+                                      a temp file, workbook closed
+        write_schema_to_file_object   end to end, workbook closed
+    Each stage gets a fresh copy of the schema, since rendering alters
+        image and table options in place.
+"""
+
+
+__all__ = [
+    'STAGES', 'run_workload', 'run', 'compare', 'main'
+]
+
+
+STAGES = (
+    'write_row', 'serializer', 'validate_schema', 'create_sheet',
+    'write_schema_to_file_object'
+)
+
+# Metrics compared against the baseline. Peak RSS is a process wide
+#   high-water mark, it's reported but too coarse to flag.
+COMPARED_METRICS = ('wall_time', 'traced_peak')
+
+# Stages faster than this (seconds) are all noise
+MIN_WALL_TIME = 0.01
+
+
+def setup_django():
+    from django.conf import settings
+    if settings.configured:
+        return
+
+    import django
+    settings.configure(
+        SECRET_KEY='excelsior-benchmarks',
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'rest_framework'
+        ],
+        REST_FRAMEWORK={'UNAUTHENTICATED_USER': None}
+    )
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+def _stage_functions(build, scale, image_server):
+    # Imported late, they need configured Django settings
+    import xlsxwriter
+    from excelsior.builder import create_sheet
+    from excelsior.images import ImageCache, default_cache
+    from excelsior.serializers import ExcelExportSerializer
+    from excelsior.validators import validate_schema
+    from excelsior.views import write_schema_to_file_object
+
+    # Every stage sets up its input and returns the callable to measure
+    state = {}
+
+    def write_row():
+        return lambda: build(scale, image_server)
+
+    def keep_schema(builder):
+        schema = builder.as_dict()
+        schema['worksheets'] = list(schema['worksheets'])
+        state['schema'] = copy.deepcopy(schema)
+
+    def serializer():
+        serializer = ExcelExportSerializer(data=copy.deepcopy(state['schema']))
+        return lambda: serializer.is_valid(raise_exception=True)
+
+    def fast_path():
+        schema = copy.deepcopy(state['schema'])
+        return lambda: validate_schema(schema)
+
+    def render():
+        schema = copy.deepcopy(state['schema'])
+
+        def stage():
+            # NOTE: in_memory would turn constant_memory off, render the
+            #   way streamed exports are (see write_schema_to_file_object)
+            with tempfile.TemporaryFile() as file_object:
+                workbook = xlsxwriter.Workbook(file_object, {
+                    'in_memory': False,
+                    'constant_memory': True
+                })
+                create_sheet(workbook, schema, image_cache=ImageCache())
+                workbook.close()
+                return file_object.tell()
+        return stage
+
+    def end_to_end():
+        schema = copy.deepcopy(state['schema'])
+
+        def stage():
+            default_cache.clear()
+            file_object = write_schema_to_file_object(schema, io.BytesIO())
+            return len(file_object.getvalue())
+        return stage
+
+    return (
+        ('write_row', write_row, keep_schema),
+        ('serializer', serializer, None),
+        ('validate_schema', fast_path, None),
+        ('create_sheet', render, None),
+        ('write_schema_to_file_object', end_to_end, None),
+    )
+
+
+def _run_stages(build, scale, image_server, measure):
+    results = []
+    for name, setup, after in _stage_functions(build, scale, image_server):
+        result, value = measure(setup())
+        if after is not None:
+            after(result)
+        results.append((name, result, value))
+    return results
+
+
+def run_workload(name, scale=1, repeat=1, trace_memory=True):
+    """
+        Measures every stage of a workload. Returns
+            {stage: {wall_time, peak_rss, traced_peak[, bytes_out]}},
+            wall time is the best of `repeat` runs.
+    """
+    build = get_workload(name)
+    stages = dict((stage, {}) for stage in STAGES)
+
+    with ImageServer() as image_server:
+        for _ in range(repeat):
+            for stage, result, seconds in _run_stages(
+                    build, scale, image_server, timed):
+                record = stages[stage]
+                best = record.get('wall_time')
+                record['wall_time'] = seconds if best is None else min(best, seconds)
+                record['peak_rss'] = peak_rss()
+                if stage == 'write_schema_to_file_object':
+                    record['bytes_out'] = result
+
+        if trace_memory:
+            for stage, result, peak in _run_stages(
+                    build, scale, image_server, traced):
+                stages[stage]['traced_peak'] = peak
+
+    return stages
+
+
+def run(workloads=None, scale=1, repeat=1, trace_memory=True):
+    setup_django()
+    import xlsxwriter
+
+    names = workloads or [name for name, _ in WORKLOADS]
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'xlsxwriter': getattr(xlsxwriter, '__version__', None),
+            'scale': scale,
+            'repeat': repeat
+        },
+        'results': dict(
+            (name, run_workload(name, scale, repeat, trace_memory))
+            for name in names
+        )
+    }
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+        Lists regressions: metrics that grew by more than `threshold`
+            (a fraction) over the baseline. Workloads, stages and metrics
+            missing on either side are skipped.
+    """
+    regressions = []
+    for workload, stages in sorted(current['results'].items()):
+        baseline_stages = baseline.get('results', {}).get(workload)
+        if baseline_stages is None:
+            continue
+
+        for stage in STAGES:
+            now = stages.get(stage, {})
+            before = baseline_stages.get(stage, {})
+            for metric in COMPARED_METRICS:
+                if not now.get(metric) or not before.get(metric):
+                    continue
+                if metric == 'wall_time' and before[metric] < MIN_WALL_TIME:
+                    continue
+                ratio = float(now[metric]) / before[metric]
+                if ratio > 1 + threshold:
+                    regressions.append({
+                        'workload': workload,
+                        'stage': stage,
+                        'metric': metric,
+                        'baseline': before[metric],
+                        'current': now[metric],
+                        'ratio': round(ratio, 3)
+                    })
+
+    return regressions
+
+
+def _format_report(report):
+    lines = []
+    header = '%-14s %-28s %10s %12s %12s' % (
+        'workload', 'stage', 'wall (s)', 'rss (MB)', 'traced (MB)'
+    )
+    lines.append(header)
+    lines.append('-' * len(header))
+
+    mb = lambda value: '-' if value is None else '%.1f' % (value / 1048576.0)
+    for workload, stages in sorted(report['results'].items()):
+        for stage in STAGES:
+            record = stages[stage]
+            lines.append('%-14s %-28s %10.3f %12s %12s' % (
+                workload, stage, record['wall_time'],
+                mb(record.get('peak_rss')), mb(record.get('traced_peak'))
+            ))
+
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Runs the excelsior export benchmarks.'
+    )
+    parser.add_argument(
+        '-w', '--workload', action='append', dest='workloads',
+        choices=[name for name, _ in WORKLOADS],
+        help='Workload to run, repeat for several (all by default).'
+    )
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument(
+        '--no-trace-memory', action='store_false', dest='trace_memory',
+        help='Skip the tracemalloc pass.'
+    )
+    parser.add_argument('-o', '--output', help='Save results as JSON.')
+    parser.add_argument('-b', '--baseline', help='Baseline results JSON.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Allowed growth over the baseline, as a fraction.'
+    )
+    args = parser.parse_args(argv)
+
+    report = run(args.workloads, args.scale, args.repeat, args.trace_memory)
+    print(_format_report(report))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.threshold)
+
+        for regression in regressions:
+            print('REGRESSION %(workload)s/%(stage)s %(metric)s: '
+                  '%(baseline)s -> %(current)s (x%(ratio)s)' % regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+from excelsior.schema import WorkbookBuilder
+
+"""
+    Synthetic export workloads. Every workload builds a WorkbookBuilder
+        through Worksheet.write_row (and friends), `scale` multiplies the
+        amount of data so quick runs and big runs share the same shape.
+"""
+
+
+__all__ = [
+    'WORKLOADS', 'get_workload'
+]
+
+
+def tall(scale, image_server=None):
+    """ Many rows of a few plain columns. """
+    wb = WorkbookBuilder('tall.xlsx')
+    ws = wb.add_worksheet('Tall')
+    for row_idx in range(20000 * scale):
+        ws.write_row(
+            'row %d' % row_idx,
+            {'v': row_idx},
+            {'v': row_idx * 0.5},
+            'label %d' % (row_idx % 100),
+            {'v': row_idx % 2 == 0}
+        )
+    return wb
+
+
+def wide(scale, image_server=None):
+    """ Few rows of many columns. """
+    wb = WorkbookBuilder('wide.xlsx')
+    ws = wb.add_worksheet('Wide')
+    columns = 1000
+    for row_idx in range(100 * scale):
+        ws.write_row(*[
+            {'v': row_idx * columns + col_idx} for col_idx in range(columns)
+        ])
+    return wb
+
+
+def heavy_formats(scale, image_server=None):
+    """ Every cell formatted, many distinct (and duplicate) formats. """
+    wb = WorkbookBuilder('formats.xlsx')
+    keys = []
+    for idx in range(200):
+        key = 'format_%d' % idx
+        wb.add_format(key, {
+            'bold': idx % 2 == 0,
+            'font_color': '#%06x' % (idx % 50 * 4096),
+            'num_format': '0.%s' % ('0' * (idx % 4 + 1)),
+            'border': idx % 3
+        })
+        keys.append(key)
+
+    ws = wb.add_worksheet('Formats')
+    for row_idx in range(5000 * scale):
+        ws.write_row(*[
+            {'v': row_idx + col_idx, 'f': keys[(row_idx + col_idx) % len(keys)]}
+            for col_idx in range(8)
+        ])
+    return wb
+
+
+def formulas(scale, image_server=None):
+    """ Plain values with a computed column per row. """
+    wb = WorkbookBuilder('formulas.xlsx')
+    ws = wb.add_worksheet('Formulas')
+    rows = 10000 * scale
+    for row_idx in range(rows):
+        ws.write_row({'v': row_idx}, {'v': row_idx * 2})
+        ws.write_formula(row_idx, 2, '=A%d*B%d' % (row_idx + 1, row_idx + 1))
+    ws.write_formula_template(3, 0, rows - 1, '=C{row}+A{row}')
+    return wb
+
+
+def merged_cells(scale, image_server=None):
+    """ Section headers merged across columns and rows. """
+    wb = WorkbookBuilder('merged.xlsx')
+    wb.add_format('header', {'bold': True, 'align': 'center'})
+    ws = wb.add_worksheet('Merged')
+    for block in range(1000 * scale):
+        first_row = ws.current_row_idx
+        ws.write_merged_cell(
+            first_row, 0, first_row + 1, 5, 'Block %d' % block, 'header'
+        )
+        ws.write_empty_rows(2)
+        for row_idx in range(3):
+            ws.write_row(*['%d.%d.%d' % (block, row_idx, col_idx)
+                           for col_idx in range(6)])
+    return wb
+
+
+def hyperlinks(scale, image_server=None):
+    """ A link per row. """
+    wb = WorkbookBuilder('hyperlinks.xlsx')
+    ws = wb.add_worksheet('Links')
+    for row_idx in range(5000 * scale):
+        ws.write_row('item %d' % row_idx)
+        ws.write_hyperlink(
+            row_idx, 1, 'https://example.com/items/%d' % row_idx,
+            label='Item %d' % row_idx, tip='Open item %d' % row_idx
+        )
+    return wb
+
+
+def images(scale, image_server=None):
+    """ Rows with thumbnails served by the local image server. """
+    wb = WorkbookBuilder('images.xlsx')
+    ws = wb.add_worksheet('Images')
+    for row_idx in range(50 * scale):
+        ws.set_row_height(row_idx, 50)
+        ws.write_row('item %d' % row_idx)
+        # A fifth of the URLs repeat, exercising URL de-duplication
+        url = image_server.url('image_%d' % (row_idx % (40 * scale)))
+        ws.write_image(row_idx, 1, url)
+    return wb
+
+
+WORKLOADS = [
+    ('tall', tall),
+    ('wide', wide),
+    ('heavy_formats', heavy_formats),
+    ('formulas', formulas),
+    ('merged_cells', merged_cells),
+    ('hyperlinks', hyperlinks),
+    ('images', images),
+]
+
+
+def get_workload(name):
+    for workload_name, build in WORKLOADS:
+        if workload_name == name:
+            return build
+    raise KeyError(name)
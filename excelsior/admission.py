@@ -0,0 +1,319 @@
+import time
+import threading
+from contextlib import contextmanager
+
+import six
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .instrumentation import null_trace
+from .storage import CellStore, SpillingCellStore
+
+"""
+    Cost estimation and admission control for exports.
+    CostEstimator takes a cheap pass over a parsed schema and estimates
+        what rendering it takes (cells, string bytes, images, memory and
+        CPU time). An AdmissionController checks the estimate against
+        Budgets:
+            - within the per-request budget: the export proceeds, once the
+              gate lets it in (see AdmissionController.admit),
+            - past it but within the background budget: the export is
+              handed off to a background job, which waits at the gate
+              too before it renders,
+            - otherwise it's refused.
+    The gate caps the number of concurrent exports and the summed cost
+        of the ones in flight (the per-process budget), exports wait for
+        room up to `wait_timeout` seconds and are turned away after.
+"""
+
+
+__all__ = [
+    'PROCEED', 'BACKGROUND', 'REFUSE', 'ExportCost', 'CostEstimator',
+    'Budget', 'AdmissionController', 'ExportTooLarge', 'ExportBusy'
+]
+
+
+PROCEED = 'proceed'
+BACKGROUND = 'background'
+REFUSE = 'refuse'
+
+# Estimated metrics, in the order they're reported
+METRICS = ('cells', 'string_bytes', 'images', 'memory', 'cpu')
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class ExportTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Export exceeds the allowed size.'
+    default_code = 'export_too_large'
+
+
+class ExportBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many exports in progress, try again later.'
+    default_code = 'export_busy'
+
+
+class ExportCost(object):
+    """
+        Estimated cost of one export. memory is in bytes, cpu in seconds.
+        exact is False when part of the schema is parsed lazily and its
+            size was guessed from the request body size.
+    """
+    def __init__(self, cells=0, string_bytes=0, images=0, memory=0, cpu=0,
+                 exact=True):
+        self.cells = cells
+        self.string_bytes = string_bytes
+        self.images = images
+        self.memory = memory
+        self.cpu = cpu
+        self.exact = exact
+
+    def as_dict(self):
+        return dict((metric, getattr(self, metric)) for metric in METRICS)
+
+
+class CostEstimator(object):
+    """
+        Linear cost model over counts taken from the schema. The
+            coefficients are rough figures for constant_memory rendering,
+            measure your own workloads (see benchmarks/) and override
+            them in a subclass.
+    """
+    # Output buffer and XlsxWriter row data per cell
+    memory_per_cell = 64
+    # Inline strings end up in the XML twice (escaped, compressed)
+    memory_per_string_byte = 2
+    # Prefetched image bytes plus their copy in the zip
+    memory_per_image = 256 * 1024
+    cpu_per_cell = 12e-6
+    cpu_per_string_byte = 5e-9
+    cpu_per_image = 20e-3
+    # Guess for lazily parsed sections: JSON bytes per cell
+    body_bytes_per_cell = 32
+
+    def _count_cells(self, sheet):
+        """ Returns (cells, string bytes), None for lazy sections. """
+        cells = 0
+        string_bytes = 0
+
+        entries = sheet.get('cells')
+        if isinstance(entries, (CellStore, SpillingCellStore)):
+            cells += len(entries)
+        elif isinstance(entries, list):
+            cells += len(entries)
+            for cell in entries:
+                value = cell.get('value')
+                if isinstance(value, six.string_types):
+                    string_bytes += len(value)
+        elif entries is not None:
+            return None
+
+        data = sheet.get('data')
+        if data is not None:
+            rows = data.get('rows')
+            if not isinstance(rows, list):
+                return None
+
+            for values in rows:
+                cells += len(values)
+                for value in values:
+                    if isinstance(value, six.string_types):
+                        string_bytes += len(value)
+
+        for section in ('formulas', 'hyperlinks', 'merged_cells'):
+            cells += len(sheet.get(section) or ())
+
+        for template in sheet.get('formula_templates') or ():
+            cells += max(0, template['last_row'] - template['first_row'] + 1)
+
+        return cells, string_bytes
+
+    def estimate(self, schema, body_bytes=None):
+        """
+            ExportCost of the schema. `body_bytes`, the request body size,
+                stands in for worksheets parsed while they're written.
+        """
+        cost = ExportCost()
+
+        worksheets = schema.get('worksheets') or ()
+        if getattr(worksheets, 'streamed', False):
+            worksheets = ()
+            cost.exact = False
+
+        for sheet in worksheets:
+            cost.images += len(sheet.get('images') or ())
+
+            counts = self._count_cells(sheet)
+            if counts is None:
+                cost.exact = False
+                continue
+            cost.cells += counts[0]
+            cost.string_bytes += counts[1]
+
+        if not cost.exact and body_bytes:
+            cost.cells += body_bytes // self.body_bytes_per_cell
+            cost.string_bytes += body_bytes
+
+        cost.memory = int(
+            cost.cells * self.memory_per_cell
+            + cost.string_bytes * self.memory_per_string_byte
+            + cost.images * self.memory_per_image
+        )
+        cost.cpu = (
+            cost.cells * self.cpu_per_cell
+            + cost.string_bytes * self.cpu_per_string_byte
+            + cost.images * self.cpu_per_image
+        )
+
+        return cost
+
+
+class Budget(object):
+    """
+        Limits on ExportCost metrics, None means unlimited.
+    """
+    def __init__(self, cells=None, string_bytes=None, images=None,
+                 memory=None, cpu=None):
+        self.cells = cells
+        self.string_bytes = string_bytes
+        self.images = images
+        self.memory = memory
+        self.cpu = cpu
+
+    def exceeded(self, values):
+        """
+            (metric, value, limit) for every metric of the `values` dict
+                past its limit.
+        """
+        over = []
+        for metric in METRICS:
+            limit = getattr(self, metric)
+            if limit is not None and values[metric] > limit:
+                over.append((metric, values[metric], limit))
+        return over
+
+
+def _describe(over):
+    return ', '.join(
+        '%s %s > %s' % (metric, _round(value), _round(limit))
+        for metric, value, limit in over
+    )
+
+
+def _round(value):
+    return round(value, 3) if isinstance(value, float) else value
+
+
+class AdmissionController(object):
+    """
+        Decides what happens to an export and gates the ones that run.
+        `request_budget` bounds a single export rendered in the request,
+            `background_budget` the ones that can be handed off to
+            a background job instead (None: no background path).
+        `process_budget` bounds the summed cost of the exports running
+            at once, `max_concurrent` their number. An export past the
+            process budget on its own is never rendered in the request,
+            the others are let in one at a time when nothing else runs.
+        Share one controller between the views of a process.
+    """
+    def __init__(self, request_budget=None, process_budget=None,
+                 background_budget=None, max_concurrent=None,
+                 wait_timeout=30, estimator=None):
+        self.request_budget = request_budget or Budget()
+        self.process_budget = process_budget or Budget()
+        self.background_budget = background_budget
+        self.max_concurrent = max_concurrent
+        self.wait_timeout = wait_timeout
+        self.estimator = estimator or CostEstimator()
+
+        self.active = 0
+        self.in_flight = dict((metric, 0) for metric in METRICS)
+        # NOTE: A condition rather than a Semaphore, acquire() takes no
+        #   timeout on py2 and the gate weighs costs, not only slots
+        self._condition = threading.Condition()
+
+    def estimate(self, schema, body_bytes=None):
+        return self.estimator.estimate(schema, body_bytes)
+
+    def decide(self, cost):
+        """ PROCEED, BACKGROUND or REFUSE for the estimated cost. """
+        values = cost.as_dict()
+        if not (self.request_budget.exceeded(values)
+                or self.process_budget.exceeded(values)):
+            return PROCEED
+
+        if (self.background_budget is not None
+                and not self.background_budget.exceeded(values)):
+            return BACKGROUND
+
+        return REFUSE
+
+    def refuse(self, cost):
+        """ Raises ExportTooLarge naming the budgets the cost is past. """
+        values = cost.as_dict()
+        over = (self.request_budget.exceeded(values)
+                or self.process_budget.exceeded(values))
+        if self.background_budget is not None:
+            over = self.background_budget.exceeded(values) or over
+
+        raise ExportTooLarge(
+            'Export exceeds the allowed size: %s.' % _describe(over)
+        )
+
+    def _fits(self, values):
+        if self.active == 0:
+            return True
+
+        if self.max_concurrent is not None and self.active >= self.max_concurrent:
+            return False
+
+        total = dict(
+            (metric, self.in_flight[metric] + values[metric])
+            for metric in METRICS
+        )
+        return not self.process_budget.exceeded(total)
+
+    def _add(self, values, sign):
+        for metric in METRICS:
+            self.in_flight[metric] += sign * values[metric]
+
+    def _wait(self, values, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = _clock() + timeout
+
+        with self._condition:
+            while not self._fits(values):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - _clock()
+                    if remaining <= 0:
+                        raise ExportBusy()
+                self._condition.wait(remaining)
+
+            self.active += 1
+            self._add(values, 1)
+
+    @contextmanager
+    def admit(self, cost, trace=None, blocking=False):
+        """
+            Holds a slot of the gate for the block. Waits up to
+                wait_timeout seconds for the exports in flight to make
+                room, then raises ExportBusy. With `blocking` it waits as
+                long as it takes, for background jobs that hold no request.
+            The wait is traced as the `admission` phase, along with
+                the estimated cost.
+        """
+        values = cost.as_dict()
+        with (trace or null_trace).phase('admission', **values):
+            self._wait(values, None if blocking else self.wait_timeout)
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self._add(values, -1)
+                self._condition.notify_all()
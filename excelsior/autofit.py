@@ -0,0 +1,175 @@
+import re
+import datetime
+
+import six
+
+try:
+    from xlsxwriter.utility import xl_pixel_width
+except ImportError:  # XlsxWriter < 3.0.6
+    def xl_pixel_width(string):
+        return 7 * len(string)
+
+from .emission import (
+    DATA_ROW, CELL, STORED_CELL, SPILLED_CELL, FORMULA, HYPERLINK
+)
+
+"""
+    Single-pass column auto-fit.
+    ColumnWidths watches the emission stage (see emission.write_sheet_data)
+        and keeps the widest rendered value per column, taking the number
+        format of numbers and dates into account. Column widths are set
+        once the worksheet data is written, see builder.write_worksheet.
+"""
+
+
+__all__ = [
+    'ColumnWidths'
+]
+
+
+# Excel's own limit, in characters
+MAX_WIDTH = 255
+
+DEFAULT_DATE_TEXT = '2000-01-01'
+DEFAULT_DATETIME_TEXT = '2000-01-01 00:00:00'
+BOOLEAN_TEXT = 'FALSE'
+
+# Number format parts that don't show up as characters
+_format_markup = re.compile(r'\[[^\]]*\]|_.|\*.|\\|"')
+_number_placeholders = re.compile(r'[0#?]')
+_date_types = (datetime.date, datetime.time, datetime.timedelta)
+
+
+def _number_text(value, num_format):
+    """ Approximate text of a number shown with an Excel number format. """
+    section = _format_markup.sub('', num_format.split(';', 1)[0])
+    if '%' in section:
+        value *= 100
+
+    integer, _, fraction = section.partition('.')
+    decimals = len(_number_placeholders.findall(fraction))
+    pattern = '{:,.%df}' if ',' in integer else '{:.%df}'
+    try:
+        text = (pattern % decimals).format(value)
+    except (TypeError, ValueError):
+        text = six.text_type(value)
+
+    # Literal characters around the placeholders ($, %, units...)
+    literals = re.sub(r'[0#?,.]|[eE][+-]', '', section)
+    return text + literals
+
+
+def _date_text(value, num_format):
+    if num_format:
+        return _format_markup.sub('', num_format.split(';', 1)[0])
+    if isinstance(value, datetime.datetime):
+        return DEFAULT_DATETIME_TEXT
+    return DEFAULT_DATE_TEXT
+
+
+def _general_text(value):
+    if isinstance(value, float):
+        # General format shows up to 11 characters
+        return ('%.10g' % value)[:11]
+    return six.text_type(value)
+
+
+class ColumnWidths(object):
+    """
+        Widest value per column, in Excel character units.
+        `specs` maps format keys to schema format specs, their num_format,
+            bold and font_size are taken into account. Widths are capped
+            to min_width/max_width.
+    """
+    def __init__(self, specs, min_width=None, max_width=None):
+        self.specs = specs or {}
+        self.min_width = min_width
+        self.max_width = MAX_WIDTH if max_width is None else min(max_width, MAX_WIDTH)
+        self.pixels = {}
+        self._styles = {}
+
+    def _style(self, format_key):
+        style = self._styles.get(format_key)
+        if style is None:
+            spec = self.specs.get(format_key) or {}
+            scale = float(spec.get('font_size') or 11) / 11.0
+            if spec.get('bold'):
+                scale *= 1.1
+            style = (spec.get('num_format'), scale)
+            self._styles[format_key] = style
+        return style
+
+    def text(self, value, format_key=None):
+        """ Text the value is shown as, None for blanks. """
+        if value is None:
+            return None
+
+        num_format = self._style(format_key)[0]
+        if isinstance(value, six.string_types):
+            return value
+        if isinstance(value, bool):
+            return BOOLEAN_TEXT
+        if isinstance(value, _date_types):
+            return _date_text(value, num_format)
+        if isinstance(num_format, six.string_types) and num_format != 'General':
+            try:
+                return _number_text(float(value), num_format)
+            except (TypeError, ValueError):
+                pass
+
+        return _general_text(value)
+
+    def observe_value(self, col, value, format_key=None):
+        text = self.text(value, format_key)
+        if not text:
+            return
+
+        if '\n' in text:
+            text = max(text.split('\n'), key=len)
+
+        pixels = xl_pixel_width(text) * self._style(format_key)[1]
+        if pixels > self.pixels.get(col, 0):
+            self.pixels[col] = pixels
+
+    def observe(self, row, col, kind, idx, entry):
+        """ Emission stage callback, see emission.write_sheet_data. """
+        if kind == DATA_ROW:
+            values, row_formats, column_formats = entry
+            row_formats = row_formats or ()
+            for offset, value in enumerate(values):
+                if value is None:
+                    continue
+                format = row_formats[offset] if offset < len(row_formats) else None
+                if format is None and offset < len(column_formats):
+                    format = column_formats[offset]
+                self.observe_value(col + offset, value, format)
+        elif kind == CELL:
+            self.observe_value(col, entry['value'], entry.get('format'))
+        elif kind == STORED_CELL:
+            self.observe_value(col, entry.value_at(idx), entry.format_at(idx))
+        elif kind == SPILLED_CELL:
+            self.observe_value(col, entry[0], entry[1])
+        elif kind == HYPERLINK:
+            self.observe_value(
+                col, entry.get('label') or entry['url'], entry.get('format')
+            )
+        elif kind == FORMULA and entry.get('default_value') is not None:
+            self.observe_value(col, entry['default_value'], entry.get('format'))
+        # Merged ranges span columns, formula templates have no value yet
+
+    def width(self, col):
+        """ Column width in characters, None if nothing was observed. """
+        pixels = self.pixels.get(col)
+        if pixels is None:
+            return None
+
+        # Excel pads cells by 7 pixels, see Worksheet._pixels_to_width
+        pixels += 7
+        if pixels <= 12:
+            width = pixels / 12.0
+        else:
+            width = (pixels - 5) / 7.0
+
+        if self.min_width is not None:
+            width = max(width, self.min_width)
+        return round(min(width, self.max_width), 2)
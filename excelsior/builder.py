@@ -1,151 +1,284 @@
 import six
-from six.moves.urllib.request import urlopen
+
+from .autofit import ColumnWidths
+from .emission import write_sheet_data, count_sheet_rows
+from .images import prefetch_images
+from .formats import FormatRegistry
+from .instrumentation import null_trace, section_counts
+from .sharedstrings import InterningWorksheet, make_interner
+from .styles import split_styles, add_conditional_styles
 
 empty_dict = {}
 empty_list = []
 
-def create_sheet(wb, schema):
+
+def add_formats(wb, formats):
+    """
+        Registers schema formats with the workbook, returns format key to
+            XlsxWriter format mapping. Identical specs share one format and
+            formats are only added once something refers to them.
+    """
+    return FormatRegistry(wb, formats)
+
+
+def count_schema_rows(schema):
+    """
+        Total number of rows create_sheet reports progress against,
+            None when a worksheet streams its rows.
+    """
+    total = 0
+    for sheet in schema['worksheets']:
+        rows = count_sheet_rows(sheet)
+        if rows is None:
+            return None
+        total += rows
+
+    return total
+
+
+def create_sheet(wb, schema, image_cache=None, progress=None, trace=None,
+                 shared_strings=None):
     """
         This func builds real workisheets using actual exporting library
             and provided exporting schema.
+        Images are downloaded up front, see images.prefetch_images.
+        `progress` is called with the number of rows written so far
+            across all worksheets.
+        `trace` (an instrumentation.ExportTrace) gets `formats` and
+            `images` phase records, then a `create_sheet` one with entry
+            counts per worksheet section. XlsxWriter formats are added
+            as cells first use them, and images of streamed worksheets
+            are fetched as they're written, both within `create_sheet`.
+        Pass `shared_strings` (True or a dict of StringInterner options)
+            to write repeated strings as shared strings, see
+            excelsior.sharedstrings.
     """
+    if trace is None:
+        trace = null_trace
 
-    added_formats = {}
-    for format in schema['formats']:
-        added_formats[format] = wb.add_format(schema['formats'][format])
+    formats = schema.get('formats') or empty_dict
+    with trace.phase('formats', count=len(formats)):
+        added_formats = add_formats(wb, formats)
+    interner = make_interner(wb, shared_strings)
+    worksheets = schema['worksheets']
+    images = None
+    # NOTE: Streamed worksheets are read one at a time, their images
+    #   are fetched per worksheet
+    if not getattr(worksheets, 'streamed', False):
+        worksheets = list(worksheets)
+        with trace.phase('images') as images_record:
+            images = prefetch_images(worksheets, image_cache)
+            images_record['count'] = len(images)
 
-    for sheet in schema['worksheets']:
+    with trace.phase('create_sheet', worksheets=[]) as record:
+        rows_done = [0]
+        for sheet in worksheets:
+            sheet_progress = None
+            if progress is not None:
+                offset = rows_done[0]
+
+                def sheet_progress(rows, offset=offset):
+                    rows_done[0] = offset + rows
+                    progress(rows_done[0])
+
+            if trace is not null_trace:
+                record['worksheets'].append({
+                    'label': sheet['label'],
+                    'sections': section_counts(sheet)
+                })
+
+            write_worksheet(
+                wb, sheet, added_formats, images, sheet_progress,
+                interner=interner, image_cache=image_cache
+            )
+
+    return wb
+
+
+def _column_widths(sheet, added_formats):
+    """ ColumnWidths for the worksheet's `autofit` option, None if off. """
+    autofit = sheet.get('autofit')
+    # NOTE: An empty dict turns auto-fit on without bounds
+    if autofit is None or autofit is False:
+        return None
+
+    if autofit is True:
+        autofit = empty_dict
+    return ColumnWidths(
+        added_formats.specs,
+        autofit.get('min_width', None),
+        autofit.get('max_width', None)
+    )
+
+
+def _apply_column_widths(worksheet, sheet, widths, added_formats):
+    """
+        Sets the auto-fit widths, columns with an explicit width in the
+            schema keep it, the format and options of the others are kept.
+    """
+    columns = {}
+    for column in sheet.get('columns') or empty_list:
+        for col in range(column['first_col'], column['last_col'] + 1):
+            columns[col] = column
+
+    for col in sorted(widths.pixels):
+        column = columns.get(col, empty_dict)
+        if column.get('width', None) is not None:
+            continue
+
+        worksheet.set_column(
+            col,
+            col,
+            widths.width(col),
+            added_formats.get(column.get('format', None), None),
+            column.get('options', empty_dict)
+        )
+
+
+def write_worksheet(wb, sheet, added_formats, images=None, progress=None,
+                    write_data=True, worksheet_class=None, interner=None,
+                    image_cache=None):
+    """
+        Builds a single worksheet from its schema.
+        `images` maps image urls to prefetched bytes, they're fetched
+            here (through `image_cache`, see images.prefetch_images)
+            when not provided.
+        Pass write_data=False to leave out the row data (cells, formulas,
+            hyperlinks, merged ranges), see excelsior.parallel.
+        With the sheet's `autofit` option, column widths are measured
+            while the data is written, see autofit.ColumnWidths.
+        Strings picked by `interner` (a sharedstrings.StringInterner)
+            are written as shared strings.
+        The sheet's `styles` rules are applied while the data is written
+            or added as conditional formats after it, see excelsior.styles.
+    """
+    if interner is not None and worksheet_class is None:
+        worksheet_class = InterningWorksheet
+
+    if worksheet_class is None:
         worksheet = wb.add_worksheet(sheet['label'])
-        if 'columns' in sheet:
-            for column in sheet['columns']:
-                worksheet.set_column(
-                    column['first_col'],
-                    column['last_col'],
-                    column.get('width', None),
-                    added_formats.get(column.get('format', None), None),
-                    column.get('options', empty_dict)
-                )
-
-        if 'rows' in sheet:
-            for row in sheet['rows']:
-                worksheet.set_row(
-                    row['row'],
-                    row.get('height', None),
-                    added_formats.get(row.get('format', None), None),
-                    row.get('options', empty_dict)
-                )
-
-        for cell in sheet['cells']:
-            worksheet.write(
-                cell['row'],
-                cell['col'],
-                cell['value'],
-                added_formats.get(cell.get('format', None), None)
+    else:
+        worksheet = wb.add_worksheet(sheet['label'], worksheet_class)
+    if interner is not None:
+        worksheet.interner = interner
+    if 'rows' in sheet:
+        for row in sheet['rows']:
+            worksheet.set_row(
+                row['row'],
+                row.get('height', None),
+                added_formats.get(row.get('format', None), None),
+                row.get('options', empty_dict)
+            )
+
+    conditional_styles, styles = split_styles(
+        sheet.get('styles'), added_formats.specs
+    )
+    widths = None
+    if write_data:
+        widths = _column_widths(sheet, added_formats)
+        write_sheet_data(
+            worksheet, sheet, added_formats, progress,
+            observe=widths.observe if widths is not None else None,
+            styles=styles
+        )
+
+    # NOTE: Columns are set once the data is written, incrementally parsed
+    #   worksheets may bring them after their rows
+    if 'columns' in sheet:
+        for column in sheet['columns']:
+            worksheet.set_column(
+                column['first_col'],
+                column['last_col'],
+                column.get('width', None),
+                added_formats.get(column.get('format', None), None),
+                column.get('options', empty_dict)
+            )
+
+    if widths is not None:
+        _apply_column_widths(worksheet, sheet, widths, added_formats)
+
+    if conditional_styles:
+        add_conditional_styles(worksheet, conditional_styles, added_formats)
+
+    if 'images' in sheet:
+        if images is None:
+            images = prefetch_images([sheet], image_cache)
+
+        for img in sheet['images']:
+            url = img['url']
+            # NOTE: Copied, the schema's options may be shared between
+            #   images and must stay reusable
+            options = dict(img.get('options') or empty_dict)
+            image_data = options.get('image_data', None)
+            image_path = options.get('image_path', None)
+
+            if image_data is not None:
+                image_data = six.BytesIO(str(image_data.decode('base64')))
+            elif image_path is not None:
+                image_data = six.BytesIO(open(image_path, 'rb').read())
+            elif image_data is None and url:
+                image_data = images[url]
+                if isinstance(image_data, Exception):
+                    raise image_data
+                image_data = six.BytesIO(image_data)
+
+            options['image_data'] = image_data
+
+            worksheet.insert_image(
+                img['row'],
+                img['col'],
+                url,
+                options
             )
 
-        if 'formulas' in sheet:
-            for formula in sheet['formulas']:
-                worksheet.write_formula(
-                    formula['row'],
-                    formula['col'],
-                    formula['formula'],
-                    added_formats.get(formula.get('format', None), None),
-                    formula.get('default_value', 0)
-                )
-
-        if 'images' in sheet:
-            for img in sheet['images']:
-                url = img['url']
-                options = img.get('options', empty_dict)
-                image_data = options.get('image_data', None)
-                image_path = options.get('image_path', None)
-
-                if image_data is not None:
-                    image_data = six.BytesIO(str(image_data.decode('base64')))
-                elif image_path is not None:
-                    image_data = six.BytesIO(open(image_path, 'rb').read())
-                elif image_data is None and url:
-                    image_data = six.BytesIO(urlopen(url).read())
-
-                options['image_data'] = image_data
-
-                worksheet.insert_image(
-                    img['row'],
-                    img['col'],
-                    url,
-                    options
-                )
-
-        if 'hyperlinks' in sheet:
-            for hyperlink in sheet['hyperlinks']:
-                worksheet.write_url(
-                    hyperlink['row'],
-                    hyperlink['col'],
-                    hyperlink['url'],
-                    added_formats.get(hyperlink.get('format', None), None),
-                    hyperlink.get('label', None),
-                    hyperlink.get('tip', None)
-                )
-
-        if 'tables' in sheet:
-            for table in sheet['tables']:
-                options = table.get('options', empty_dict)
-                columns = options.get('columns', empty_list)
-
-                for column in columns:
-                    format = column.get('format', None)
-                    if format is not None:
-                        column['format'] = added_formats.get(format, None)
-
-                worksheet.add_table(
-                    table['first_row'],
-                    table['first_col'],
-                    table['last_row'],
-                    table['last_col'],
-                    options
-                )
-
-        if 'merged_cells' in sheet:
-            for merged in sheet['merged_cells']:
-                worksheet.merge_range(
-                    merged['first_row'],
-                    merged['first_col'],
-                    merged['last_row'],
-                    merged['last_col'],
-                    merged['data'],
-                    added_formats.get(merged.get('format', None), None),
-                )
-
-        if 'autofilter' in sheet:
-            atf = sheet['autofilter']
+    if 'tables' in sheet:
+        for table in sheet['tables']:
+            options = table.get('options', empty_dict)
+            columns = options.get('columns', empty_list)
+
+            for column in columns:
+                format = column.get('format', None)
+                if format is not None:
+                    column['format'] = added_formats.get(format, None)
+
+            worksheet.add_table(
+                table['first_row'],
+                table['first_col'],
+                table['last_row'],
+                table['last_col'],
+                options
+            )
+
+    if 'autofilter' in sheet:
+        atf = sheet['autofilter']
+        worksheet.autofilter(
+            atf['first_row'],
+            atf['first_col'],
+            atf['last_row'],
+            atf['last_col']
+        )
+
+    if 'autofilters' in sheet:
+        autofilters_list = sheet.get('autofilters') or []
+        for autofilter in autofilters_list:
             worksheet.autofilter(
-                atf['first_row'],
-                atf['first_col'],
-                atf['last_row'],
-                atf['last_col']
+                autofilter['first_row'],
+                autofilter['first_col'],
+                autofilter['last_row'],
+                autofilter['last_col']
             )
 
-        if 'autofilters' in sheet:
-            autofilters_list = sheet.get('autofilters') or []
-            for autofilter in autofilters_list:
-                worksheet.autofilter(
-                    autofilter['first_row'],
-                    autofilter['first_col'],
-                    autofilter['last_row'],
-                    autofilter['last_col']
-                )
-
-        if 'frozen_panes' in sheet:
-            frozen_panes_list = sheet.get('frozen_panes') or []
-            for pane in frozen_panes_list:
-                worksheet.freeze_panes(
-                    pane['row'],
-                    pane['col'],
-                    pane['top_row'],
-                    pane['left_col']
-                )
-
-        if 'zoom' in sheet:
-            worksheet.set_zoom(sheet.get('zoom'))
+    if 'frozen_panes' in sheet:
+        frozen_panes_list = sheet.get('frozen_panes') or []
+        for pane in frozen_panes_list:
+            worksheet.freeze_panes(
+                pane['row'],
+                pane['col'],
+                pane['top_row'],
+                pane['left_col']
+            )
 
-    return wb
+    if 'zoom' in sheet:
+        worksheet.set_zoom(sheet.get('zoom'))
+
+    return worksheet
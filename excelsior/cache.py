@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import six
+
+"""
+    Content-addressed cache of generated xlsx files.
+    The key is a hash of the canonicalized (validated) schema, so identical
+        export payloads are served without rendering the workbook again.
+    Backends implement get(key) -> file object or None
+        and set(key, file_object).
+"""
+
+
+__all__ = [
+    'schema_digest', 'FileResultCache', 'DjangoResultCache'
+]
+
+
+def schema_digest(schema):
+    """
+        Stable hash of the schema: keys sorted, no whitespace.
+    """
+    canonical = json.dumps(
+        schema, sort_keys=True, separators=(',', ':'), default=repr
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class FileResultCache(object):
+    """
+        Keeps files in a local directory. Entries older than `ttl` seconds
+            are misses, the oldest files are removed once the directory
+            grows past `max_bytes`.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.xlsx')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            return open(path, 'rb')
+        except (IOError, OSError):
+            return None
+
+    def set(self, key, file_object):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as cached:
+            shutil.copyfileobj(file_object, cached, self.chunk_size)
+        os.rename(temp_path, self._path(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.xlsx'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class DjangoResultCache(object):
+    """
+        Stores files in a Django cache. Files over `max_entry_bytes`
+            are not cached.
+    """
+    key_prefix = 'excelsior:export:'
+
+    def __init__(self, alias='default', ttl=3600, max_entry_bytes=10 * 1024 * 1024):
+        self.alias = alias
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        data = self.cache.get(self.key_prefix + key)
+        if data is None:
+            return None
+        return six.BytesIO(data)
+
+    def set(self, key, file_object):
+        data = file_object.read(self.max_entry_bytes + 1)
+        if len(data) > self.max_entry_bytes:
+            return
+        self.cache.set(self.key_prefix + key, data, self.ttl)
@@ -0,0 +1,192 @@
+import csv
+import datetime
+
+import six
+
+from .emission import (
+    iter_sheet_entries, DATA_ROW, FORMULA_TEMPLATE, CELL, STORED_CELL,
+    SPILLED_CELL, FORMULA, HYPERLINK, MERGED_PAD
+)
+from .schema import ExportError
+
+"""
+    Delimited text (CSV/TSV) rendering of export schemas.
+    One worksheet is streamed as text rows in row order, straight from the
+        emission stage's merged (row, col) stream, so entries resolve the
+        same way as in the xlsx: later kinds win on a shared spot. Only
+        values are kept:
+            - formats, images, tables and layout are ignored,
+            - formulas give their default value,
+            - hyperlinks give their label (or url),
+            - merged ranges give their data in the first cell, their other
+              cells are blank.
+    Skipped rows come out as empty lines, so line numbers match the
+        worksheet's rows.
+"""
+
+
+__all__ = [
+    'OUTPUT_FORMATS', 'iter_sheet_rows', 'iter_delimited', 'select_worksheet'
+]
+
+
+empty_list = []
+
+OUTPUT_FORMATS = {
+    'csv': ('excel', 'text/csv', '.csv'),
+    'tsv': ('excel-tab', 'text/tab-separated-values', '.tsv'),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return u'TRUE' if value else u'FALSE'
+    if isinstance(value, float):
+        # NOTE: str() rounds floats to 12 digits on py2
+        return repr(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _entry_value(kind, idx, entry):
+    if kind == CELL:
+        return entry['value']
+    if kind == STORED_CELL:
+        return entry.value_at(idx)
+    if kind == SPILLED_CELL:
+        return entry[0]
+    if kind == FORMULA:
+        return entry.get('default_value', 0)
+    if kind == FORMULA_TEMPLATE:
+        return entry.default_value
+    if kind == HYPERLINK:
+        return entry.get('label') or entry['url']
+    # Merged range head
+    return entry['data']
+
+
+def _put(values, col, value):
+    if value is None:
+        return
+
+    missing = col - len(values)
+    if missing >= 0:
+        values.extend([None] * missing)
+        values.append(value)
+    else:
+        values[col] = value
+
+
+def _blank(values, row, merged):
+    first_col = min(merged['first_col'], merged['last_col'])
+    last_col = max(merged['first_col'], merged['last_col'])
+    if row == min(merged['first_row'], merged['last_row']):
+        first_col += 1
+
+    for col in range(first_col, min(last_col + 1, len(values))):
+        values[col] = None
+
+
+def iter_sheet_rows(sheet):
+    """
+        Yields a list of cell values per worksheet row, from the first row
+            to the last written one, None for empty cells.
+    """
+    current_row = 0
+    values = []
+    for row, col, kind, idx, entry in iter_sheet_entries(sheet):
+        if row != current_row:
+            yield values
+            for _ in range(current_row + 1, row):
+                yield empty_list
+            current_row = row
+            values = []
+
+        if kind == DATA_ROW:
+            if not values and col == 0:
+                values = list(entry[0])
+                continue
+            for offset, value in enumerate(entry[0]):
+                _put(values, col + offset, value)
+        elif kind == MERGED_PAD:
+            _blank(values, row, entry)
+        else:
+            _put(values, col, _entry_value(kind, idx, entry))
+
+    if values or current_row > 0:
+        yield values
+
+
+class _Lines(object):
+    """ File-like target collecting what csv.writer writes. """
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.lines = []
+        self.size = 0
+
+    def write(self, line):
+        self.lines.append(line)
+        self.size += len(line)
+
+    def drain(self):
+        chunk = ''.join(self.lines)
+        self.lines = []
+        self.size = 0
+        # NOTE: py2 csv writes the bytes it's given
+        return chunk if six.PY2 else chunk.encode(self.encoding)
+
+
+def select_worksheet(schema, worksheet=None):
+    """
+        Worksheet schema of a schema (or WorkbookBuilder) by label or
+            index, the first one by default. Raises ExportError if there's
+            no such worksheet.
+    """
+    if isinstance(schema, dict):
+        worksheets = schema['worksheets']
+    else:
+        worksheets = (sheet.render_source() for sheet in schema.worksheets)
+
+    for sheet_idx, sheet in enumerate(worksheets):
+        if worksheet is None or worksheet == sheet_idx \
+                or worksheet == sheet['label']:
+            return sheet
+
+    raise ExportError('Worksheet %s does not exist.' % (worksheet,))
+
+
+def iter_delimited(schema, worksheet=None, output='csv', encoding='utf-8',
+                   chunk_size=CHUNK_SIZE):
+    """
+        Iterator over the worksheet as encoded CSV (or TSV, output='tsv')
+            in chunks of about `chunk_size` bytes. `schema` is an export
+            schema or a WorkbookBuilder, see select_worksheet.
+        The worksheet is looked up right away, so a missing one raises
+            ExportError here rather than once iteration has started.
+    """
+    dialect = OUTPUT_FORMATS[output][0]
+    sheet = select_worksheet(schema, worksheet)
+
+    return _iter_chunks(sheet, dialect, encoding, chunk_size)
+
+
+def _iter_chunks(sheet, dialect, encoding, chunk_size):
+    target = _Lines(encoding)
+    writer = csv.writer(target, dialect)
+    for values in iter_sheet_rows(sheet):
+        values = [_text(value) for value in values]
+        if six.PY2:
+            values = [
+                value.encode(encoding) if isinstance(value, six.text_type)
+                else value for value in values
+            ]
+        writer.writerow(values)
+
+        if target.size >= chunk_size:
+            yield target.drain()
+
+    if target.lines:
+        yield target.drain()
@@ -0,0 +1,439 @@
+import heapq
+from warnings import warn
+
+from xlsxwriter.exceptions import OverlappingRange
+from xlsxwriter.utility import xl_col_to_name, xl_range
+
+from .storage import CellStore, SpillingCellStore
+
+"""
+    Row-ordered emission stage.
+    XlsxWriter in constant_memory mode flushes a row as soon as a later
+        row is written, so everything that lands in a worksheet's row data
+        (data rows, cells, formulas, formula templates, hyperlinks, merged
+        ranges) has to arrive in row order. This module merges those schema sections into
+        a single (row, col)-sorted stream and writes it out.
+"""
+
+
+__all__ = [
+    'iter_sheet_entries', 'write_sheet_data', 'count_sheet_rows'
+]
+
+
+empty_list = []
+
+
+# Entry kinds. The numbers double as a tie breaker for entries sharing
+#   a coordinate, so the old "cells, formulas, hyperlinks, merged cells"
+#   write order (and its last-write-wins result) is kept. Columnar data
+#   rows go first, explicit entries override them. Merged ranges pad
+#   each of their rows from an event on their last column, after every
+#   other entry of the range's row (see _merged_events).
+DATA_ROW = 0
+FORMULA_TEMPLATE = 1
+CELL = 2
+STORED_CELL = 3
+SPILLED_CELL = 4
+FORMULA = 5
+HYPERLINK = 6
+MERGED = 7
+MERGED_PAD = 8
+
+
+def _is_sorted(entries, row_key, col_key):
+    previous = None
+    for entry in entries:
+        current = (entry[row_key], entry[col_key])
+        if previous is not None and current < previous:
+            return False
+        previous = current
+
+    return True
+
+
+def _decorate(entries, kind, row_key='row', col_key='col'):
+    for idx, entry in enumerate(entries):
+        yield (entry[row_key], entry[col_key], kind, idx, entry)
+
+
+def _ordered(entries, kind, row_key='row', col_key='col'):
+    """
+        Decorated stream of entries in (row, col) order. Sorts only when
+            the provided list is not already ordered.
+    """
+    stream = _decorate(entries, kind, row_key, col_key)
+    # NOTE: One-shot iterators (incrementally parsed cells) come in order
+    if not isinstance(entries, (list, tuple)):
+        return stream
+
+    if _is_sorted(entries, row_key, col_key):
+        return stream
+
+    return iter(sorted(stream))
+
+
+def _merged_events(merged_cells):
+    """
+        Splits merged ranges into a head event on the first cell and one
+            padding event per row, so a range spanning several rows doesn't
+            push the row pointer past rows still to be written.
+        Padding events sit on the range's last column: they come after
+            the other entries of the range's cells and blank them out, as
+            merge_range() used to when merged ranges were written last.
+    """
+    events = []
+    for idx, merged in enumerate(merged_cells):
+        first_row = min(merged['first_row'], merged['last_row'])
+        last_row = max(merged['first_row'], merged['last_row'])
+        first_col = min(merged['first_col'], merged['last_col'])
+        last_col = max(merged['first_col'], merged['last_col'])
+
+        events.append((first_row, first_col, MERGED, idx, merged))
+        for row in range(first_row, last_row + 1):
+            events.append((row, last_col, MERGED_PAD, idx, merged))
+
+    events.sort()
+    return iter(events)
+
+
+def _data_rows(data):
+    """
+        Stream of the columnar `data` block, one event per row array.
+    """
+    first_row = data.get('first_row', 0)
+    first_col = data.get('first_col', 0)
+    formats = data.get('formats') or empty_list
+    column_formats = data.get('column_formats') or empty_list
+    formats_count = len(formats)
+
+    for idx, values in enumerate(data['rows']):
+        row_formats = formats[idx] if idx < formats_count else None
+        yield (first_row + idx, first_col, DATA_ROW, idx,
+               (values, row_formats, column_formats))
+
+
+class FormulaTemplate(object):
+    """
+        Compiled formula template: `{row}` is replaced with the Excel row
+            number of the cell being written, `{col}` with the template
+            column letters.
+    """
+    __slots__ = ('parts', 'format', 'default_value')
+
+    def __init__(self, template, col, format=None, default_value=0):
+        self.parts = template.replace('{col}', xl_col_to_name(col)).split('{row}')
+        self.format = format
+        self.default_value = default_value
+
+    def with_format(self, format):
+        """ Copy of the template writing with another format. """
+        template = FormulaTemplate.__new__(FormulaTemplate)
+        template.parts = self.parts
+        template.format = format
+        template.default_value = self.default_value
+        return template
+
+    def render(self, row):
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return str(row + 1).join(self.parts)
+
+
+def _formula_template_rows(idx, entry):
+    """
+        Stream of one formula template, expanded lazily row by row.
+        idx is the template's position: templates covering the same
+            cells are merged in that order, never compared.
+    """
+    template = FormulaTemplate(
+        entry['template'],
+        entry['col'],
+        entry.get('format', None),
+        entry.get('default_value', 0)
+    )
+    col = entry['col']
+    for row in range(entry['first_row'], entry['last_row'] + 1):
+        yield (row, col, FORMULA_TEMPLATE, idx, template)
+
+
+def iter_sheet_entries(sheet):
+    """
+        Yields (row, col, kind, idx, entry) tuples for every row-data entry
+            of the worksheet schema, in (row, col) order.
+        Uses a k-way merge of the per-section streams.
+    """
+    streams = []
+
+    if sheet.get('data'):
+        streams.append(_data_rows(sheet['data']))
+
+    cells = sheet.get('cells')
+    if isinstance(cells, CellStore):
+        if len(cells) > 0:
+            streams.append(cells.iter_ordered(STORED_CELL))
+    elif isinstance(cells, SpillingCellStore):
+        if len(cells) > 0:
+            streams.append(cells.iter_ordered(SPILLED_CELL))
+    elif cells:
+        streams.append(_ordered(cells, CELL))
+
+    if sheet.get('formulas'):
+        streams.append(_ordered(sheet['formulas'], FORMULA))
+
+    for idx, entry in enumerate(sheet.get('formula_templates') or empty_list):
+        streams.append(_formula_template_rows(idx, entry))
+
+    if sheet.get('hyperlinks'):
+        streams.append(_ordered(sheet['hyperlinks'], HYPERLINK))
+
+    if sheet.get('merged_cells'):
+        streams.append(_merged_events(sheet['merged_cells']))
+
+    if len(streams) < 2:
+        return streams[0] if streams else iter(empty_list)
+
+    return heapq.merge(*streams)
+
+
+def _write_data_row(worksheet, row, col, idx, entry, formats):
+    values, row_formats, column_formats = entry
+
+    if not row_formats and not column_formats:
+        worksheet.write_row(row, col, values)
+        return
+
+    row_formats = row_formats or empty_list
+    row_formats_count = len(row_formats)
+    column_formats_count = len(column_formats)
+    for idx, value in enumerate(values):
+        format = row_formats[idx] if idx < row_formats_count else None
+        # NOTE: Column defaults apply to values only, empty cells stay empty
+        if format is None and value is not None and idx < column_formats_count:
+            format = column_formats[idx]
+
+        worksheet.write(row, col + idx, value, formats.get(format, None))
+
+
+def _write_cell(worksheet, row, col, idx, cell, formats):
+    worksheet.write(
+        row,
+        col,
+        cell['value'],
+        formats.get(cell.get('format', None), None)
+    )
+
+
+def _write_stored_cell(worksheet, row, col, idx, store, formats):
+    worksheet.write(
+        row,
+        col,
+        store.value_at(idx),
+        formats.get(store.format_at(idx), None)
+    )
+
+
+def _write_spilled_cell(worksheet, row, col, idx, cell, formats):
+    value, format = cell
+    worksheet.write(row, col, value, formats.get(format, None))
+
+
+def _write_formula(worksheet, row, col, idx, formula, formats):
+    worksheet.write_formula(
+        row,
+        col,
+        formula['formula'],
+        formats.get(formula.get('format', None), None),
+        formula.get('default_value', 0)
+    )
+
+
+def _write_formula_template(worksheet, row, col, idx, template, formats):
+    worksheet.write_formula(
+        row,
+        col,
+        template.render(row),
+        formats.get(template.format, None),
+        template.default_value
+    )
+
+
+def _write_hyperlink(worksheet, row, col, idx, hyperlink, formats):
+    worksheet.write_url(
+        row,
+        col,
+        hyperlink['url'],
+        formats.get(hyperlink.get('format', None), None),
+        hyperlink.get('label', None),
+        hyperlink.get('tip', None)
+    )
+
+
+def _merged_range(merged):
+    return (
+        min(merged['first_row'], merged['last_row']),
+        min(merged['first_col'], merged['last_col']),
+        max(merged['first_row'], merged['last_row']),
+        max(merged['first_col'], merged['last_col'])
+    )
+
+
+def _claim_merged_range(worksheet, first_row, first_col, last_row, last_col):
+    """
+        merge_range()'s checks and bookkeeping without its writes: False
+            for ranges it would skip (single cells, out of bounds), raises
+            OverlappingRange for ranges overlapping a merged range or
+            a table.
+    """
+    if first_row == last_row and first_col == last_col:
+        warn("Can't merge single cell")
+        return False
+
+    if worksheet._check_dimensions(first_row, first_col) \
+            or worksheet._check_dimensions(last_row, last_col):
+        return False
+
+    cell_range = xl_range(first_row, first_col, last_row, last_col)
+    for row in range(first_row, last_row + 1):
+        for col in range(first_col, last_col + 1):
+            previous_range = worksheet.merged_cells.get((row, col))
+            if previous_range:
+                raise OverlappingRange(
+                    "Merge range '%s' overlaps previous merge range '%s'."
+                    % (cell_range, previous_range)
+                )
+
+            previous_range = worksheet.table_cells.get((row, col))
+            if previous_range:
+                raise OverlappingRange(
+                    "Merge range '%s' overlaps previous table range '%s'."
+                    % (cell_range, previous_range)
+                )
+
+            worksheet.merged_cells[(row, col)] = cell_range
+
+    worksheet.merge.append([first_row, first_col, last_row, last_col])
+    return True
+
+
+def _write_merged(worksheet, row, col, idx, merged, formats):
+    # NOTE: merge_range() pads every row of the range at once, which
+    #   flushes the first row in constant_memory mode. The range is
+    #   checked and registered here, its rows are padded from their
+    #   own events.
+    if not _claim_merged_range(worksheet, *_merged_range(merged)):
+        return
+
+    worksheet.write(
+        row, col, merged['data'], formats.get(merged.get('format', None), None)
+    )
+
+
+def _write_merged_pad(worksheet, row, col, idx, merged, formats):
+    first_row, first_col, last_row, last_col = _merged_range(merged)
+    # Skipped ranges are not registered
+    if worksheet.merged_cells.get((row, first_col)) != xl_range(
+            first_row, first_col, last_row, last_col):
+        return
+
+    format = formats.get(merged.get('format', None), None)
+    if row == first_row:
+        first_col += 1
+    for pad_col in range(first_col, last_col + 1):
+        worksheet.write_blank(row, pad_col, None, format)
+
+
+_writers = {
+    DATA_ROW: _write_data_row,
+    CELL: _write_cell,
+    STORED_CELL: _write_stored_cell,
+    SPILLED_CELL: _write_spilled_cell,
+    FORMULA: _write_formula,
+    FORMULA_TEMPLATE: _write_formula_template,
+    HYPERLINK: _write_hyperlink,
+    MERGED: _write_merged,
+    MERGED_PAD: _write_merged_pad,
+}
+
+
+def count_sheet_rows(sheet):
+    """
+        Number of rows the worksheet data spans (last row + 1), None when
+            it can't be known up front (streamed data rows).
+    """
+    last_row = -1
+
+    data = sheet.get('data')
+    if data:
+        if not isinstance(data['rows'], (list, tuple)):
+            return None
+        last_row = data.get('first_row', 0) + len(data['rows']) - 1
+
+    cells = sheet.get('cells')
+    if isinstance(cells, (CellStore, SpillingCellStore)):
+        last_row = max(last_row, cells.max_row())
+    elif cells:
+        last_row = max(last_row, max(cell['row'] for cell in cells))
+
+    for section in ('formulas', 'hyperlinks'):
+        for entry in sheet.get(section) or empty_list:
+            if entry['row'] > last_row:
+                last_row = entry['row']
+
+    for entry in sheet.get('formula_templates') or empty_list:
+        last_row = max(last_row, entry['last_row'])
+
+    for merged in sheet.get('merged_cells') or empty_list:
+        last_row = max(last_row, merged['first_row'], merged['last_row'])
+
+    return last_row + 1
+
+
+def _observing(writers, observe):
+    """ Writers that report every written entry to `observe`. """
+    def wrap(kind, writer):
+        def write(worksheet, row, col, idx, entry, formats):
+            writer(worksheet, row, col, idx, entry, formats)
+            observe(row, col, kind, idx, entry)
+        return write
+
+    return dict((kind, wrap(kind, writer)) for kind, writer in writers.items())
+
+
+def write_sheet_data(worksheet, sheet, formats, progress=None,
+                     progress_every=1000, observe=None, styles=None):
+    """
+        Writes data rows, cells, formulas, hyperlinks and merged ranges
+            of the worksheet schema in row order.
+        `progress` is called with the number of rows done so far
+            (last written row + 1) every `progress_every` rows
+            and once at the end.
+        `observe` is called with every written (row, col, kind, idx,
+            entry), see autofit.ColumnWidths.
+        `styles` (a styles.StyleRules) fills in the formats of entries
+            written without one.
+    """
+    writers = _writers
+    if observe is not None:
+        writers = _observing(writers, observe)
+    entries = iter_sheet_entries(sheet)
+    if styles is not None:
+        entries = styles.restyle(entries)
+    if progress is None:
+        for row, col, kind, idx, entry in entries:
+            writers[kind](worksheet, row, col, idx, entry, formats)
+
+        return worksheet
+
+    next_report = progress_every
+    last_row = -1
+    for row, col, kind, idx, entry in entries:
+        writers[kind](worksheet, row, col, idx, entry, formats)
+        if row >= next_report:
+            progress(row)
+            next_report = row + progress_every
+        last_row = row
+
+    progress(last_row + 1)
+
+    return worksheet
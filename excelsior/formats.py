@@ -0,0 +1,151 @@
+import json
+import threading
+from collections import OrderedDict
+
+import six
+
+"""
+    Format registry for builder.create_sheet.
+    Schema format specs are canonicalized, so keys with identical specs
+        share a single XlsxWriter format, and formats are only added to
+        the workbook once a cell, row, column or table refers to them.
+    Normalized specs are cached process wide, repeated exports with the
+        same formats skip normalization entirely.
+"""
+
+
+__all__ = [
+    'FormatRegistry', 'NormalizedFormats', 'normalize_spec'
+]
+
+
+SPEC_CACHE_SIZE = 1024
+
+_spec_cache = OrderedDict()
+_spec_cache_lock = threading.Lock()
+
+
+def _normalize_value(key, value):
+    if isinstance(value, six.string_types) and key.endswith('color'):
+        # '#ff0000' and '#FF0000' are the same color
+        return value.upper() if value.startswith('#') else value.lower()
+    return value
+
+
+def normalize_spec(spec):
+    """
+        Returns (canonical key, XlsxWriter properties) for a format spec.
+        Results are cached process wide.
+    """
+    raw_key = json.dumps(spec, sort_keys=True, separators=(',', ':'), default=repr)
+
+    with _spec_cache_lock:
+        cached = _spec_cache.pop(raw_key, None)
+        if cached is not None:
+            _spec_cache[raw_key] = cached
+            return cached
+
+    properties = dict(
+        (key, _normalize_value(key, value))
+        for key, value in six.iteritems(spec or {})
+        if value is not None
+    )
+    canonical_key = json.dumps(
+        properties, sort_keys=True, separators=(',', ':'), default=repr
+    )
+    normalized = (canonical_key, properties)
+
+    with _spec_cache_lock:
+        _spec_cache[raw_key] = normalized
+        while len(_spec_cache) > SPEC_CACHE_SIZE:
+            _spec_cache.popitem(last=False)
+
+    return normalized
+
+
+class NormalizedFormats(dict):
+    """
+        Format specs with their normalize_spec results computed up front,
+            for formats reused across exports (see excelsior.templates).
+            FormatRegistry takes them as they are.
+    """
+    def __init__(self, formats):
+        super(NormalizedFormats, self).__init__(formats)
+        self.normalized = dict(
+            (key, normalize_spec(spec)) for key, spec in six.iteritems(formats)
+        )
+
+
+class FormatRegistry(object):
+    """
+        Maps schema format keys to XlsxWriter formats of one workbook.
+        Behaves like the plain {key: Format} dict it replaces: get(key)
+            returns None for None and for unknown keys.
+    """
+    def __init__(self, wb, formats):
+        self.wb = wb
+        self.specs = formats
+        self._keys = dict(getattr(formats, 'normalized', ()))
+        self._formats = {}
+        self._resolved = {}
+
+    def _normalized(self, key):
+        normalized = self._keys.get(key)
+        if normalized is None:
+            normalized = normalize_spec(self.specs[key])
+            self._keys[key] = normalized
+        return normalized
+
+    def get(self, key, default=None):
+        format = self._resolved.get(key)
+        if format is not None:
+            return format
+
+        if key is None or key not in self.specs:
+            return default
+
+        canonical_key, properties = self._normalized(key)
+        format = self._formats.get(canonical_key)
+        if format is None:
+            # XlsxWriter may alter the dict it's given
+            format = self.wb.add_format(dict(properties))
+            self._formats[canonical_key] = format
+
+        self._resolved[key] = format
+        return format
+
+    def resolve_all(self, dxf_keys=(), keys=None, url_format=True):
+        """
+            Adds the `keys` formats (every format by default), in key
+                order, and fixes their XF index, the DXF index of the
+                `dxf_keys` formats (the ones conditional formats use) and,
+                with `url_format`, the XF index of the workbook's
+                hyperlink format.
+            Workbooks built separately from the same keys end up with
+                the same cell style indices, see excelsior.parallel.
+                Other formats are still added as they're first used,
+                after those.
+        """
+        if keys is None:
+            keys = self.specs
+        for key in sorted(key for key in keys if key in self.specs):
+            self.get(key)._get_xf_index()
+
+        for key in sorted(dxf_keys):
+            self.get(key)._get_dxf_index()
+
+        # Hyperlinks written without a format use the workbook's own
+        default_url_format = getattr(self.wb, 'default_url_format', None)
+        if url_format and default_url_format is not None:
+            default_url_format._get_xf_index()
+
+        return self
+
+    def __getitem__(self, key):
+        format = self.get(key)
+        if format is None:
+            raise KeyError(key)
+        return format
+
+    def __contains__(self, key):
+        return key in self.specs
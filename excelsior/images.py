@@ -0,0 +1,174 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from six.moves.urllib.request import urlopen
+
+"""
+    Image prefetching for builder.create_sheet.
+    Every image URL of the workbook is collected up front, de-duplicated
+        and fetched concurrently with a bounded pool and per-request
+        timeouts. Results go to a size-bounded LRU cache shared by all
+        exports of the process, optionally spilling evicted images to disk.
+"""
+
+
+__all__ = [
+    'ImageCache', 'default_cache', 'collect_image_urls', 'prefetch_images'
+]
+
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 10
+
+
+class ImageCache(object):
+    """
+        Thread-safe LRU cache of image bytes bounded by `max_bytes`.
+        With `spill_dir` set, evicted images are written there and read
+            back on a later miss instead of being fetched again.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _spill_path(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, digest)
+
+    def get(self, url):
+        with self._lock:
+            data = self._entries.pop(url, None)
+            if data is not None:
+                self._entries[url] = data
+                return data
+
+        if self.spill_dir is not None:
+            try:
+                with open(self._spill_path(url), 'rb') as spilled:
+                    data = spilled.read()
+            except (IOError, OSError):
+                return None
+            self.set(url, data)
+
+        return data
+
+    def set(self, url, data):
+        if len(data) > self.max_bytes:
+            self._spill(url, data)
+            return
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            self._entries[url] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                evicted_url, evicted_data = self._entries.popitem(last=False)
+                self.size -= len(evicted_data)
+                evicted.append((evicted_url, evicted_data))
+
+        for evicted_url, evicted_data in evicted:
+            self._spill(evicted_url, evicted_data)
+
+    def _spill(self, url, data):
+        if self.spill_dir is None:
+            return
+
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+
+        with open(self._spill_path(url), 'wb') as spilled:
+            spilled.write(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+# Shared by every export in the process
+default_cache = ImageCache()
+
+
+def collect_image_urls(worksheets):
+    """
+        Unique URLs of images that have to be downloaded, in schema order.
+    """
+    urls = OrderedDict()
+    for sheet in worksheets:
+        for img in sheet.get('images') or []:
+            options = img.get('options') or {}
+            if options.get('image_data') is not None:
+                continue
+            if options.get('image_path') is not None:
+                continue
+            if img.get('url'):
+                urls[img['url']] = True
+
+    return list(urls.keys())
+
+
+def _fetch(args):
+    url, timeout, opener = args
+    try:
+        response = opener(url, timeout=timeout)
+        try:
+            return url, response.read(), None
+        finally:
+            response.close()
+    except Exception as e:
+        return url, None, e
+
+
+def prefetch_images(worksheets, cache=None, pool_size=DEFAULT_POOL_SIZE,
+                    timeout=DEFAULT_TIMEOUT, opener=urlopen):
+    """
+        Fetches every image of the worksheets that is not cached yet.
+        Returns an url -> bytes mapping; urls that failed map to
+            the raised exception, so the export fails the way
+            a direct urlopen() would.
+    """
+    cache = default_cache if cache is None else cache
+    images = {}
+    missing = []
+
+    for url in collect_image_urls(worksheets):
+        data = cache.get(url)
+        if data is None:
+            missing.append(url)
+        else:
+            images[url] = data
+
+    if not missing:
+        return images
+
+    jobs = [(url, timeout, opener) for url in missing]
+    if len(jobs) == 1:
+        results = [_fetch(jobs[0])]
+    else:
+        pool = ThreadPool(min(pool_size, len(jobs)))
+        try:
+            results = pool.map(_fetch, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    for url, data, error in results:
+        if error is not None:
+            images[url] = error
+            continue
+
+        cache.set(url, data)
+        images[url] = data
+
+    return images
@@ -0,0 +1,55 @@
+"""
+    Coordinate lookups for indexed worksheets, see schema.Worksheet.
+    Single cells are looked up in plain {(row, col): position} dicts,
+        ranges (merged cells) in a RangeIndex.
+"""
+
+
+__all__ = [
+    'RangeIndex'
+]
+
+
+class RangeIndex(object):
+    """
+        Rectangles bucketed by blocks of `block_rows` rows: a range is
+            listed in every block it spans, so point and overlap queries
+            only test the ranges of the blocks they touch.
+    """
+    def __init__(self, block_rows=64):
+        self.block_rows = block_rows
+        self.ranges = {}
+        self._blocks = {}
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def _block_span(self, first_row, last_row):
+        return range(first_row // self.block_rows,
+                     last_row // self.block_rows + 1)
+
+    def add(self, key, first_row, first_col, last_row, last_col):
+        self.ranges[key] = (first_row, first_col, last_row, last_col)
+        for block in self._block_span(first_row, last_row):
+            self._blocks.setdefault(block, []).append(key)
+
+    def find(self, row, col):
+        """ Key of a range containing the cell, None if there's none. """
+        for key in self._blocks.get(row // self.block_rows, ()):
+            first_row, first_col, last_row, last_col = self.ranges[key]
+            if first_row <= row <= last_row and first_col <= col <= last_col:
+                return key
+
+        return None
+
+    def overlapping(self, first_row, first_col, last_row, last_col):
+        """ Keys of the ranges overlapping the rectangle, in add order. """
+        keys = set()
+        for block in self._block_span(first_row, last_row):
+            for key in self._blocks.get(block, ()):
+                other = self.ranges[key]
+                if (other[0] <= last_row and first_row <= other[2]
+                        and other[1] <= last_col and first_col <= other[3]):
+                    keys.add(key)
+
+        return sorted(keys)
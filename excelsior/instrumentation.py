@@ -0,0 +1,134 @@
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+"""
+    Per-phase export instrumentation.
+    An ExportTrace collects one record per export phase (parsing,
+        create_sheet, closing the workbook, ...):
+            {'name', 'duration', 'peak_memory_delta', ...phase details}
+        and hands each record to its hooks once the phase is over.
+    Tracing is opt-in, without a trace the export code goes through
+        null_trace, whose phases cost a context manager and a dict.
+"""
+
+
+__all__ = [
+    'ExportTrace', 'null_trace', 'peak_rss', 'section_counts'
+]
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# Worksheet sections that hold one entry per written cell (or range)
+COUNTED_SECTIONS = (
+    'cells', 'data', 'formulas', 'formula_templates', 'hyperlinks',
+    'merged_cells', 'images'
+)
+
+
+def peak_rss():
+    """
+        High-water mark of the process resident set in bytes,
+            None where it's not available.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _count(entries):
+    try:
+        return len(entries)
+    except TypeError:
+        # Lazily parsed or generated, unknown before it's written
+        return None
+
+
+def section_counts(sheet):
+    """
+        Number of entries per worksheet section, None for sections
+            that are consumed lazily. `data` counts rows.
+    """
+    counts = {}
+    for section in COUNTED_SECTIONS:
+        entries = sheet.get(section)
+        if entries is None:
+            continue
+        if section == 'data':
+            entries = entries.get('rows')
+        counts[section] = _count(entries)
+
+    return counts
+
+
+class ExportTrace(object):
+    """
+        Collects phase records of one export. `hooks` are called with
+            every record as soon as its phase ends.
+        peak_memory_delta is how far the phase pushed the process RSS
+            high-water mark, 0 when it stayed under an earlier peak.
+    """
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name, **details):
+        """
+            Times the block, the yielded record takes extra details.
+
+            Example:
+                with trace.phase('close') as record:
+                    workbook.close()
+                    record['bytes_out'] = file_object.tell()
+        """
+        record = {
+            'name': name,
+            'duration': None,
+            'peak_memory_delta': None
+        }
+        record.update(details)
+
+        rss_before = peak_rss()
+        start = _clock()
+        try:
+            yield record
+        finally:
+            record['duration'] = _clock() - start
+            if rss_before is not None:
+                record['peak_memory_delta'] = peak_rss() - rss_before
+
+            self.phases.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def get(self, name):
+        for record in self.phases:
+            if record['name'] == name:
+                return record
+        return None
+
+    def server_timing(self):
+        """ Server-Timing header value, durations in milliseconds. """
+        return ', '.join(
+            '%s;dur=%.1f' % (record['name'], record['duration'] * 1000)
+            for record in self.phases
+        )
+
+
+class _NullTrace(object):
+    @contextmanager
+    def phase(self, name, **details):
+        yield {}
+
+
+null_trace = _NullTrace()
@@ -0,0 +1,239 @@
+import os
+import time
+import uuid
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .builder import count_schema_rows
+
+"""
+    Asynchronous export jobs.
+    A job backend takes a validated schema, renders it outside of the
+        request thread and keeps track of progress (rows written out of
+        total). Clients poll the job, cancel it or download the result.
+    LocalJobBackend runs jobs on an in-process worker pool, no broker
+        needed. Other backends (a process pool, a task queue) only have
+        to implement submit/get/cancel/open_result/discard.
+    submit() takes an optional `admit` callable returning a context manager
+        (an admission.AdmissionController gate), jobs render inside it.
+    NOTE: LocalJobBackend keeps its jobs in the memory of one process. With
+        several server processes (gunicorn/uWSGI workers) a poll landing
+        on another process than the one the job was submitted to gets
+        a 404, use a shared backend or sticky routing there.
+"""
+
+
+__all__ = [
+    'ExportJob', 'JobCancelled', 'LocalJobBackend', 'get_default_backend'
+]
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ExportJob(object):
+    def __init__(self, filename, rows_total=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = PENDING
+        self.rows_written = 0
+        self.rows_total = rows_total
+        self.error = None
+        self.path = None
+        self.cancel_requested = False
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_written': self.rows_written,
+            'rows_total': self.rows_total,
+            'error': self.error
+        }
+
+
+class LocalJobBackend(object):
+    """
+        Runs export jobs on a pool of `pool_size` workers of the current
+            process, files are written to `directory` (the system temp
+            dir by default).
+        Finished jobs are dropped, their files removed, `ttl` seconds
+            after they finish, and the oldest finished ones first when
+            there are more than `max_jobs` jobs. None disables either.
+        NOTE: Workers are threads (`pool_class`, ThreadPool by default):
+            jobs report progress and get cancelled through ExportJob
+            objects shared with the request threads. Their rendering
+            competes with the requests for the GIL though. Set
+            `render_processes` to render the worksheets of multi-sheet
+            exports on that many processes (see excelsior.parallel), or
+            swap `pool_class` for another in-process pool with the same
+            apply_async() (e.g. a gevent pool). Process pools can't run
+            jobs, they would update copies of the jobs.
+    """
+    pool_class = ThreadPool
+
+    def __init__(self, pool_size=2, directory=None, ttl=3600, max_jobs=1000,
+                 render_processes=None, pool_class=None):
+        self.pool_size = pool_size
+        self.directory = directory
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.render_processes = render_processes
+        if pool_class is not None:
+            self.pool_class = pool_class
+        self.jobs = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self.pool_class(self.pool_size)
+            return self._pool
+
+    def expire(self):
+        """ Drops the finished jobs past `ttl` or `max_jobs`. """
+        with self._lock:
+            finished = sorted(
+                (job for job in self.jobs.values() if job.finished),
+                key=lambda job: job.finished_at
+            )
+
+            expired = []
+            if self.ttl is not None:
+                deadline = time.time() - self.ttl
+                while finished and finished[0].finished_at <= deadline:
+                    expired.append(finished.pop(0))
+
+            if self.max_jobs is not None:
+                excess = len(self.jobs) - len(expired) - self.max_jobs
+                if excess > 0:
+                    expired.extend(finished[:excess])
+
+            for job in expired:
+                del self.jobs[job.id]
+
+        for job in expired:
+            self._remove_file(job)
+
+    def submit(self, schema, admit=None):
+        self.expire()
+
+        job = ExportJob(schema['filename'], count_schema_rows(schema))
+        with self._lock:
+            self.jobs[job.id] = job
+        self.pool.apply_async(self._run, (job, schema, admit))
+
+        return job
+
+    def get(self, job_id):
+        self.expire()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        job.cancel_requested = True
+        if job.status == PENDING:
+            job.finish(CANCELLED)
+
+        return job
+
+    def open_result(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status != DONE:
+            return None
+
+        return open(job.path, 'rb')
+
+    def discard(self, job_id):
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel_requested = True
+            self._remove_file(job)
+
+        return job
+
+    def _remove_file(self, job):
+        if job.path is not None and os.path.exists(job.path):
+            os.remove(job.path)
+
+    def _run(self, job, schema, admit=None):
+        if admit is None:
+            return self._render(job, schema)
+
+        # NOTE: The job stays pending while it waits at the gate. _render
+        #   records its own errors, those of the gate would be lost in
+        #   the pool
+        try:
+            with admit():
+                self._render(job, schema)
+        except Exception as e:
+            job.error = str(e)
+            job.finish(FAILED)
+
+    def _render(self, job, schema):
+        # Avoid circular import, views import this module
+        from .views import write_schema_to_file_object
+
+        if job.cancel_requested:
+            job.finish(CANCELLED)
+            return
+
+        job.status = RUNNING
+
+        def progress(rows_written):
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.rows_written = rows_written
+
+        handle, job.path = tempfile.mkstemp(suffix='.xlsx', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'w+b') as file_object:
+                write_schema_to_file_object(
+                    schema, file_object, in_memory=False, progress=progress,
+                    processes=self.render_processes
+                )
+        except JobCancelled:
+            self._remove_file(job)
+            job.finish(CANCELLED)
+        except Exception as e:
+            self._remove_file(job)
+            job.error = str(e)
+            job.finish(FAILED)
+        else:
+            job.finish(DONE)
+
+
+_default_backend = None
+
+
+def get_default_backend():
+    """ Process wide LocalJobBackend. """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = LocalJobBackend()
+    return _default_backend
@@ -0,0 +1,271 @@
+import io
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+import xlsxwriter
+from xlsxwriter.worksheet import Worksheet
+
+from .builder import add_formats, create_sheet, write_worksheet
+from .emission import count_sheet_rows
+from .images import prefetch_images
+from .instrumentation import null_trace, section_counts
+from .sharedstrings import make_interner
+from .storage import CellStore, SpillingCellStore
+from .styles import CELLS, conditional_format_keys, rule_mode
+
+"""
+    Parallel rendering of multi-sheet workbooks.
+    Each worksheet's XML part is rendered by a worker process into its
+        own constant_memory workbook, the parent assembles the parts into
+        the final zip. Every workbook registers the formats the
+        worksheets refer to in the same order up front
+        (FormatRegistry.resolve_all), so the cell style and conditional
+        format indices of the parts match the parent's styles. Formats
+        nothing refers to are left out, as in serial rendering.
+    Worksheets with images or tables, and lazily parsed ones, are
+        rendered by the parent while the workers run.
+"""
+
+
+__all__ = [
+    'PrerenderedWorksheet', 'referenced_format_keys', 'render_worksheet_part',
+    'create_sheet_parallel'
+]
+
+
+empty_dict = {}
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+def can_render_apart(sheet):
+    """
+        Worksheets whose part a worker can render on its own: no images
+            or tables (they need workbook wide ids) and every row data
+            section materialized, so it can be sent to the worker.
+    """
+    if sheet.get('images') or sheet.get('tables'):
+        return False
+
+    return None not in section_counts(sheet).values()
+
+
+# Worksheet sections whose entries may have a cell `format` key
+_formatted_sections = (
+    'rows', 'columns', 'formulas', 'formula_templates', 'hyperlinks',
+    'merged_cells'
+)
+
+
+def _cell_format_keys(cells, keys):
+    if isinstance(cells, CellStore):
+        format_keys = cells.format_keys
+        keys.update(
+            format_keys[format_id]
+            for format_id in set(cells.format_ids) if format_id
+        )
+    elif isinstance(cells, SpillingCellStore):
+        # NOTE: Spilled cells aren't read back for this, every format
+        #   of the store's workbook counts
+        keys.update(key for key in cells.format_keys[1:] if key is not None)
+    else:
+        for cell in cells or ():
+            keys.add(cell.get('format'))
+
+
+def referenced_format_keys(worksheets, specs):
+    """
+        Format keys the worksheets' entries give a cell style. Formats
+            conditional styles and table columns use are DXF records,
+            see conditional_format_keys.
+    """
+    keys = set()
+    for sheet in worksheets:
+        _cell_format_keys(sheet.get('cells'), keys)
+
+        data = sheet.get('data')
+        if data:
+            for row_formats in data.get('formats') or ():
+                keys.update(row_formats or ())
+            keys.update(data.get('column_formats') or ())
+
+        for section in _formatted_sections:
+            for entry in sheet.get(section) or ():
+                keys.add(entry.get('format'))
+
+        for rule in sheet.get('styles') or ():
+            if rule_mode(rule, specs) == CELLS:
+                keys.add(rule['format'])
+
+    keys.discard(None)
+    return keys
+
+
+def _remove_row_data(worksheet):
+    if not worksheet.constant_memory:
+        return
+
+    worksheet._opt_close()
+    if os.path.exists(worksheet.row_data_filename):
+        os.remove(worksheet.row_data_filename)
+
+
+def render_worksheet_part(args):
+    """
+        Worker: renders one worksheet into an XML file in `tmpdir`.
+        Returns (path, external hyperlink relationships).
+    """
+    formats, format_keys, dxf_keys, hyperlinks, sheet, selected, tmpdir = args
+
+    wb = xlsxwriter.Workbook(os.devnull, {
+        'constant_memory': True,
+        'in_memory': False,
+        'tmpdir': tmpdir
+    })
+    worksheet = None
+    try:
+        added_formats = add_formats(wb, formats).resolve_all(
+            dxf_keys, format_keys, hyperlinks
+        )
+        worksheet = write_worksheet(wb, sheet, added_formats, empty_dict)
+        worksheet.selected = selected
+
+        handle, path = tempfile.mkstemp(suffix='.xml', dir=tmpdir)
+        os.close(handle)
+
+        # Same steps as the packager takes on close()
+        worksheet._opt_reopen()
+        worksheet._write_single_row()
+        worksheet._set_xml_writer(path)
+        worksheet._assemble_xml_file()
+    finally:
+        # NOTE: The worker workbook itself is never written
+        wb.fileclosed = True
+        if worksheet is not None:
+            _remove_row_data(worksheet)
+
+    return path, worksheet.external_hyper_links
+
+
+class PrerenderedWorksheet(Worksheet):
+    """
+        Placeholder for a worksheet rendered by render_worksheet_part,
+            its XML part is copied in when the workbook is closed.
+    """
+    prerendered_path = None
+    prerendered_links = ()
+
+    def _assemble_xml_file(self):
+        _remove_row_data(self)
+
+        with io.open(self.prerendered_path, 'r', encoding='utf-8') as part:
+            shutil.copyfileobj(part, self.fh, COPY_BUFFER_SIZE)
+        os.remove(self.prerendered_path)
+
+        self.external_hyper_links = list(self.prerendered_links)
+        self._xml_close()
+
+
+def create_sheet_parallel(wb, schema, processes=None, image_cache=None,
+                          progress=None, trace=None, tmpdir=None,
+                          shared_strings=None):
+    """
+        create_sheet rendering worksheets on a pool of `processes`
+            worker processes (os.cpu_count() by default). Parts are
+            written to `tmpdir` and removed as the workbook is closed.
+        Falls back to create_sheet when fewer than two worksheets can
+            be rendered apart.
+        `shared_strings` only applies to the worksheets the parent
+            renders, the workers' parts keep inline strings.
+    """
+    worksheets = schema['worksheets']
+    if getattr(worksheets, 'streamed', False):
+        return create_sheet(
+            wb, schema, image_cache, progress, trace, shared_strings
+        )
+
+    worksheets = list(worksheets)
+    apart = [
+        idx for idx, sheet in enumerate(worksheets) if can_render_apart(sheet)
+    ]
+    if len(apart) < 2:
+        return create_sheet(
+            wb, dict(schema, worksheets=worksheets), image_cache, progress,
+            trace, shared_strings
+        )
+
+    if trace is None:
+        trace = null_trace
+
+    formats = schema.get('formats') or empty_dict
+    dxf_keys = conditional_format_keys(worksheets, formats)
+    format_keys = referenced_format_keys(worksheets, formats)
+    hyperlinks = any(sheet.get('hyperlinks') for sheet in worksheets)
+    pool = Pool(processes)
+    try:
+        # NOTE: Workers render while the parent adds formats and fetches
+        #   images, their time overlaps these phases
+        parts = pool.imap(render_worksheet_part, [
+            (formats, format_keys, dxf_keys, hyperlinks, worksheets[idx],
+             idx == 0, tmpdir)
+            for idx in apart
+        ])
+
+        with trace.phase('formats', count=len(formats)):
+            added_formats = add_formats(wb, formats).resolve_all(
+                dxf_keys, format_keys, hyperlinks
+            )
+        with trace.phase('images') as images_record:
+            images = prefetch_images(worksheets, image_cache)
+            images_record['count'] = len(images)
+        interner = make_interner(wb, shared_strings)
+
+        with trace.phase('create_sheet', worksheets=[],
+                         processes=processes) as record:
+            rows_done = [0]
+            placeholders = []
+            for idx, sheet in enumerate(worksheets):
+                rendered_apart = idx in apart
+                if trace is not null_trace:
+                    record['worksheets'].append({
+                        'label': sheet['label'],
+                        'sections': section_counts(sheet),
+                        'process': rendered_apart
+                    })
+
+                if rendered_apart:
+                    placeholders.append(write_worksheet(
+                        wb, sheet, added_formats, images, write_data=False,
+                        worksheet_class=PrerenderedWorksheet
+                    ))
+                    continue
+
+                sheet_progress = None
+                if progress is not None:
+                    offset = rows_done[0]
+
+                    def sheet_progress(rows, offset=offset):
+                        rows_done[0] = offset + rows
+                        progress(rows_done[0])
+
+                write_worksheet(
+                    wb, sheet, added_formats, images, sheet_progress,
+                    interner=interner
+                )
+
+            for idx, worksheet, part in zip(apart, placeholders, parts):
+                worksheet.prerendered_path, worksheet.prerendered_links = part
+                if progress is not None:
+                    rows_done[0] += count_sheet_rows(worksheets[idx])
+                    progress(rows_done[0])
+
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return wb
@@ -0,0 +1,374 @@
+import re
+import json
+import codecs
+
+from rest_framework.exceptions import ParseError, ValidationError
+
+from .templates import DATA_SECTIONS
+from .validators import (
+    validate_filename, validate_formats, validate_output, validate_worksheet,
+    iter_valid_cells, iter_valid_rows
+)
+
+"""
+    Incremental parsing of export request bodies.
+    The JSON body is read from the request stream chunk by chunk. Schema
+        metadata is decoded as it arrives, while the cells (or the columnar
+        `data` rows) of every worksheet are decoded, validated and handed to
+        the emission stage one record at a time.
+
+    Since rows are written in a single pass, the payload has to be ordered:
+        - `formats` before `worksheets`,
+        - inside a worksheet, `label`, `rows`, `formulas`,
+          `formula_templates`, `hyperlinks`, `merged_cells`, `autofit`,
+          `styles` before the streamed `cells`/`data` section, later
+          ones raise ParseError. Layout sections (`columns`, `images`,
+          `tables`...) may follow it,
+        - `template` (see excelsior.templates) and `output`,
+          `output_worksheet` (see excelsior.delimited) before `worksheets`.
+    WorkbookBuilder.as_dict() emits schemas in that order. Worksheets whose
+        cells/data come before their `label` (older clients put `cells`
+        first) are parsed as a whole instead of streamed.
+"""
+
+
+__all__ = [
+    'JSONStreamReader', 'StreamedWorksheets', 'parse_export_request'
+]
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+# Sections written together with the streamed row data, they can't
+#   arrive once the streamed section has been consumed. The others
+#   (columns, images, tables, autofilters, frozen panes, zoom) are
+#   applied after the rows, see builder.write_worksheet.
+_row_data_sections = (
+    'label', 'rows', 'formulas', 'formula_templates', 'hyperlinks',
+    'merged_cells', 'autofit', 'styles', 'cells', 'data'
+)
+
+
+# Schema keys read before the worksheets are written
+_schema_head = ('formats', 'template', 'output', 'output_worksheet')
+
+
+class JSONStreamReader(object):
+    """
+        Pull-style reader over a binary stream of JSON. Walks objects and
+            arrays structurally and decodes complete values with
+            json.JSONDecoder.raw_decode, reading more input on demand.
+    """
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+
+    def _read(self, size):
+        if self.eof:
+            return False
+
+        chunk = self.stream.read(size)
+        # Drop what's been consumed already
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+        if not chunk:
+            self.eof = True
+            self.buffer += self._decoder.decode(b'', final=True)
+            return False
+
+        self.buffer += self._decoder.decode(chunk)
+        return True
+
+    def _error(self, message):
+        raise ParseError('JSON parse error - %s' % message)
+
+    def peek(self):
+        """ Next non-whitespace character, empty string at the end. """
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read(self.chunk_size):
+                return u''
+
+    def expect(self, char):
+        if self.peek() != char:
+            self._error('expected %r' % char)
+        self.pos += 1
+
+    def value(self):
+        """ Decodes the next complete JSON value. """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    self._error('malformed JSON')
+            else:
+                # NOTE: A number at the very end of the buffer may continue
+                #   in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+
+            # Grow reads geometrically so big values aren't re-decoded
+            #   once per chunk
+            self._read(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def iter_keys(self):
+        """
+            Yields the keys of the next object. The caller has to consume
+                every key's value before asking for the next key.
+        """
+        self.expect(u'{')
+        if self.peek() == u'}':
+            self.pos += 1
+            return
+
+        while True:
+            if self.peek() != u'"':
+                self._error('expected an object key')
+            key = self.value()
+            self.expect(u':')
+            yield key
+
+            char = self.peek()
+            self.pos += 1
+            if char == u'}':
+                return
+            if char != u',':
+                self._error('expected "," or "}"')
+
+    def iter_items(self):
+        """
+            Walks the next array, yielding once per element. The caller
+                has to consume each element.
+        """
+        self.expect(u'[')
+        if self.peek() == u']':
+            self.pos += 1
+            return
+
+        while True:
+            yield
+
+            char = self.peek()
+            self.pos += 1
+            if char == u']':
+                return
+            if char != u',':
+                self._error('expected "," or "]"')
+
+    def iter_values(self):
+        """ Yields decoded elements of the next array. """
+        for _ in self.iter_items():
+            yield self.value()
+
+
+class StreamedWorksheets(object):
+    """
+        Worksheets of an incrementally parsed schema. Iterable once,
+            every worksheet has to be written before the next one is read.
+    """
+    streamed = True
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+    def __iter__(self):
+        return self._iterator
+
+
+def _finish_object(reader, keys, target, path, forbidden=()):
+    for key in keys:
+        if key in forbidden:
+            raise ParseError(
+                '%s.%s must precede the streamed rows.' % (path, key)
+            )
+        target[key] = reader.value()
+
+
+def _iter_lazy_cells(reader, sheet_keys, sheet, path, formats, validate,
+                     late_forbidden):
+    cells = iter_valid_cells(path + '.cells', reader.iter_values(), formats)
+    previous = (0, 0)
+    for cell in cells:
+        current = (cell['row'], cell['col'])
+        if current < previous:
+            raise ParseError(
+                '%s.cells must be ordered by row and column.' % path
+            )
+        previous = current
+        yield cell
+
+    _finish_object(reader, sheet_keys, sheet, path, late_forbidden)
+    validate(sheet, 'cells')
+
+
+def _iter_lazy_rows(reader, data_keys, data, sheet_keys, sheet, path,
+                    validate, late_forbidden):
+    rows = iter_valid_rows(path + '.data.rows', reader.iter_values())
+    for values in rows:
+        yield values
+
+    _finish_object(
+        reader, data_keys, data, path + '.data',
+        ('rows', 'formats', 'column_formats')
+    )
+    _finish_object(reader, sheet_keys, sheet, path, late_forbidden)
+    validate(sheet, 'data')
+
+
+def _drain(iterator):
+    for _ in iterator:
+        pass
+
+
+def _sheet_validator(path, sheet_idx, formats, template):
+    if template is None:
+        return lambda sheet, lazy: validate_worksheet(path, sheet, formats, lazy)
+
+    return lambda sheet, lazy: template.validate_worksheet(
+        path, sheet_idx, sheet, lazy
+    )
+
+
+def _iter_worksheets(reader, schema, schema_keys, envelope_keys, envelope,
+                     template=None):
+    formats = schema.get('formats')
+    sheet_count = 0
+    # NOTE: Template requests only bring data sections, they're merged
+    #   into a copy of the template's worksheet, none can come late
+    late_forbidden = _row_data_sections
+    if template is not None:
+        late_forbidden = _row_data_sections + DATA_SECTIONS
+
+    for sheet_idx, _ in enumerate(reader.iter_items()):
+        path = 'worksheets[%d]' % sheet_idx
+        validate = _sheet_validator(path, sheet_idx, formats, template)
+        sheet = {}
+        lazy = None
+        sheet_keys = reader.iter_keys()
+
+        for key in sheet_keys:
+            # NOTE: The worksheet is created before its rows are written,
+            #   rows preceding the label (the order older clients send)
+            #   are parsed as a whole
+            if key in ('cells', 'data') and 'label' not in sheet \
+                    and template is None:
+                sheet[key] = reader.value()
+                continue
+
+            if key == 'cells':
+                lazy = 'cells'
+                sheet['cells'] = _iter_lazy_cells(
+                    reader, sheet_keys, sheet, path, formats, validate,
+                    late_forbidden
+                )
+                break
+
+            if key == 'data':
+                data = {}
+                data_keys = reader.iter_keys()
+                for data_key in data_keys:
+                    if data_key == 'rows':
+                        lazy = 'data'
+                        data['rows'] = _iter_lazy_rows(
+                            reader, data_keys, data, sheet_keys, sheet, path,
+                            validate, late_forbidden
+                        )
+                        break
+                    data[data_key] = reader.value()
+                sheet['data'] = data
+                if lazy is not None:
+                    break
+                continue
+
+            sheet[key] = reader.value()
+
+        validate(sheet, lazy)
+        if template is None:
+            yield sheet
+        else:
+            yield template.merge_worksheet(sheet_idx, sheet)
+        sheet_count += 1
+
+        # The consumer may stop early, skip what's left of the worksheet
+        if lazy == 'cells':
+            _drain(sheet['cells'])
+        elif lazy == 'data':
+            _drain(sheet['data']['rows'])
+
+    if template is not None:
+        for sheet in template.remaining_worksheets(sheet_count):
+            yield sheet
+
+    for key in schema_keys:
+        if key in _schema_head:
+            raise ParseError('%s must precede worksheets.' % key)
+        schema[key] = reader.value()
+
+    if template is not None and not schema.get('filename'):
+        schema['filename'] = template.filename
+    validate_filename(schema.get('filename'))
+    _finish_object(reader, envelope_keys, envelope, '')
+
+
+def _request_template(schema, templates):
+    if templates is None or 'template' not in schema:
+        validate_formats(schema.get('formats'))
+        return None
+
+    template = templates.resolve(schema['template'])
+    if 'formats' in schema:
+        raise ValidationError(
+            {'formats': ['Defined by template %s.' % template.name]}
+        )
+    schema['formats'] = template.formats
+
+    return template
+
+
+def parse_export_request(stream, chunk_size=64 * 1024, templates=None):
+    """
+        Parses a `{"data": <schema>, ...}` export request body from
+            a binary stream. Returns the request dict; its schema's
+            `worksheets` is a StreamedWorksheets, keys following the
+            worksheets (e.g. `filename`, `cookie`) are filled in once
+            all worksheets have been consumed.
+        Pass a templates.TemplateRegistry to accept template requests,
+            their `template` has to precede the worksheets.
+    """
+    reader = JSONStreamReader(stream, chunk_size)
+    envelope = {}
+    envelope_keys = reader.iter_keys()
+
+    for key in envelope_keys:
+        if key != 'data':
+            envelope[key] = reader.value()
+            continue
+
+        schema = {}
+        envelope['data'] = schema
+        schema_keys = reader.iter_keys()
+        for schema_key in schema_keys:
+            if schema_key == 'worksheets':
+                validate_output(schema)
+                template = _request_template(schema, templates)
+                schema['worksheets'] = StreamedWorksheets(_iter_worksheets(
+                    reader, schema, schema_keys, envelope_keys, envelope,
+                    template
+                ))
+                return envelope
+            schema[schema_key] = reader.value()
+
+        raise ParseError('worksheets key not in object!')
+
+    raise ParseError('data key not in object!')
@@ -1,4 +1,15 @@
+import warnings
+
 import six
+import xlsxwriter
+
+from .builder import add_formats, write_worksheet
+from .images import prefetch_images
+from .sharedstrings import make_interner
+from .storage import CellStore, SpillingCellStore
+from .index import RangeIndex
+from .sources import blank_na_rows, is_na, rows_from, rows_from_columns
+from .styles import CRITERIA, MODES
 
 """
     Schema API layer. Use it in the real exports implementations
@@ -9,7 +20,7 @@ import six
 
 
 __all__ = [
-    'ExportError', 'Worksheet', 'WorkbookBuilder'
+    'ExportError', 'Worksheet', 'StreamingWorksheet', 'WorkbookBuilder'
 ]
 
 
@@ -17,22 +28,62 @@ class ExportError(Exception):
     pass
 
 
+# Cells collected by write_rows/write_columns before they are stored
+EXTEND_CHUNK = 65536
+
+
+# Indexed sections holding single cells
+_spot_sections = (
+    ('cells', 'cell'),
+    ('formulas', 'formula'),
+    ('hyperlinks', 'hyperlink'),
+)
+
+
+def _range_label(first_row, first_col, last_row, last_col):
+    return 'merged range (rows %d-%d, columns %d-%d)' \
+        % (first_row, last_row, first_col, last_col)
+
+
 class Worksheet(object):
-    def __init__(self, workbook, label):
+    def __init__(self, workbook, label, compact=False):
         self.workbook = workbook
         self.label = label
-        self.cells = []
+        spill_threshold = getattr(workbook, 'spill_threshold', None)
+        spill_bytes = getattr(workbook, 'spill_bytes', None)
+        if spill_threshold is not None or spill_bytes is not None:
+            # NOTE: Spilled cells are stored compactly as well
+            self.compact = True
+            self.cells = SpillingCellStore(
+                workbook.format_keys,
+                spill_threshold,
+                spill_bytes,
+                workbook.spill_dir
+            )
+        else:
+            self.compact = compact
+            self.cells = CellStore(workbook.format_keys) if compact else []
         self.columns = []
         self.rows = []
         self.tables = []
         self.merged_cells = []
         self.hyperlinks = []
         self.formulas = []
+        self.formula_templates = []
         self.images = []
         self.autofilters = []
         self.frozen_panes = []
         self.current_row_idx = 0
         self.zoom = None
+        self.autofit = None
+        self.styles = []
+
+        self.indexed = getattr(workbook, 'indexed', False)
+        if self.indexed and isinstance(self.cells, SpillingCellStore):
+            raise ExportError('Indexed worksheets can not spill cells to disk.')
+        # Indexed worksheets: section -> {(row, col): position}
+        self._spots = dict((section, {}) for section, _ in _spot_sections)
+        self._merged_index = RangeIndex()
 
     def write_empty_rows(self, rows_to_write = 1):
         self.current_row_idx += rows_to_write
@@ -128,39 +179,296 @@ class Worksheet(object):
                     % (current_row_idx, current_column_idx)
                 )
 
-            cell = {
-                'row': current_row_idx,
-                'col': current_column_idx,
-                'value': value
-            }
+            self._append_cell(current_row_idx, current_column_idx, value, format)
             current_column_idx += 1
 
-            if format is not None :
-                cell['format'] = format
+        return self
+
+    def write_rows(self, rows, formats=None, start_row=None):
+        """
+            Writes many rows at once, starting at start_row (the current
+                row by default) and moving the current row past them.
+
+            `rows` is any iterable of row sequences, a 2-D NumPy array or
+                a pandas DataFrame. Values are written as is, None and NaN
+                leave the cell blank. `formats` is either a single format
+                key for every column or a list of per-column format keys.
+
+            Example:
+                write_rows(
+                    queryset.values_list('name', 'price'),
+                    formats=[None, 'money']
+                )
+        """
+        return self._extend_rows(rows_from(rows), formats, start_row)
+
+    def write_columns(self, columns, formats=None, start_row=None):
+        """
+            Column oriented write_rows: `columns` is an iterable of column
+                sequences, a 2-D NumPy array (one column per array column)
+                or a pandas DataFrame.
+        """
+        return self._extend_rows(rows_from_columns(columns), formats, start_row)
+
+    def _column_formats(self, formats):
+        """
+            Validates bulk formats once, returns a per-column lookup
+                (format keys, or format ids for compact storage).
+        """
+        if formats is None or isinstance(formats, six.string_types):
+            formats = [formats]
+            repeat = True
+        else:
+            formats = list(formats)
+            repeat = False
+
+        for col_idx, format in enumerate(formats):
+            if format is not None and not self.workbook.has_format(format):
+                raise ExportError(
+                    'Column %d refers to non-existent format %s' \
+                         % (col_idx, format)
+                )
 
-            self.cells.append(cell)
+        if self.compact:
+            formats = [self.workbook.format_id(format) for format in formats]
+
+        return formats, repeat
+
+    def _extend_rows(self, rows, formats, start_row):
+        formats, repeat = self._column_formats(formats)
+        no_format = 0 if self.compact else None
+        padding = formats[0] if repeat else no_format
+        if repeat:
+            formats = []
+
+        row_idx = self.current_row_idx if start_row is None else start_row
+
+        rows_idx = []
+        cols_idx = []
+        values = []
+        format_keys = []
+        add_row = rows_idx.append
+        add_col = cols_idx.append
+        add_value = values.append
+        add_format = format_keys.append
+
+        for row in rows:
+            if len(row) > len(formats):
+                formats.extend([padding] * (len(row) - len(formats)))
+
+            col_idx = 0
+            for value in row:
+                try:
+                    if value is not None and value == value:
+                        add_row(row_idx)
+                        add_col(col_idx)
+                        add_value(value)
+                        add_format(formats[col_idx])
+                except TypeError:
+                    # pandas.NA == NA is NA, whose truth value raises
+                    if not is_na(value):
+                        raise
+                col_idx += 1
+            row_idx += 1
+
+            if len(values) >= EXTEND_CHUNK:
+                # NOTE: Hand the store bounded chunks, a spilling store
+                #   gets to spill between them
+                self._store_cells(rows_idx, cols_idx, values, format_keys)
+                for collected in (rows_idx, cols_idx, values, format_keys):
+                    del collected[:]
+
+        self._store_cells(rows_idx, cols_idx, values, format_keys)
+        self.current_row_idx = row_idx
 
         return self
 
-    def write_cell(self, row_idx, col_idx, value, format=None):
-        cell = {
-            'row': row_idx,
-            'col': col_idx,
-            'value': value
-        }
+    def _store_cells(self, rows_idx, cols_idx, values, format_keys):
+        if self.indexed:
+            for cell_row, cell_col, value, format in zip(rows_idx, cols_idx,
+                                                         values, format_keys):
+                self._put_cell(cell_row, cell_col, value, format)
+        elif self.compact:
+            self.cells.extend(rows_idx, cols_idx, values, format_keys)
+        else:
+            cells = self.cells
+            for cell_row, cell_col, value, format in zip(rows_idx, cols_idx,
+                                                         values, format_keys):
+                cell = {
+                    'row': cell_row,
+                    'col': cell_col,
+                    'value': value
+                }
+                if format is not None:
+                    cell['format'] = format
+                cells.append(cell)
 
+    def write_cell(self, row_idx, col_idx, value, format=None):
         if format is not None:
             if not self.workbook.has_format(format):
                 raise ExportError(
                     'Row %d, Column %d refers to non-existent format %s' \
                          % (row_idx, col_idx, format)
                 )
-            cell['format'] = format
 
-        self.cells.append(cell)
+        self._append_cell(row_idx, col_idx, value, format)
 
         return self
 
+    def _append_cell(self, row_idx, col_idx, value, format):
+        if self.compact:
+            format = self.workbook.format_id(format)
+
+        self._put_cell(row_idx, col_idx, value, format)
+
+    def _put_cell(self, row_idx, col_idx, value, format):
+        """
+            Stores a cell, `format` is a format id for compact storage.
+            Indexed worksheets overwrite a cell written to the same spot.
+        """
+        position = None
+        if self.indexed:
+            position = self._claim('cells', row_idx, col_idx)
+
+        if self.compact:
+            if position is None:
+                self.cells.append(row_idx, col_idx, value, format)
+            else:
+                self.cells.replace(position, value, format)
+        else:
+            cell = {
+                'row': row_idx,
+                'col': col_idx,
+                'value': value
+            }
+
+            if format is not None:
+                cell['format'] = format
+
+            if position is None:
+                self.cells.append(cell)
+            else:
+                self.cells[position] = cell
+
+        if self.indexed and position is None:
+            self._spots['cells'][(row_idx, col_idx)] = len(self.cells) - 1
+
+    def _claim(self, section, row_idx, col_idx):
+        """
+            Indexed worksheets: position of the `section` entry already
+                written to the spot, None if it's free. Raises ExportError
+                when another section or a merged range holds the spot.
+        """
+        spot = (row_idx, col_idx)
+        for other, name in _spot_sections:
+            if other != section and spot in self._spots[other]:
+                raise ExportError(
+                    'Row %d, Column %d already holds a %s.' \
+                        % (row_idx, col_idx, name)
+                )
+
+        merged = self._merged_index.find(row_idx, col_idx)
+        if merged is not None:
+            raise ExportError(
+                'Row %d, Column %d is covered by a %s.' % (
+                    row_idx, col_idx,
+                    _range_label(*self._merged_index.ranges[merged])
+                )
+            )
+
+        return self._spots[section].get(spot)
+
+    def _add_entry(self, section, entry):
+        entries = getattr(self, section)
+        if not self.indexed:
+            entries.append(entry)
+            return
+
+        position = self._claim(section, entry['row'], entry['col'])
+        if position is None:
+            self._spots[section][(entry['row'], entry['col'])] = len(entries)
+            entries.append(entry)
+        else:
+            entries[position] = entry
+
+    def _add_merged(self, merged):
+        if not self.indexed:
+            self.merged_cells.append(merged)
+            return
+
+        bounds = (
+            min(merged['first_row'], merged['last_row']),
+            min(merged['first_col'], merged['last_col']),
+            max(merged['first_row'], merged['last_row']),
+            max(merged['first_col'], merged['last_col'])
+        )
+        first_row, first_col, last_row, last_col = bounds
+
+        overlapping = self._merged_index.overlapping(*bounds)
+        if (len(overlapping) == 1
+                and self._merged_index.ranges[overlapping[0]] == bounds):
+            self.merged_cells[overlapping[0]] = merged
+            return
+        if overlapping:
+            raise ExportError('%s overlaps a %s.' % (
+                _range_label(*bounds).capitalize(),
+                _range_label(*self._merged_index.ranges[overlapping[0]])
+            ))
+
+        area = (last_row - first_row + 1) * (last_col - first_col + 1)
+        for section, name in _spot_sections:
+            spots = self._spots[section]
+            if area <= len(spots):
+                covered = (
+                    (row_idx, col_idx)
+                    for row_idx in range(first_row, last_row + 1)
+                    for col_idx in range(first_col, last_col + 1)
+                    if (row_idx, col_idx) in spots
+                )
+            else:
+                covered = (
+                    spot for spot in spots
+                    if first_row <= spot[0] <= last_row
+                    and first_col <= spot[1] <= last_col
+                )
+
+            for row_idx, col_idx in covered:
+                raise ExportError('%s covers a %s at row %d, column %d.' % (
+                    _range_label(*bounds).capitalize(), name, row_idx, col_idx
+                ))
+
+        self._merged_index.add(len(self.merged_cells), *bounds)
+        self.merged_cells.append(merged)
+
+    def get_cell(self, row_idx, col_idx):
+        """
+            Cell written to (row, col) as a schema dict, None if there's
+                none. Needs an indexed worksheet, see WorkbookBuilder.
+        """
+        if not self.indexed:
+            raise ExportError(
+                'get_cell() needs an indexed worksheet, '
+                'see WorkbookBuilder(indexed=True).'
+            )
+
+        position = self._spots['cells'].get((row_idx, col_idx))
+        if position is None:
+            return None
+
+        if not self.compact:
+            return dict(self.cells[position])
+
+        cell = {
+            'row': row_idx,
+            'col': col_idx,
+            'value': self.cells.value_at(position)
+        }
+        format = self.cells.format_at(position)
+        if format is not None:
+            cell['format'] = format
+
+        return cell
+
     def write_merged_cell(self, first_row_idx, first_col_idx, last_row_idx, last_col_idx,
                         data=None, format=None):
         cell = {
@@ -180,7 +488,7 @@ class Worksheet(object):
                 )
             cell['format'] = format
 
-        self.merged_cells.append(cell)
+        self._add_merged(cell)
 
         return self
 
@@ -204,7 +512,7 @@ class Worksheet(object):
         if tip is not None:
             hyperlink['tip'] = tip
 
-        self.hyperlinks.append(hyperlink)
+        self._add_entry('hyperlinks', hyperlink)
 
         return self
 
@@ -226,7 +534,35 @@ class Worksheet(object):
         if default_value is not None:
             formula['default_value'] = default_value
 
-        self.formulas.append(formula)
+        self._add_entry('formulas', formula)
+
+    def write_formula_template(self, col_idx, first_row_idx, last_row_idx,
+                               template, format=None, default_value=None):
+        """
+            Writes `template` to every row of the range in a single entry,
+                e.g. '=B{row}*C{row}'. `{row}` is replaced with the Excel
+                row number of each cell, `{col}` with the column letters.
+        """
+        formula_template = {
+            'template': template,
+            'col': col_idx,
+            'first_row': first_row_idx,
+            'last_row': last_row_idx
+        }
+
+        if format is not None:
+            if not self.workbook.has_format(format):
+                raise ExportError(
+                    'Column %d refers to non-existent format %s' \
+                         % (col_idx, format)
+                )
+            formula_template['format'] = format
+        if default_value is not None:
+            formula_template['default_value'] = default_value
+
+        self.formula_templates.append(formula_template)
+
+        return self
 
     def write_image(self, row_idx, col_idx, url, options={}):
         self.images.append({
@@ -270,9 +606,167 @@ class Worksheet(object):
         value = abs(int(value))
         self.zoom = value
 
-    def as_dict(self):
-        schema = {
+    def set_autofit(self, min_width=None, max_width=None):
+        """
+            Fits the width of columns without an explicit width to their
+                widest value, measured while the worksheet is rendered.
+                Widths are in characters, like set_column_width.
+        """
+        autofit = {}
+        if min_width is not None:
+            autofit['min_width'] = min_width
+        if max_width is not None:
+            autofit['max_width'] = max_width
+        if min_width is not None and max_width is not None \
+                and min_width > max_width:
+            raise ExportError('Autofit min_width is greater than max_width')
+
+        self.autofit = autofit or True
+        return self
+
+    def add_style(self, format, first_row=0, first_col=0, last_row=None,
+                  last_col=None, row_step=None, criteria=None, value=None,
+                  minimum=None, maximum=None, mode=None):
+        """
+            Styles a range with `format` instead of formatting each cell:
+                every row_step'th row from first_row and/or the number
+                values matching criteria ('>', 'between'... with `value`
+                or `minimum`/`maximum`). Open ranges end at the last
+                written row/column.
+            Rules become Excel conditional formats when the format allows
+                it, they're applied to the written cells otherwise (or
+                with mode='cells'), see excelsior.styles.
+        """
+        if not self.workbook.has_format(format):
+            raise ExportError(
+                'Style refers to non-existent format %s' % format
+            )
+        if criteria is not None and criteria not in CRITERIA:
+            raise ExportError('Unknown style criteria %s' % criteria)
+        if mode is not None and mode not in MODES:
+            raise ExportError('Unknown style mode %s' % mode)
+
+        style = {
+            'format': format,
+            'first_row': first_row,
+            'first_col': first_col
+        }
+        for key, option in (('last_row', last_row), ('last_col', last_col),
+                            ('row_step', row_step), ('mode', mode)):
+            if option is not None:
+                style[key] = option
+
+        if criteria is not None:
+            style['criteria'] = criteria
+            if criteria in ('between', 'not between'):
+                style['minimum'] = minimum
+                style['maximum'] = maximum
+            else:
+                style['value'] = value
+
+        self.styles.append(style)
+
+        return self
+
+    def render_source(self):
+        """
+            Worksheet schema for the builder, sharing this worksheet's
+                storage. Unlike as_dict() nothing here is meant to be
+                serialized.
+        """
+        source = {
+            'label': self.label,
             'cells': self.cells,
+            'columns': self.columns,
+            'rows': self.rows,
+            'hyperlinks': self.hyperlinks,
+            'formulas': self.formulas,
+            'formula_templates': self.formula_templates,
+            'images': self.images,
+            'tables': self.tables,
+            'merged_cells': self.merged_cells,
+            'autofilters': self.autofilters,
+            'frozen_panes': self.frozen_panes
+        }
+
+        if self.zoom is not None:
+            source['zoom'] = self.zoom
+
+        if self.autofit is not None:
+            source['autofit'] = self.autofit
+
+        if len(self.styles) > 0:
+            source['styles'] = self.styles
+
+        return source
+
+    def cells_as_data(self):
+        """
+            Packs cells into the columnar `data` block: row arrays covering
+                the cells bounding box, plus per-column default formats or
+                a parallel format keys matrix when cells are formatted.
+        """
+        if len(self.cells) == 0:
+            return {'first_row': 0, 'first_col': 0, 'rows': []}
+
+        first_row = min(cell['row'] for cell in self.cells)
+        last_row = max(cell['row'] for cell in self.cells)
+        first_col = min(cell['col'] for cell in self.cells)
+        last_col = max(cell['col'] for cell in self.cells)
+        width = last_col - first_col + 1
+        height = last_row - first_row + 1
+
+        rows = [[None] * width for _ in range(height)]
+        formats = None
+        for cell in self.cells:
+            row_idx = cell['row'] - first_row
+            col_idx = cell['col'] - first_col
+            rows[row_idx][col_idx] = cell['value']
+
+            format = cell.get('format')
+            if format is not None:
+                if formats is None:
+                    formats = [[None] * width for _ in range(height)]
+                formats[row_idx][col_idx] = format
+
+        data = {
+            'first_row': first_row,
+            'first_col': first_col
+        }
+
+        if formats is not None:
+            data.update(self._data_formats(rows, formats, width, height))
+
+        # NOTE: Rows go last, see excelsior.parsers
+        data['rows'] = rows
+
+        return data
+
+    def _data_formats(self, rows, formats, width, height):
+        # Collapse columns that share a single format to column defaults
+        column_formats = [None] * width
+        for col_idx in range(width):
+            keys = set()
+            for row_idx in range(height):
+                if rows[row_idx][col_idx] is not None:
+                    keys.add(formats[row_idx][col_idx])
+                elif formats[row_idx][col_idx] is not None:
+                    keys.add(None)
+                    keys.add(formats[row_idx][col_idx])
+
+            if len(keys) > 1:
+                return {'formats': formats}
+
+            column_formats[col_idx] = keys.pop() if keys else None
+
+        return {'column_formats': column_formats}
+
+    def as_dict(self, columnar=False):
+        """
+            Worksheet schema. Pass columnar=True to emit cells as
+                a compact `data` block instead of per-cell dicts.
+        """
+        schema = {
             'label': self.label
         }
 
@@ -288,6 +782,9 @@ class Worksheet(object):
         if len(self.formulas) > 0:
             schema['formulas'] = self.formulas
 
+        if len(self.formula_templates) > 0:
+            schema['formula_templates'] = self.formula_templates
+
         if len(self.images) > 0:
             schema['images'] = self.images
 
@@ -306,13 +803,112 @@ class Worksheet(object):
         if self.zoom is not None:
             schema['zoom'] = self.zoom;
 
+        if self.autofit is not None:
+            schema['autofit'] = self.autofit
+
+        if len(self.styles) > 0:
+            schema['styles'] = self.styles
+
+        # NOTE: Row data goes last, incremental parsing needs the sections
+        #   written along with it to come first
+        if columnar:
+            schema['data'] = self.cells_as_data()
+        elif self.compact:
+            schema['cells'] = list(self.cells)
+        else:
+            schema['cells'] = self.cells
+
         return schema
 
 
+class StreamingWorksheet(Worksheet):
+    """
+        Worksheet whose data rows are pulled from `row_source` (any
+            iterator of row sequences, e.g. queryset.iterator() or
+            a DB-API cursor) only while the xlsx is being rendered.
+        Everything written through the regular Worksheet API (header
+            rows, column widths, frozen panes...) works as usual, streamed
+            rows start at `start_row` or right after the rows written so far.
+        The source is consumed once: render the workbook a single time.
+        NOTE: XlsxWriter's in_memory option overrides constant_memory,
+            WorkbookBuilder.render() defaults to in_memory=False when a
+            streaming worksheet is present and warns if in_memory is
+            forced.
+    """
+    def __init__(self, workbook, label, row_source, formats=None,
+                 start_row=None, compact=False):
+        super(StreamingWorksheet, self).__init__(workbook, label, compact)
+
+        if formats is not None:
+            for col_idx, format in enumerate(formats):
+                if format is not None and not workbook.has_format(format):
+                    raise ExportError(
+                        'Column %d refers to non-existent format %s' \
+                             % (col_idx, format)
+                    )
+
+        self.row_source = row_source
+        self.row_formats = formats
+        self.start_row = start_row
+
+    def _stream_start_row(self):
+        if self.start_row is None:
+            return self.current_row_idx
+        return self.start_row
+
+    def render_source(self):
+        source = super(StreamingWorksheet, self).render_source()
+        source['data'] = {
+            'first_row': self._stream_start_row(),
+            'first_col': 0,
+            'rows': blank_na_rows(rows_from(self.row_source))
+        }
+
+        if self.row_formats:
+            source['data']['column_formats'] = self.row_formats
+
+        return source
+
+    def as_dict(self, columnar=False):
+        """
+            Serializing a streaming worksheet drains the row source into
+                regular cells first.
+        """
+        if self.row_source is not None:
+            self.write_rows(
+                self.row_source, self.row_formats, self._stream_start_row()
+            )
+            self.row_source = None
+
+        return super(StreamingWorksheet, self).as_dict(columnar)
+
+
 class WorkbookBuilder(object):
-    def __init__(self, filename):
+    """
+        Pass compact=True to keep worksheet cells in parallel arrays
+            (see storage.CellStore) instead of a dict per cell.
+        Pass spill_threshold (a number of cells) and/or spill_bytes (an
+            approximate size of cell values) to move cells past that size
+            to temp files in `spill_dir`, see storage.SpillingCellStore.
+            Rendering replays them in row order.
+        Pass indexed=True to index worksheet cells, formulas, hyperlinks
+            and merged ranges by coordinate: rewriting a spot replaces
+            its entry, Worksheet.get_cell() reads cells back and writes
+            colliding with another kind of entry (or a merged range)
+            raise ExportError.
+    """
+    def __init__(self, filename, compact=False, spill_threshold=None,
+                 spill_bytes=None, spill_dir=None, indexed=False):
         self.filename = filename
+        self.compact = compact
+        self.indexed = indexed
+        self.spill_threshold = spill_threshold
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
         self.formats = {}
+        # Interned format ids, id 0 stands for "no format"
+        self.format_keys = [None]
+        self.format_ids = {None: 0}
         self.worksheets = []
 
     def add_format(self, format_key, format_spec):
@@ -322,31 +918,139 @@ class WorkbookBuilder(object):
             )
 
         self.formats[format_key] = format_spec
+        self.format_ids[format_key] = len(self.format_keys)
+        self.format_keys.append(format_key)
 
         return self
 
     def has_format(self, format_key):
         return format_key in self.formats
 
+    def format_id(self, format_key):
+        return self.format_ids[format_key]
+
     def add_worksheet(self, worksheet_label):
 
         """ Add a worksheet to the workbook. """
 
-        worksheet = Worksheet(self, worksheet_label)
+        worksheet = Worksheet(self, worksheet_label, self.compact)
+        self.worksheets.append(worksheet)
+
+        return worksheet
+
+    def add_streaming_worksheet(self, worksheet_label, row_source,
+                                formats=None, start_row=None):
+        """
+            Add a worksheet whose rows are pulled from row_source at render
+                time, see StreamingWorksheet. `formats` is a list of
+                per-column format keys.
+        """
+        worksheet = StreamingWorksheet(
+            self, worksheet_label, row_source, formats, start_row, self.compact
+        )
         self.worksheets.append(worksheet)
 
         return worksheet
 
-    def as_dict(self):
+    def as_dict(self, columnar=False):
         if len(self.worksheets) == 0:
             raise ExportError('Trying to serialize an empty workbook.')
 
         schema = {
-            'filename': self.filename,
-            'worksheets': map(lambda w: w.as_dict(), self.worksheets)
+            'filename': self.filename
         }
 
         if len(self.formats.keys()) > 0:
             schema['formats'] = self.formats
 
+        schema['worksheets'] = map(lambda w: w.as_dict(columnar), self.worksheets)
+
         return schema
+
+    def render(self, file_object, shared_strings=None, **workbook_options):
+        """
+            Renders the workbook straight into the file object, walking
+                the worksheets' own storage instead of going through
+                the as_dict() schema. Output matches the dict route.
+            Workbooks with streaming worksheets are rendered with
+                in_memory=False (temp files in `tmpdir`), XlsxWriter
+                buffers every row otherwise.
+            See builder.create_sheet for `shared_strings`.
+            Spilled cells are released once written, see close(), so
+                a spilling builder renders once.
+        """
+        if len(self.worksheets) == 0:
+            raise ExportError('Trying to serialize an empty workbook.')
+
+        streamed = any(
+            isinstance(worksheet, StreamingWorksheet)
+            for worksheet in self.worksheets
+        )
+        options = {
+            # NOTE: in_memory turns constant_memory off
+            'in_memory': not streamed,
+            'constant_memory': True
+        }
+        options.update(workbook_options)
+        if streamed and options['in_memory']:
+            warnings.warn(
+                'Rendering streaming worksheets with in_memory=True '
+                'buffers every streamed row, pass in_memory=False to keep '
+                'memory flat.',
+                RuntimeWarning
+            )
+
+        wb = xlsxwriter.Workbook(file_object, options)
+        try:
+            added_formats = add_formats(wb, self.formats)
+            interner = make_interner(wb, shared_strings)
+            sources = [
+                worksheet.render_source() for worksheet in self.worksheets
+            ]
+            images = prefetch_images(sources)
+            for source in sources:
+                write_worksheet(
+                    wb, source, added_formats, images, interner=interner
+                )
+            wb.close()
+        finally:
+            self.close()
+        file_object.seek(0)
+
+        return file_object
+
+    def close(self):
+        """
+            Releases the temp files of spilled cells. render() calls it,
+                call it (or use the builder as a context manager) when
+                the cells are rendered through as_dict() instead.
+        """
+        for worksheet in self.worksheets:
+            close = getattr(worksheet.cells, 'close', None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def render_delimited(self, file_object, worksheet=None, output='csv',
+                         encoding='utf-8'):
+        """
+            Writes one worksheet (label or index, the first by default)
+                to the file object as CSV, or TSV with output='tsv'.
+                Only values are written, see excelsior.delimited.
+        """
+        # Avoid circular import, delimited imports this module
+        from .delimited import iter_delimited
+
+        if len(self.worksheets) == 0:
+            raise ExportError('Trying to serialize an empty workbook.')
+
+        for chunk in iter_delimited(self, worksheet, output, encoding):
+            file_object.write(chunk)
+        file_object.seek(0)
+
+        return file_object
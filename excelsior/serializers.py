@@ -1,3 +1,4 @@
+import six
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
@@ -14,6 +15,43 @@ class AnyField(serializers.Field):
         return data
 
 
+class AutofitField(serializers.Field):
+    """
+    Worksheet column auto-fit: true, or the min_width/max_width
+        bounds (in characters) of the fitted widths.
+    """
+    default_error_messages = {
+        'invalid': 'Expected a boolean or a dictionary of min_width/max_width.',
+        'bounds': 'Ensure min_width is not greater than max_width.'
+    }
+    bounds = ('min_width', 'max_width')
+
+    def to_representation(self, obj):
+        return obj
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            return data
+
+        if not isinstance(data, dict) or set(data) - set(self.bounds):
+            self.fail('invalid')
+
+        for key in self.bounds:
+            value = data.get(key)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, six.integer_types + (float,)) \
+                    or value < 0:
+                self.fail('invalid')
+
+        if data.get('min_width') is not None \
+                and data.get('max_width') is not None \
+                and data['min_width'] > data['max_width']:
+            self.fail('bounds')
+
+        return data
+
+
 class ExcelRowSerializer(serializers.Serializer):
     row = serializers.IntegerField(min_value=0)
     height = serializers.IntegerField(min_value=0)
@@ -61,6 +99,20 @@ class FormulaSerializer(CellBaseSerializer):
     default_value = serializers.IntegerField(required=False)
 
 
+class FormulaTemplateSerializer(serializers.Serializer):
+    """
+    Formula written to every row of first_row..last_row in col.
+        `{row}` in the template stands for the Excel row number of each
+        cell, `{col}` for the column letters.
+    """
+    template = serializers.CharField(max_length=1024)
+    col = serializers.IntegerField(min_value=0)
+    first_row = serializers.IntegerField(min_value=0)
+    last_row = serializers.IntegerField(min_value=0)
+    format = serializers.CharField(max_length=255, required=False, allow_null=True)
+    default_value = serializers.IntegerField(required=False)
+
+
 class ImageSerializer(CellBaseSerializer):
     url = serializers.CharField(max_length=1024)
     options = serializers.DictField(required=False, default={})
@@ -88,25 +140,112 @@ class MergedCellsSerializer(serializers.Serializer):
     format = serializers.CharField(max_length=255, required=False, allow_null=True)
 
 
+class StyleSerializer(serializers.Serializer):
+    """
+    Styling rule: `format` for the range's cells, every row_step'th row
+        and/or the number values matching criteria, see excelsior.styles.
+    """
+    format = serializers.CharField(max_length=255)
+    first_row = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    first_col = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    last_row = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    last_col = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    row_step = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+    criteria = serializers.ChoiceField(
+        choices=('==', '!=', '>', '<', '>=', '<=', 'between', 'not between'),
+        required=False, allow_null=True
+    )
+    value = AnyField(required=False, allow_null=True)
+    minimum = AnyField(required=False, allow_null=True)
+    maximum = AnyField(required=False, allow_null=True)
+    mode = serializers.ChoiceField(
+        choices=('conditional', 'cells'), required=False, allow_null=True
+    )
+
+    def validate(self, attrs):
+        criteria = attrs.get('criteria')
+        if criteria is None:
+            return attrs
+
+        if criteria in ('between', 'not between'):
+            keys = ('minimum', 'maximum')
+        else:
+            keys = ('value',)
+        for key in keys:
+            value = attrs.get(key)
+            if isinstance(value, bool) \
+                    or not isinstance(value, six.integer_types + (float,)):
+                raise ValidationError({key: ['A valid number is required.']})
+
+        return attrs
+
+
+class DataBlockSerializer(serializers.Serializer):
+    """
+    Columnar worksheet data: row arrays starting at first_row/first_col,
+        with an optional parallel matrix of format keys and/or
+        per-column default format keys.
+    """
+    first_row = serializers.IntegerField(min_value=0, default=0)
+    first_col = serializers.IntegerField(min_value=0, default=0)
+    rows = serializers.ListField(child=serializers.ListField(child=AnyField(allow_null=True)))
+    formats = serializers.ListField(
+        child=serializers.ListField(
+            child=serializers.CharField(max_length=255, allow_null=True),
+            allow_null=True
+        ),
+        required=False, allow_null=True
+    )
+    column_formats = serializers.ListField(
+        child=serializers.CharField(max_length=255, allow_null=True),
+        required=False, allow_null=True
+    )
+
+
 class WorksheetSerializer(serializers.Serializer):
     label = serializers.CharField(max_length=255)
-    cells = ExcelWriteSerializer(many=True)
+    cells = ExcelWriteSerializer(many=True, required=False)
+    data = DataBlockSerializer(required=False)
 
     columns = ExcelColumnSerializer(many=True, required=False, allow_null=True)
     rows = ExcelRowSerializer(many=True, required=False, allow_null=True)
     formulas = FormulaSerializer(many=True, required=False, allow_null=True)
+    formula_templates = FormulaTemplateSerializer(many=True, required=False, allow_null=True)
     images = ImageSerializer(many=True, required=False, allow_null=True)
     hyperlinks = HyperlinkSerializer(many=True, required=False, allow_null=True)
     tables = TableSerializer(many=True, required=False, allow_null=True)
     merged_cells = MergedCellsSerializer(many=True, required=False, allow_null=True)
     autofilters = AutofilterSerializer(many=True, required=False, allow_null=True)
     frozen_panes = FrozenPaneSerializer(many=True, required=False, allow_null=True)
+    autofit = AutofitField(required=False, allow_null=True)
+    styles = StyleSerializer(many=True, required=False, allow_null=True)
+
+    def validate(self, attrs):
+        if 'cells' not in attrs and 'data' not in attrs:
+            raise ValidationError('Either cells or data must be provided!')
+
+        return attrs
 
 
 class ExcelExportSerializer(serializers.Serializer):
     filename = serializers.CharField(max_length=255)
     worksheets = WorksheetSerializer(many=True)
     formats = serializers.DictField(required=False, allow_null=True)
+    output = serializers.ChoiceField(
+        choices=('xlsx', 'csv', 'tsv'), required=False, allow_null=True
+    )
+    output_worksheet = AnyField(required=False, allow_null=True)
+
+    def validate_output_worksheet(self, value):
+        if value is None or isinstance(value, six.string_types):
+            return value
+
+        if isinstance(value, bool) or not isinstance(value, six.integer_types) \
+                or value < 0:
+            raise ValidationError(
+                'Expected a worksheet label or a non-negative integer.'
+            )
+        return value
 
     def validate(self, attrs):
         format_keys = attrs.get('formats')
@@ -114,12 +253,46 @@ class ExcelExportSerializer(serializers.Serializer):
             format_keys = format_keys.keys()
 
         for worksheet in attrs['worksheets']:
-            for cell in worksheet['cells']:
+            for cell in worksheet.get('cells', []):
                 if 'format' in cell:
-                    if format_keys is None:
-                        raise ValidationError('formats key not in object!')
+                    self.check_format_key(cell['format'], format_keys)
+
+            data = worksheet.get('data')
+            if data is not None:
+                for row_formats in data.get('formats') or []:
+                    for format in row_formats or []:
+                        self.check_format_key(format, format_keys)
+
+                for format in data.get('column_formats') or []:
+                    self.check_format_key(format, format_keys)
+
+            for style in worksheet.get('styles') or []:
+                self.check_format_key(style['format'], format_keys)
 
-                    if cell['format'] not in format_keys:
-                        raise ValidationError('Cell format key %s not in formats!' % cell['format'])
+        self.check_output_worksheet(
+            attrs.get('output_worksheet'), attrs['worksheets']
+        )
 
         return attrs
+
+    def check_output_worksheet(self, worksheet, worksheets):
+        if worksheet is None:
+            return
+
+        for sheet_idx, sheet in enumerate(worksheets):
+            if worksheet == sheet_idx or worksheet == sheet['label']:
+                return
+
+        raise ValidationError({
+            'output_worksheet': ['Worksheet %s does not exist.' % (worksheet,)]
+        })
+
+    def check_format_key(self, format, format_keys):
+        if format is None:
+            return
+
+        if format_keys is None:
+            raise ValidationError('formats key not in object!')
+
+        if format not in format_keys:
+            raise ValidationError('Cell format key %s not in formats!' % format)
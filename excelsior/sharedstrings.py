@@ -0,0 +1,132 @@
+from xlsxwriter.worksheet import Worksheet
+
+"""
+    Shared strings in constant_memory mode.
+    XlsxWriter writes every string inline in constant_memory mode (the
+        in_memory=False exports), so a label repeated on every row is
+        repeated in the sheet XML too.
+    StringInterner moves the strings that keep coming back to the
+        workbook's shared string table (xl/sharedStrings.xml), the long
+        tail stays inline. The table is capped, once it's full every new
+        string is written inline, so memory stays bounded however many
+        distinct strings the export holds.
+"""
+
+
+__all__ = [
+    'StringInterner', 'InterningWorksheet', 'make_interner'
+]
+
+
+class StringInterner(object):
+    """
+        Picks the strings written as shared strings of `str_table`
+            (a workbook's SharedStringTable).
+        A string is shared from its `min_count`th occurrence on. Counts
+            are kept for up to `max_candidates` strings of at most
+            `max_length` characters, past that they're halved and the
+            strings that drop to 0 forgotten, so rare strings age out.
+        The table takes at most `max_strings` strings and `max_bytes`
+            characters.
+    """
+    def __init__(self, str_table, max_strings=10000, max_bytes=1024 * 1024,
+                 min_count=2, max_candidates=50000, max_length=255):
+        self.str_table = str_table
+        self.max_strings = max_strings
+        self.max_bytes = max_bytes
+        self.min_count = min_count
+        self.max_candidates = max_candidates
+        self.max_length = max_length
+
+        self.size = 0
+        self.full = False
+        self.counts = {}
+        # NOTE: The workbook's table doubles as the set of shared strings.
+        #   Closing the workbook swaps it for a sorted list (while the
+        #   last row of every worksheet is still to be written), this
+        #   reference keeps the lookups working.
+        self._table = str_table.string_table
+
+    def _age(self):
+        self.counts = dict(
+            (string, count >> 1) for string, count in self.counts.items()
+            if count > 1
+        )
+
+    def _share(self, string):
+        index = self.str_table._get_shared_string_index(string)
+
+        self.size += len(string)
+        if (self.str_table.unique_count >= self.max_strings
+                or self.size >= self.max_bytes):
+            self.full = True
+            self.counts = {}
+
+        return index
+
+    def index(self, string):
+        """ Shared string index of the string, None to write it inline. """
+        index = self._table.get(string)
+        if index is not None:
+            self.str_table.count += 1
+            return index
+
+        if self.full or len(string) > self.max_length:
+            return None
+
+        if self.str_table.string_table is not self._table:
+            # Shared strings are final once the workbook is closing
+            self.full = True
+            return None
+
+        count = self.counts.get(string, 0) + 1
+        if count >= self.min_count:
+            self.counts.pop(string, None)
+            return self._share(string)
+
+        self.counts[string] = count
+        if len(self.counts) > self.max_candidates:
+            self._age()
+
+        return None
+
+
+class InterningWorksheet(Worksheet):
+    """
+        constant_memory worksheet writing the strings its `interner`
+            picks as shared strings.
+    """
+    interner = None
+
+    def _write_cell(self, row, col, cell):
+        if (self.interner is None or not self.constant_memory
+                or cell.__class__.__name__ != 'String'):
+            return Worksheet._write_cell(self, row, col, cell)
+
+        index = self.interner.index(cell.string)
+        if index is None:
+            return Worksheet._write_cell(self, row, col, cell)
+
+        # NOTE: Worksheet writes string cells by index outside of
+        #   constant_memory mode, the row data is already in order
+        self.constant_memory = False
+        try:
+            Worksheet._write_cell(self, row, col, cell._replace(string=index))
+        finally:
+            self.constant_memory = True
+
+
+def make_interner(wb, shared_strings):
+    """
+        StringInterner of the `shared_strings` export option: True, or
+            a dict of StringInterner options. None when it's off or
+            the workbook is not in constant_memory mode.
+    """
+    # NOTE: Outside of constant_memory mode (in_memory workbooks included)
+    #   XlsxWriter shares every string already
+    if not shared_strings or not wb.constant_memory:
+        return None
+
+    if shared_strings is True:
+        return StringInterner(wb.str_table)
+    return StringInterner(wb.str_table, **shared_strings)
@@ -0,0 +1,149 @@
+from six.moves import zip_longest
+
+"""
+    Bulk row sources for schema.Worksheet.write_rows/write_columns.
+    NumPy arrays and pandas DataFrames are recognized by duck typing,
+        neither library is required. Dates become datetime objects,
+        NaN, NaT and pandas.NA become None (a blank cell).
+"""
+
+
+__all__ = [
+    'rows_from', 'rows_from_columns', 'is_na', 'blank_na_rows'
+]
+
+
+def is_na(value):
+    """ NaN, NaT or pandas.NA, None is not. """
+    # NOTE: pandas.NA compares to NA, its truth value raises
+    if value.__class__.__name__ == 'NAType':
+        return True
+    try:
+        return bool(value != value)
+    except (TypeError, ValueError):
+        return False
+
+
+def _blank_na(values):
+    """ Nested lists with NaN/NaT/pandas.NA replaced with None. """
+    return [
+        _blank_na(value) if isinstance(value, list)
+        else (None if value is not None and is_na(value) else value)
+        for value in values
+    ]
+
+
+def blank_na_rows(rows):
+    """
+        Yields the rows with NaN/NaT/pandas.NA values replaced with None,
+            as Worksheet.write_rows leaves them out. Rows without any
+            are passed through as they are.
+    """
+    for row in rows:
+        try:
+            clean = all(value == value for value in row)
+        except TypeError:
+            # pandas.NA == NA is NA, whose truth value raises
+            clean = False
+
+        if not clean:
+            row = [
+                None if value is not None and is_na(value) else value
+                for value in row
+            ]
+        yield row
+
+
+def _is_dataframe(source):
+    return hasattr(source, 'dtypes') and hasattr(source, 'columns') \
+        and hasattr(source, 'iloc')
+
+
+def _is_ndarray(source):
+    return hasattr(source, 'dtype') and hasattr(source, 'ndim') \
+        and hasattr(source, 'tolist')
+
+
+def _array_to_list(values):
+    """
+        Converts a NumPy array to nested python lists, turning dates
+            into datetime objects and NaN/NaT into None.
+    """
+    kind = values.dtype.kind
+    if kind == 'M':
+        # NOTE: datetime64[ns] tolist() gives ints, microseconds give datetimes
+        return values.astype('datetime64[us]').tolist()
+
+    if kind == 'm':
+        return values.astype('timedelta64[us]').tolist()
+
+    if kind == 'f' or kind == 'c':
+        blanks = values != values
+        if blanks.any():
+            values = values.astype(object)
+            values[blanks] = None
+        return values.tolist()
+
+    if kind == 'O':
+        # NOTE: Elementwise != gives pandas.NA for NA elements, an array
+        #   holding them can't be tested
+        return _blank_na(values.tolist())
+
+    return values.tolist()
+
+
+def _dataframe_columns(frame):
+    columns = []
+    for idx in range(len(frame.columns)):
+        column = frame.iloc[:, idx]
+        if column.dtype.kind == 'M' and getattr(column.dt, 'tz', None) is not None:
+            # Excel has no timezones, write local wall time
+            column = column.dt.tz_localize(None)
+
+        if getattr(column.dtype, 'na_value', None) is not None:
+            # Nullable (extension) dtypes: boolean, Int64, string...
+            #   to_numpy() gives float arrays for Int64 and NA objects
+            #   for the others
+            columns.append(
+                column.to_numpy(dtype=object, na_value=None).tolist()
+            )
+            continue
+
+        columns.append(_array_to_list(column.to_numpy()))
+
+    return columns
+
+
+def rows_from(source):
+    """
+        Returns an iterable of row sequences for any iterable of rows,
+            2-D NumPy array or pandas DataFrame.
+    """
+    if _is_dataframe(source):
+        return zip(*_dataframe_columns(source))
+
+    if _is_ndarray(source):
+        if source.ndim != 2:
+            raise ValueError('Expected a 2-D array, got %d-D' % source.ndim)
+        return _array_to_list(source)
+
+    return source
+
+
+def rows_from_columns(columns):
+    """
+        Returns an iterable of rows built from column sequences, shorter
+            columns are padded with None.
+    """
+    if _is_dataframe(columns):
+        return zip(*_dataframe_columns(columns))
+
+    if _is_ndarray(columns):
+        if columns.ndim != 2:
+            raise ValueError('Expected a 2-D array, got %d-D' % columns.ndim)
+        return _array_to_list(columns.T)
+
+    return zip_longest(*[
+        _array_to_list(column) if _is_ndarray(column) else column
+        for column in columns
+    ])
@@ -0,0 +1,335 @@
+import heapq
+import struct
+import tempfile
+from array import array
+
+import six
+from six.moves import cPickle as pickle
+
+"""
+    Compact cell storage for schema.Worksheet.
+    Cells live in parallel arrays (rows, columns, interned format ids)
+        next to a plain list of values, instead of one dict per cell.
+    SpillingCellStore moves them to a temp file past a size threshold.
+"""
+
+
+__all__ = [
+    'CellStore', 'SpillingCellStore'
+]
+
+
+class CellStore(object):
+    """
+        Parallel-array cell storage. Format ids index into the workbook
+            `format_keys` list, id 0 stands for "no format".
+        Iterating yields cells as schema dicts, so the store can stand in
+            for the plain `cells` list.
+    """
+    __slots__ = ('rows', 'cols', 'values', 'format_ids', 'format_keys')
+
+    def __init__(self, format_keys):
+        self.rows = array('I')
+        self.cols = array('I')
+        self.values = []
+        self.format_ids = array('I')
+        self.format_keys = format_keys
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        format_keys = self.format_keys
+        for idx in range(len(self.values)):
+            cell = {
+                'row': self.rows[idx],
+                'col': self.cols[idx],
+                'value': self.values[idx]
+            }
+
+            format_id = self.format_ids[idx]
+            if format_id:
+                cell['format'] = format_keys[format_id]
+
+            yield cell
+
+    def append(self, row_idx, col_idx, value, format_id=0):
+        self.rows.append(row_idx)
+        self.cols.append(col_idx)
+        self.values.append(value)
+        self.format_ids.append(format_id)
+
+    def extend(self, rows, cols, values, format_ids):
+        """ Bulk append of parallel sequences. """
+        self.rows.extend(rows)
+        self.cols.extend(cols)
+        self.values.extend(values)
+        self.format_ids.extend(format_ids)
+
+    def replace(self, idx, value, format_id=0):
+        self.values[idx] = value
+        self.format_ids[idx] = format_id
+
+    def value_at(self, idx):
+        return self.values[idx]
+
+    def max_row(self):
+        return max(self.rows) if len(self.rows) else -1
+
+    def format_at(self, idx):
+        return self.format_keys[self.format_ids[idx]]
+
+    def is_sorted(self):
+        rows = self.rows
+        cols = self.cols
+        for idx in range(1, len(rows)):
+            if (rows[idx], cols[idx]) < (rows[idx - 1], cols[idx - 1]):
+                return False
+
+        return True
+
+    def iter_ordered(self, kind):
+        """
+            Yields (row, col, kind, idx, store) tuples in (row, col) order,
+                the emission stage entry shape. Ties keep insertion order.
+        """
+        rows = self.rows
+        cols = self.cols
+        order = range(len(rows))
+        if not self.is_sorted():
+            order = sorted(order, key=lambda idx: (rows[idx], cols[idx]))
+
+        for idx in order:
+            yield (rows[idx], cols[idx], kind, idx, self)
+
+
+# Spilled cell record: row, col, insertion sequence, format id, value
+#   type, 8 byte payload (the number itself or a value heap offset)
+#   and the heap entry length.
+RECORD = struct.Struct('<IIIIB8sI')
+RECORDS_PER_READ = 4096
+
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+_NO_PAYLOAD = b'\0' * 8
+
+NONE = 0
+BOOL = 1
+INT = 2
+FLOAT = 3
+TEXT = 4
+BYTES = 5
+PICKLED = 6
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _unpack_records(data):
+    if hasattr(RECORD, 'iter_unpack'):
+        return RECORD.iter_unpack(data)
+
+    # Python 2
+    return (RECORD.unpack_from(data, start)
+            for start in range(0, len(data), RECORD.size))
+
+
+class SpillingCellStore(object):
+    """
+        Cell storage bounded in memory. Cells are buffered in a CellStore
+            until `max_cells` cells or about `max_bytes` bytes of values
+            are held (None for no limit), then the buffer is sorted and written out as a run
+            of fixed-width records to a temp file in `directory`, with
+            strings and other variable sized values in a separate value
+            heap file.
+        Replaying merges the sorted runs, so cells come back in (row, col)
+            order, insertion order for cells written to the same spot.
+            Iterating yields schema dicts in that order.
+    """
+    def __init__(self, format_keys, max_cells=100000, max_bytes=None,
+                 directory=None):
+        self.format_keys = format_keys
+        self.max_cells = max_cells
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.buffer = CellStore(format_keys)
+        self.buffer_bytes = 0
+        self.spilled = 0
+        self.runs = []
+        self._max_row = -1
+        self._records = None
+        self._heap = None
+
+    def __len__(self):
+        return self.spilled + len(self.buffer)
+
+    def __iter__(self):
+        for row, col, _, _, (value, format_key) in self.iter_ordered(None):
+            cell = {
+                'row': row,
+                'col': col,
+                'value': value
+            }
+            if format_key is not None:
+                cell['format'] = format_key
+
+            yield cell
+
+    def _value_size(self, value):
+        if isinstance(value, six.string_types):
+            return len(value)
+        return 8
+
+    def append(self, row_idx, col_idx, value, format_id=0):
+        self.buffer.append(row_idx, col_idx, value, format_id)
+        if row_idx > self._max_row:
+            self._max_row = row_idx
+        if self.max_bytes is not None:
+            self.buffer_bytes += self._value_size(value)
+
+        self._maybe_spill()
+
+    def extend(self, rows, cols, values, format_ids):
+        """ Bulk append of parallel sequences. """
+        self.buffer.extend(rows, cols, values, format_ids)
+        if len(rows):
+            self._max_row = max(self._max_row, max(rows))
+        if self.max_bytes is not None:
+            self.buffer_bytes += sum(self._value_size(value) for value in values)
+
+        self._maybe_spill()
+
+    def max_row(self):
+        return self._max_row
+
+    def _maybe_spill(self):
+        if ((self.max_cells is not None and len(self.buffer) >= self.max_cells)
+                or (self.max_bytes is not None
+                    and self.buffer_bytes >= self.max_bytes)):
+            self.spill()
+
+    def _encode(self, value, heap):
+        if value is None:
+            return NONE, _NO_PAYLOAD, 0
+        if isinstance(value, bool):
+            return BOOL, _INT64.pack(value), 0
+        if (isinstance(value, six.integer_types)
+                and _INT64_MIN <= value <= _INT64_MAX):
+            return INT, _INT64.pack(value), 0
+        if isinstance(value, float):
+            return FLOAT, _DOUBLE.pack(value), 0
+
+        if isinstance(value, six.text_type):
+            kind, data = TEXT, value.encode('utf-8')
+        elif isinstance(value, six.binary_type):
+            kind, data = BYTES, value
+        else:
+            kind, data = PICKLED, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        offset = heap.tell()
+        heap.write(data)
+        return kind, _INT64.pack(offset), len(data)
+
+    def _decode(self, kind, payload, length):
+        if kind == NONE:
+            return None
+        if kind == BOOL:
+            return bool(_INT64.unpack(payload)[0])
+        if kind == INT:
+            return _INT64.unpack(payload)[0]
+        if kind == FLOAT:
+            return _DOUBLE.unpack(payload)[0]
+
+        self._heap.seek(_INT64.unpack(payload)[0])
+        data = self._heap.read(length)
+        if kind == TEXT:
+            return data.decode('utf-8')
+        if kind == BYTES:
+            return data
+        return pickle.loads(data)
+
+    def spill(self):
+        """ Writes the buffered cells out as a sorted run. """
+        buffer = self.buffer
+        if len(buffer) == 0:
+            return
+
+        if self._records is None:
+            self._records = tempfile.TemporaryFile(dir=self.directory)
+            self._heap = tempfile.TemporaryFile(dir=self.directory)
+
+        records = self._records
+        heap = self._heap
+        records.seek(0, 2)
+        heap.seek(0, 2)
+
+        rows = buffer.rows
+        cols = buffer.cols
+        # NOTE: sorted() is stable, same-spot cells keep insertion order
+        order = sorted(
+            range(len(rows)), key=lambda idx: (rows[idx], cols[idx])
+        )
+
+        offset = records.tell()
+        pack = RECORD.pack
+        chunk = []
+        for idx in order:
+            kind, payload, length = self._encode(buffer.values[idx], heap)
+            chunk.append(pack(
+                rows[idx], cols[idx], self.spilled + idx,
+                buffer.format_ids[idx], kind, payload, length
+            ))
+            if len(chunk) == RECORDS_PER_READ:
+                records.write(b''.join(chunk))
+                chunk = []
+        records.write(b''.join(chunk))
+
+        self.runs.append((offset, len(order)))
+        self.spilled += len(order)
+        self.buffer = CellStore(self.format_keys)
+        self.buffer_bytes = 0
+
+    def _iter_run(self, offset, count):
+        records = self._records
+        size = RECORD.size
+        position = offset
+        end = offset + count * size
+        while position < end:
+            records.seek(position)
+            data = records.read(min(RECORDS_PER_READ * size, end - position))
+            position += len(data)
+            for row, col, seq, format_id, kind, payload, length \
+                    in _unpack_records(data):
+                yield (row, col, seq, format_id,
+                       self._decode(kind, payload, length))
+
+    def _iter_buffer(self):
+        buffer = self.buffer
+        rows = buffer.rows
+        cols = buffer.cols
+        order = range(len(rows))
+        if not buffer.is_sorted():
+            order = sorted(order, key=lambda idx: (rows[idx], cols[idx]))
+
+        for idx in order:
+            yield (rows[idx], cols[idx], self.spilled + idx,
+                   buffer.format_ids[idx], buffer.values[idx])
+
+    def iter_ordered(self, kind):
+        """
+            Yields (row, col, kind, seq, (value, format key)) tuples in
+                (row, col) order, the emission stage entry shape.
+        """
+        if self.runs and self._records is None:
+            raise ValueError('The spilled cells were released by close().')
+        streams = [self._iter_run(offset, count) for offset, count in self.runs]
+        streams.append(self._iter_buffer())
+        format_keys = self.format_keys
+        for row, col, seq, format_id, value in heapq.merge(*streams):
+            yield (row, col, kind, seq, (value, format_keys[format_id]))
+
+    def close(self):
+        for temp in (self._records, self._heap):
+            if temp is not None:
+                temp.close()
+        self._records = self._heap = None
@@ -0,0 +1,344 @@
+import six
+from xlsxwriter.utility import xl_rowcol_to_cell
+
+from .emission import (
+    DATA_ROW, FORMULA_TEMPLATE, CELL, STORED_CELL, SPILLED_CELL, FORMULA
+)
+
+"""
+    Rule-based worksheet styling.
+    A worksheet's `styles` section lists rules giving a format to a range
+        of cells instead of a format key on every cell:
+
+            {
+                "format": "stripe",
+                "first_row": 1, "last_row": null,
+                "first_col": 0, "last_col": null,
+                "row_step": 2,
+                "criteria": "<", "value": 0,
+                "mode": "conditional"
+            }
+
+        Everything but the format is optional. Missing last_row/last_col
+        extend the range to the last written row/column, row_step picks
+        every row_step'th row from first_row, criteria (one of CRITERIA,
+        with `value` or `minimum`/`maximum` for the ranges) matches number
+        values only.
+    Rules are applied one of two ways (`mode`):
+        - conditional: compiled into an Excel conditional format over the
+          range, nothing is done per cell. Used by default when the
+          format only has properties conditional formats support
+          (DXF_PROPERTIES): font color and style, number format, fill,
+          borders. Layered over the cells' own formats, blank cells
+          of the range are styled as well,
+        - cells: evaluated in bulk while the rows are emitted, cells,
+          data rows and formulas written without a format of their own
+          get the first matching rule's format. Blank cells stay blank.
+"""
+
+
+__all__ = [
+    'CRITERIA', 'DXF_PROPERTIES', 'MODES', 'StyleRules', 'rule_mode',
+    'split_styles', 'add_conditional_styles', 'conditional_format_keys'
+]
+
+
+empty_list = []
+
+CONDITIONAL = 'conditional'
+CELLS = 'cells'
+MODES = (CONDITIONAL, CELLS)
+
+# Value criteria -> Excel formula operator
+CRITERIA = {
+    '==': '=',
+    '!=': '<>',
+    '>': '>',
+    '<': '<',
+    '>=': '>=',
+    '<=': '<=',
+    'between': None,
+    'not between': None,
+}
+
+# Format properties Excel conditional formats (DXF records) support
+DXF_PROPERTIES = frozenset((
+    'font_color', 'bold', 'italic', 'underline', 'font_strikeout',
+    'num_format', 'pattern', 'bg_color', 'fg_color', 'border', 'bottom',
+    'top', 'left', 'right', 'border_color', 'bottom_color', 'top_color',
+    'left_color', 'right_color',
+))
+
+# Formulas have no value the criteria can test
+_NO_VALUE = object()
+
+_number_types = six.integer_types + (float,)
+
+
+def _is_number(value):
+    return isinstance(value, _number_types) and not isinstance(value, bool)
+
+
+def _value_test(rule):
+    """ Predicate of the rule's criteria, None when it has none. """
+    criteria = rule.get('criteria')
+    if criteria is None:
+        return None
+
+    if criteria in ('between', 'not between'):
+        minimum = rule['minimum']
+        maximum = rule['maximum']
+        inside = criteria == 'between'
+        return lambda value: (minimum <= value <= maximum) == inside
+
+    limit = rule['value']
+    return {
+        '==': lambda value: value == limit,
+        '!=': lambda value: value != limit,
+        '>': lambda value: value > limit,
+        '<': lambda value: value < limit,
+        '>=': lambda value: value >= limit,
+        '<=': lambda value: value <= limit,
+    }[criteria]
+
+
+def rule_mode(rule, specs):
+    """
+        `conditional` or `cells`, the rule's own mode or the one
+            its format spec allows.
+    """
+    mode = rule.get('mode')
+    if mode is not None:
+        return mode
+
+    spec = specs.get(rule['format']) or {}
+    for key, value in six.iteritems(spec):
+        if value is not None and key not in DXF_PROPERTIES:
+            return CELLS
+    return CONDITIONAL
+
+
+class _CellRule(object):
+    __slots__ = (
+        'format', 'first_row', 'last_row', 'first_col', 'last_col',
+        'row_step', 'test'
+    )
+
+    def __init__(self, rule):
+        self.format = rule['format']
+        self.first_row = rule.get('first_row') or 0
+        self.last_row = rule.get('last_row')
+        self.first_col = rule.get('first_col') or 0
+        self.last_col = rule.get('last_col')
+        self.row_step = rule.get('row_step')
+        self.test = _value_test(rule)
+
+    def on_row(self, row):
+        if row < self.first_row:
+            return False
+        if self.last_row is not None and row > self.last_row:
+            return False
+        return self.row_step is None \
+            or (row - self.first_row) % self.row_step == 0
+
+    def on_col(self, col):
+        return col >= self.first_col \
+            and (self.last_col is None or col <= self.last_col)
+
+
+class StyleRules(object):
+    """
+        Rules evaluated while the rows are emitted (the `cells` mode),
+            see emission.write_sheet_data. Explicit formats (the entry's
+            own, or a data block's row/column formats) always win.
+    """
+    def __init__(self, rules):
+        self.rules = [_CellRule(rule) for rule in rules]
+        self._templates = {}
+
+    def format_at(self, row, col, value=_NO_VALUE):
+        """ Format key of the first rule matching the cell, or None. """
+        for rule in self.rules:
+            if not (rule.on_row(row) and rule.on_col(col)):
+                continue
+            if rule.test is None:
+                return rule.format
+            if value is not _NO_VALUE and _is_number(value) and rule.test(value):
+                return rule.format
+        return None
+
+    def row_formats(self, row, col, values, row_formats, column_formats):
+        """
+            Format keys of a data row with the rules filled in, None when
+                no rule applies to the row.
+        """
+        rules = [rule for rule in self.rules if rule.on_row(row)]
+        if not rules:
+            return None
+
+        row_formats = row_formats or empty_list
+        row_formats_count = len(row_formats)
+        column_formats_count = len(column_formats)
+        formats = []
+        for idx, value in enumerate(values):
+            format = row_formats[idx] if idx < row_formats_count else None
+            if value is None:
+                formats.append(format)
+                continue
+
+            if format is None and idx < column_formats_count:
+                format = column_formats[idx]
+            if format is None:
+                for rule in rules:
+                    if rule.on_col(col + idx) and (
+                            rule.test is None
+                            or (_is_number(value) and rule.test(value))):
+                        format = rule.format
+                        break
+            formats.append(format)
+
+        return formats
+
+    def _template(self, template, format):
+        key = (template, format)
+        styled = self._templates.get(key)
+        if styled is None:
+            styled = template.with_format(format)
+            self._templates[key] = styled
+        return styled
+
+    def restyle(self, entries):
+        """
+            Passes a (row, col, kind, idx, entry) stream through, entries
+                the rules style are replaced with styled ones.
+        """
+        for row, col, kind, idx, entry in entries:
+            if kind == DATA_ROW:
+                formats = self.row_formats(row, col, *entry)
+                if formats is not None:
+                    entry = (entry[0], formats, empty_list)
+            elif kind == CELL:
+                if entry.get('format') is None and entry['value'] is not None:
+                    format = self.format_at(row, col, entry['value'])
+                    if format is not None:
+                        kind, entry = SPILLED_CELL, (entry['value'], format)
+            elif kind == STORED_CELL:
+                value = entry.value_at(idx)
+                if entry.format_at(idx) is None and value is not None:
+                    format = self.format_at(row, col, value)
+                    if format is not None:
+                        kind, entry = SPILLED_CELL, (value, format)
+            elif kind == SPILLED_CELL:
+                value, format = entry
+                if format is None and value is not None:
+                    format = self.format_at(row, col, value)
+                    if format is not None:
+                        entry = (value, format)
+            elif kind == FORMULA:
+                if entry.get('format') is None:
+                    format = self.format_at(row, col)
+                    if format is not None:
+                        entry = dict(entry, format=format)
+            elif kind == FORMULA_TEMPLATE:
+                if entry.format is None:
+                    format = self.format_at(row, col)
+                    if format is not None:
+                        entry = self._template(entry, format)
+
+            yield row, col, kind, idx, entry
+
+
+def split_styles(rules, specs):
+    """
+        Returns (conditional rules, StyleRules of the cells mode ones
+            or None).
+    """
+    conditional = []
+    cells = []
+    for rule in rules or empty_list:
+        if rule_mode(rule, specs) == CONDITIONAL:
+            conditional.append(rule)
+        else:
+            cells.append(rule)
+
+    return conditional, (StyleRules(cells) if cells else None)
+
+
+def _number(value):
+    # NOTE: str() rounds floats to 12 digits on py2
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _criteria_formula(cell, rule):
+    criteria = rule['criteria']
+    if criteria == 'between':
+        return 'AND(%s>=%s,%s<=%s)' % (
+            cell, _number(rule['minimum']), cell, _number(rule['maximum'])
+        )
+    if criteria == 'not between':
+        return 'OR(%s<%s,%s>%s)' % (
+            cell, _number(rule['minimum']), cell, _number(rule['maximum'])
+        )
+    return '%s%s%s' % (cell, CRITERIA[criteria], _number(rule['value']))
+
+
+def _rule_formula(rule, first_row, first_col):
+    """
+        Conditional format formula of the rule, relative to the top left
+            cell of its range.
+    """
+    conditions = []
+    if rule.get('row_step'):
+        conditions.append(
+            'MOD(ROW()-%d,%d)=0' % (first_row + 1, rule['row_step'])
+        )
+
+    if rule.get('criteria') is not None:
+        cell = xl_rowcol_to_cell(first_row, first_col)
+        # NOTE: Number cells only, as in the cells mode. Excel compares
+        #   text and blanks to numbers too.
+        conditions.append('ISNUMBER(%s)' % cell)
+        conditions.append(_criteria_formula(cell, rule))
+
+    if not conditions:
+        return '=TRUE'
+    if len(conditions) == 1:
+        return '=' + conditions[0]
+    return '=AND(%s)' % ','.join(conditions)
+
+
+def add_conditional_styles(worksheet, rules, added_formats):
+    """
+        Adds the conditional format of every rule. Call it once the data
+            is written, open ranges end at the last written row/column
+            and rules past the written range are left out.
+    """
+    for rule in rules:
+        first_row = rule.get('first_row') or 0
+        first_col = rule.get('first_col') or 0
+        last_row = rule.get('last_row')
+        if last_row is None:
+            last_row = worksheet.dim_rowmax
+        last_col = rule.get('last_col')
+        if last_col is None:
+            last_col = worksheet.dim_colmax
+
+        if last_row is None or last_col is None \
+                or last_row < first_row or last_col < first_col:
+            continue
+
+        worksheet.conditional_format(first_row, first_col, last_row, last_col, {
+            'type': 'formula',
+            'criteria': _rule_formula(rule, first_row, first_col),
+            'format': added_formats.get(rule['format'], None)
+        })
+
+
+def conditional_format_keys(worksheets, specs):
+    """ Format keys the worksheets' conditional rules use. """
+    keys = set()
+    for sheet in worksheets:
+        for rule in sheet.get('styles') or empty_list:
+            if rule_mode(rule, specs) == CONDITIONAL:
+                keys.add(rule['format'])
+    return keys
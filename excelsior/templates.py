@@ -0,0 +1,261 @@
+import copy
+import threading
+
+import six
+from rest_framework.exceptions import ValidationError
+
+from .formats import NormalizedFormats
+from .schema import ExportError
+from .validators import (
+    validate_schema, validate_filename, validate_output, validate_worksheet
+)
+
+"""
+    Server-side registered export templates.
+    A template is the static part of an export schema (formats, column
+        widths, header cells, frozen panes, autofilters, tables...),
+        validated and compiled once when it's registered. Requests then
+        only carry the template name and the data of each worksheet:
+
+            {
+                "template": "orders",
+                "filename": "orders-2020.xlsx",
+                "worksheets": [
+                    {"data": {"first_row": 1, "rows": [...]}}
+                ]
+            }
+
+        Request worksheets line up with the template's worksheets, the
+        ones left out are rendered from the template alone. Only their
+        data sections (DATA_SECTIONS) are validated per request.
+"""
+
+
+__all__ = [
+    'DATA_SECTIONS', 'ExportTemplate', 'TemplateRegistry',
+    'get_default_registry', 'register_template'
+]
+
+
+empty_list = []
+
+# Worksheet sections a template request may fill in, they're appended
+#   to the template's own entries
+DATA_SECTIONS = (
+    'cells', 'data', 'formulas', 'formula_templates', 'hyperlinks',
+    'merged_cells', 'images'
+)
+
+
+def _fail(path, message):
+    raise ValidationError({path: [message]})
+
+
+def _cell_position(cell):
+    return (cell['row'], cell['col'])
+
+
+def _iter_merged_cells(static, cells):
+    """
+        Merges the template's sorted cells into an ordered stream of
+            request cells, template cells go first on the same spot.
+    """
+    static = iter(static)
+    pending = next(static, None)
+    for cell in cells:
+        position = _cell_position(cell)
+        while pending is not None and _cell_position(pending) <= position:
+            yield pending
+            pending = next(static, None)
+        yield cell
+
+    if pending is not None:
+        yield pending
+        for cell in static:
+            yield cell
+
+
+class ExportTemplate(object):
+    """
+        Compiled static part of an export schema.
+        `schema` is an export schema (or a WorkbookBuilder) whose
+            worksheets may leave out their cells. Templates can't hold
+            columnar `data` blocks, those come with the requests.
+        Raises ExportError or rest_framework ValidationError when the
+            schema is not valid.
+    """
+    def __init__(self, name, schema):
+        if hasattr(schema, 'as_dict'):
+            schema = schema.as_dict()
+
+        worksheets = list(schema.get('worksheets') or empty_list)
+        if not worksheets:
+            raise ExportError('Template %s has no worksheets.' % name)
+
+        for sheet in worksheets:
+            if 'data' in sheet:
+                raise ExportError(
+                    'Template %s worksheet %s has a data block, data goes '
+                    'with the requests.' % (name, sheet.get('label'))
+                )
+
+        # NOTE: Checked once, requests only bring data sections
+        validate_schema(dict(
+            schema,
+            filename=schema.get('filename') or name,
+            worksheets=[dict(sheet, cells=sheet.get('cells') or empty_list)
+                        for sheet in worksheets]
+        ))
+
+        self.name = name
+        self.filename = schema.get('filename')
+        self.formats = NormalizedFormats(schema.get('formats') or {})
+        self.worksheets = [self._compile_worksheet(sheet) for sheet in worksheets]
+
+    def _compile_worksheet(self, sheet):
+        sheet = dict(sheet)
+        if sheet.get('cells'):
+            sheet['cells'] = sorted(sheet['cells'], key=_cell_position)
+        else:
+            sheet.pop('cells', None)
+        return sheet
+
+    def validate_worksheet(self, path, sheet_idx, sheet, lazy=None):
+        """
+            Validates the data sections of the sheet_idx'th request
+                worksheet, see validators.validate_worksheet.
+        """
+        if sheet_idx >= len(self.worksheets):
+            _fail(path, 'Template %s has %d worksheets.'
+                        % (self.name, len(self.worksheets)))
+
+        if not isinstance(sheet, dict):
+            _fail(path, 'Expected a dictionary of items.')
+
+        for key in sheet:
+            if key not in DATA_SECTIONS:
+                _fail('%s.%s' % (path, key),
+                      'Defined by template %s.' % self.name)
+
+        sheet = dict(sheet, label=self.worksheets[sheet_idx]['label'])
+        if 'cells' not in sheet and 'data' not in sheet:
+            sheet['cells'] = empty_list
+        validate_worksheet(path, sheet, self.formats, lazy)
+
+    def merge_worksheet(self, sheet_idx, sheet=None):
+        """
+            Worksheet schema of the template's sheet_idx'th worksheet
+                with the request's data sections appended.
+        """
+        merged = dict(self.worksheets[sheet_idx])
+        if 'tables' in merged:
+            # NOTE: create_sheet resolves table formats in place
+            merged['tables'] = copy.deepcopy(merged['tables'])
+
+        for key, entries in six.iteritems(sheet or {}):
+            static = merged.get(key)
+            if not static:
+                merged[key] = entries
+            elif key == 'cells' and not isinstance(entries, list):
+                merged[key] = _iter_merged_cells(static, entries)
+            else:
+                merged[key] = static + entries
+
+        return merged
+
+    def merge(self, schema):
+        """
+            Export schema of a template request, see the module docs.
+            Raises rest_framework ValidationError for invalid requests.
+        """
+        if not isinstance(schema, dict):
+            raise ValidationError('Expected a dictionary of items.')
+
+        if 'formats' in schema:
+            _fail('formats', 'Defined by template %s.' % self.name)
+        validate_output(schema)
+
+        worksheets = schema.get('worksheets', empty_list)
+        if not isinstance(worksheets, list):
+            _fail('worksheets', 'Expected a list of items.')
+
+        for sheet_idx, sheet in enumerate(worksheets):
+            self.validate_worksheet(
+                'worksheets[%d]' % sheet_idx, sheet_idx, sheet
+            )
+
+        sheets = [self.merge_worksheet(sheet_idx, sheet)
+                  for sheet_idx, sheet in enumerate(worksheets)]
+        sheets.extend(self.remaining_worksheets(len(worksheets)))
+
+        merged = {
+            'filename': validate_filename(
+                schema.get('filename') or self.filename
+            ),
+            'formats': self.formats,
+            'worksheets': sheets
+        }
+        for key in ('output', 'output_worksheet'):
+            if schema.get(key) is not None:
+                merged[key] = schema[key]
+
+        return merged
+
+    def remaining_worksheets(self, count):
+        """ Template worksheets following the first `count` ones. """
+        for sheet_idx in range(count, len(self.worksheets)):
+            yield self.merge_worksheet(sheet_idx)
+
+
+class TemplateRegistry(object):
+    """
+        Named export templates. Register templates at startup (e.g. in
+            an AppConfig.ready()), registering a name again replaces it.
+    """
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._templates
+
+    def register(self, name, schema):
+        template = ExportTemplate(name, schema)
+        with self._lock:
+            self._templates[name] = template
+        return template
+
+    def unregister(self, name):
+        with self._lock:
+            self._templates.pop(name, None)
+
+    def get(self, name):
+        return self._templates.get(name)
+
+    def resolve(self, name):
+        """
+            Template of a request, raises rest_framework ValidationError
+                for unknown names.
+        """
+        template = None
+        if isinstance(name, six.string_types):
+            template = self.get(name)
+        if template is None:
+            _fail('template', 'Unknown export template %s.' % (name,))
+        return template
+
+
+_default_registry = None
+
+
+def get_default_registry():
+    """ Process wide TemplateRegistry. """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = TemplateRegistry()
+    return _default_registry
+
+
+def register_template(name, schema):
+    """ Registers a template with the default registry. """
+    return get_default_registry().register(name, schema)
@@ -0,0 +1,487 @@
+import re
+
+import six
+from rest_framework.exceptions import ValidationError
+
+from .styles import CRITERIA, MODES
+
+"""
+    Fast path schema validation.
+    Checks the same constraints as serializers.ExcelExportSerializer
+        in a single pass over the schema without building serializer
+        fields or intermediate dicts. The schema is returned as it is,
+        so it can be handed straight to builder.create_sheet. Only
+        integer fields given as int-like strings or floats ("3", 3.0)
+        are replaced in place by their int, as the serializer's
+        IntegerFields coerce them.
+"""
+
+
+__all__ = [
+    'validate_schema', 'validate_filename', 'validate_formats',
+    'validate_output', 'validate_output_worksheet', 'validate_worksheet',
+    'iter_valid_cells', 'iter_valid_rows'
+]
+
+
+_integer_types = six.integer_types
+
+# Renderers of the schema `output` flag, see excelsior.delimited
+OUTPUTS = ('xlsx', 'csv', 'tsv')
+
+
+# IntegerField's trailing decimal zeros
+_decimal = re.compile(r'\.0*\s*$')
+
+
+def _fail(path, message):
+    raise ValidationError({path: [message]})
+
+
+def _to_int(value):
+    """ int of an int-like string or float, None for anything else. """
+    if not isinstance(value, six.string_types + (float,)):
+        return None
+
+    try:
+        return int(_decimal.sub('', six.text_type(value)))
+    except ValueError:
+        return None
+
+
+def _check_field(path, entry, key, check, message):
+    """
+        Fails unless entry[key] passes the check, int-like values of
+            integer fields are coerced in place first.
+    """
+    value = entry.get(key)
+    if check(value):
+        return
+
+    value = _to_int(value)
+    if value is None or not check(value):
+        _fail(path, message)
+    entry[key] = value
+
+
+def _index(value):
+    """ Non-negative int, bools are rejected. """
+    return (isinstance(value, _integer_types)
+            and not isinstance(value, bool) and value >= 0)
+
+
+def _integer(value):
+    return isinstance(value, _integer_types) and not isinstance(value, bool)
+
+
+def _string(max_length):
+    def check(value):
+        return (isinstance(value, six.string_types)
+                and len(value) <= max_length)
+    return check
+
+
+def _dict(value):
+    return isinstance(value, dict)
+
+
+_INDEX = (_index, 'Ensure this value is a non-negative integer.')
+_INTEGER = (_integer, 'A valid integer is required.')
+_DICT = (_dict, 'Expected a dictionary of items.')
+_STRING_255 = (_string(255), 'Expected a string of at most 255 characters.')
+_STRING_1024 = (_string(1024), 'Expected a string of at most 1024 characters.')
+
+
+# Compiled section specs:
+#   section -> (required fields, optional fields, nullable fields)
+#   every field is (key, (check, message)). Format keys are checked
+#   separately against the workbook formats.
+_sections = (
+    ('columns', (
+        (('first_col', _INDEX), ('last_col', _INDEX), ('width', _INDEX)),
+        (('options', _DICT),),
+        (),
+    )),
+    ('rows', (
+        (('row', _INDEX), ('height', _INDEX)),
+        (('options', _DICT),),
+        (),
+    )),
+    ('formulas', (
+        (('row', _INDEX), ('col', _INDEX), ('formula', _STRING_1024)),
+        (('default_value', _INTEGER),),
+        (),
+    )),
+    ('formula_templates', (
+        (('template', _STRING_1024), ('col', _INDEX),
+         ('first_row', _INDEX), ('last_row', _INDEX)),
+        (('default_value', _INTEGER),),
+        (),
+    )),
+    ('images', (
+        (('row', _INDEX), ('col', _INDEX), ('url', _STRING_1024)),
+        (('options', _DICT),),
+        (),
+    )),
+    ('hyperlinks', (
+        (('row', _INDEX), ('col', _INDEX), ('url', _STRING_255)),
+        (),
+        (('label', _STRING_255), ('tip', _STRING_255)),
+    )),
+    ('tables', (
+        (('first_row', _INDEX), ('first_col', _INDEX),
+         ('last_row', _INDEX), ('last_col', _INDEX)),
+        (('options', _DICT),),
+        (),
+    )),
+    ('merged_cells', (
+        (('first_row', _INDEX), ('first_col', _INDEX),
+         ('last_row', _INDEX), ('last_col', _INDEX)),
+        (),
+        (),
+    )),
+    ('autofilters', (
+        (('first_row', _INDEX), ('first_col', _INDEX),
+         ('last_row', _INDEX), ('last_col', _INDEX)),
+        (),
+        (),
+    )),
+    ('frozen_panes', (
+        (('row', _INDEX), ('col', _INDEX),
+         ('top_row', _INDEX), ('left_col', _INDEX)),
+        (),
+        (),
+    )),
+)
+
+
+_section_specs = dict(_sections)
+
+
+def _width(value):
+    return (isinstance(value, _integer_types + (float,))
+            and not isinstance(value, bool) and value >= 0)
+
+
+def _validate_autofit(path, autofit):
+    if isinstance(autofit, bool):
+        return
+
+    message = 'Expected a boolean or a dictionary of min_width/max_width.'
+    if not isinstance(autofit, dict) \
+            or set(autofit) - set(('min_width', 'max_width')):
+        _fail(path, message)
+
+    for key in ('min_width', 'max_width'):
+        value = autofit.get(key)
+        if value is not None and not _width(value):
+            _fail('%s.%s' % (path, key), message)
+
+    min_width = autofit.get('min_width')
+    max_width = autofit.get('max_width')
+    if min_width is not None and max_width is not None \
+            and min_width > max_width:
+        _fail(path + '.max_width', 'Ensure min_width is not greater than max_width.')
+
+
+def _number(value):
+    return (isinstance(value, _integer_types + (float,))
+            and not isinstance(value, bool))
+
+
+_STYLE_FIELDS = (
+    ('first_row', _INDEX), ('first_col', _INDEX),
+    ('last_row', _INDEX), ('last_col', _INDEX),
+    ('row_step', (lambda value: _index(value) and value > 0,
+                  'Ensure this value is a positive integer.')),
+)
+
+
+def _validate_styles(path, styles, formats):
+    if not isinstance(styles, list):
+        _fail(path, 'Expected a list of items.')
+
+    for idx, style in enumerate(styles):
+        style_path = '%s[%d]' % (path, idx)
+        if not isinstance(style, dict):
+            _fail(style_path, 'Expected a dictionary of items.')
+
+        if style.get('format') is None:
+            _fail(style_path + '.format', 'This field is required.')
+        _check_format(style_path, style, formats)
+
+        for key, (check, message) in _STYLE_FIELDS:
+            if style.get(key) is not None:
+                _check_field(
+                    '%s.%s' % (style_path, key), style, key, check, message
+                )
+
+        mode = style.get('mode')
+        if mode is not None and mode not in MODES:
+            _fail(style_path + '.mode',
+                  'Expected one of %s.' % ', '.join(MODES))
+
+        criteria = style.get('criteria')
+        if criteria is None:
+            continue
+        if criteria not in CRITERIA:
+            _fail(style_path + '.criteria',
+                  'Expected one of %s.' % ', '.join(sorted(CRITERIA)))
+
+        if criteria in ('between', 'not between'):
+            keys = ('minimum', 'maximum')
+        else:
+            keys = ('value',)
+        for key in keys:
+            if not _number(style.get(key)):
+                _fail('%s.%s' % (style_path, key),
+                      'A valid number is required.')
+
+
+def _check_format(path, entry, formats):
+    format = entry.get('format')
+    if format is None:
+        return
+
+    if not isinstance(format, six.string_types) or len(format) > 255:
+        _fail(path + '.format', 'Expected a string of at most 255 characters.')
+
+    if formats is None:
+        raise ValidationError('formats key not in object!')
+
+    if format not in formats:
+        raise ValidationError('Cell format key %s not in formats!' % format)
+
+
+def _validate_cells(path, cells, formats):
+    if not isinstance(cells, list):
+        _fail(path, 'Expected a list of items.')
+
+    for cell in iter_valid_cells(path, cells, formats):
+        pass
+
+
+def iter_valid_cells(path, cells, formats):
+    """
+        Yields cells of any iterable, checking each one on the way.
+    """
+    # NOTE: Hot loop, keep it free of per-cell helper calls
+    for idx, cell in enumerate(cells):
+        if not isinstance(cell, dict):
+            _fail('%s[%d]' % (path, idx), 'Expected a dictionary of items.')
+
+        row = cell.get('row')
+        col = cell.get('col')
+        if (not isinstance(row, _integer_types) or isinstance(row, bool)
+                or row < 0):
+            _check_field('%s[%d].row' % (path, idx), cell, 'row', *_INDEX)
+        if (not isinstance(col, _integer_types) or isinstance(col, bool)
+                or col < 0):
+            _check_field('%s[%d].col' % (path, idx), cell, 'col', *_INDEX)
+
+        format = cell.get('format')
+        if format is not None and (
+                formats is None
+                or not isinstance(format, six.string_types)
+                or format not in formats):
+            _check_format('%s[%d]' % (path, idx), cell, formats)
+
+        yield cell
+
+
+def iter_valid_rows(path, rows):
+    """
+        Yields row arrays of a columnar data block, checking each one.
+    """
+    for idx, values in enumerate(rows):
+        if not isinstance(values, list):
+            _fail('%s[%d]' % (path, idx), 'Expected a list of items.')
+
+        yield values
+
+
+def _validate_format_keys(path, keys, formats):
+    if not isinstance(keys, list):
+        _fail(path, 'Expected a list of items.')
+
+    for idx, format in enumerate(keys):
+        if format is not None:
+            _check_format('%s[%d]' % (path, idx), {'format': format}, formats)
+
+
+def _validate_data(path, data, formats, lazy_rows=False):
+    if not isinstance(data, dict):
+        _fail(path, 'Expected a dictionary of items.')
+
+    for key in ('first_row', 'first_col'):
+        if key in data:
+            _check_field('%s.%s' % (path, key), data, key, *_INDEX)
+
+    if not lazy_rows:
+        rows = data.get('rows')
+        if not isinstance(rows, list):
+            _fail(path + '.rows', 'Expected a list of items.')
+
+        for values in iter_valid_rows(path + '.rows', rows):
+            pass
+
+    row_formats = data.get('formats')
+    if row_formats is not None:
+        if not isinstance(row_formats, list):
+            _fail(path + '.formats', 'Expected a list of items.')
+
+        for idx, keys in enumerate(row_formats):
+            if keys is not None:
+                _validate_format_keys(
+                    '%s.formats[%d]' % (path, idx), keys, formats
+                )
+
+    column_formats = data.get('column_formats')
+    if column_formats is not None:
+        _validate_format_keys(path + '.column_formats', column_formats, formats)
+
+
+def _validate_section(path, entries, spec, formats):
+    if not isinstance(entries, list):
+        _fail(path, 'Expected a list of items.')
+
+    for idx, entry in enumerate(entries):
+        _validate_entry('%s[%d]' % (path, idx), entry, spec, formats)
+
+
+def _validate_entry(path, entry, spec, formats):
+    if not isinstance(entry, dict):
+        _fail(path, 'Expected a dictionary of items.')
+
+    required, optional, nullable = spec
+    for key, (check, message) in required:
+        if key not in entry:
+            _fail('%s.%s' % (path, key), 'This field is required.')
+        _check_field('%s.%s' % (path, key), entry, key, check, message)
+
+    for key, (check, message) in optional:
+        if key in entry:
+            _check_field('%s.%s' % (path, key), entry, key, check, message)
+
+    for key, (check, message) in nullable:
+        if entry.get(key) is not None:
+            _check_field('%s.%s' % (path, key), entry, key, check, message)
+
+    if 'format' in entry:
+        _check_format(path, entry, formats)
+
+
+def validate_schema(schema):
+    """
+        Validates the exporting schema and returns it as is.
+        Raises rest_framework ValidationError on the first problem found.
+    """
+    if not isinstance(schema, dict):
+        raise ValidationError('Expected a dictionary of items.')
+
+    validate_filename(schema.get('filename'))
+    formats = validate_formats(schema.get('formats'))
+    validate_output(schema)
+
+    worksheets = schema.get('worksheets')
+    if not isinstance(worksheets, list):
+        _fail('worksheets', 'Expected a list of items.')
+
+    for sheet_idx, sheet in enumerate(worksheets):
+        validate_worksheet('worksheets[%d]' % sheet_idx, sheet, formats)
+
+    validate_output_worksheet(schema.get('output_worksheet'), worksheets)
+
+    return schema
+
+
+def validate_output_worksheet(worksheet, worksheets):
+    """ Checks the `output_worksheet` label or index names a worksheet. """
+    if worksheet is None:
+        return
+
+    for sheet_idx, sheet in enumerate(worksheets):
+        if worksheet == sheet_idx or worksheet == sheet['label']:
+            return
+
+    _fail('output_worksheet', 'Worksheet %s does not exist.' % (worksheet,))
+
+
+def validate_filename(filename):
+    if not _STRING_255[0](filename):
+        _fail('filename', _STRING_255[1])
+
+    return filename
+
+
+def validate_formats(formats):
+    if formats is not None and not isinstance(formats, dict):
+        _fail('formats', 'Expected a dictionary of items.')
+
+    return formats
+
+
+def validate_output(schema):
+    """
+        Checks the `output` renderer flag and the `output_worksheet`
+            (label or index) delimited outputs render.
+    """
+    output = schema.get('output')
+    if output is not None and output not in OUTPUTS:
+        _fail('output', 'Expected one of %s.' % ', '.join(OUTPUTS))
+
+    worksheet = schema.get('output_worksheet')
+    if worksheet is not None and not (
+            _index(worksheet) or _STRING_255[0](worksheet)):
+        _fail('output_worksheet',
+              'Expected a worksheet label or a non-negative integer.')
+
+    return schema
+
+
+def validate_worksheet(path, sheet, formats, lazy=None):
+    """
+        Validates a single worksheet schema. `lazy` names the section
+            ('cells' or 'data') whose entries are checked as they're
+            consumed, see iter_valid_cells/iter_valid_rows.
+    """
+    if not isinstance(sheet, dict):
+        _fail(path, 'Expected a dictionary of items.')
+
+    if not _STRING_255[0](sheet.get('label')):
+        _fail(path + '.label', _STRING_255[1])
+
+    if 'cells' not in sheet and 'data' not in sheet:
+        _fail(path + '.cells', 'Either cells or data must be provided.')
+
+    if 'cells' in sheet and lazy != 'cells':
+        _validate_cells(path + '.cells', sheet['cells'], formats)
+
+    if 'data' in sheet:
+        _validate_data(path + '.data', sheet['data'], formats, lazy == 'data')
+
+    for section, spec in _sections:
+        entries = sheet.get(section)
+        if entries is not None:
+            _validate_section(
+                '%s.%s' % (path, section), entries, spec, formats
+            )
+
+    # NOTE: Single autofilter and zoom aren't serializer fields, the
+    #   builder still writes them
+    if 'autofilter' in sheet:
+        _validate_entry(
+            path + '.autofilter', sheet['autofilter'],
+            _section_specs['autofilters'], formats
+        )
+
+    if 'zoom' in sheet:
+        _check_field(path + '.zoom', sheet, 'zoom', *_INDEX)
+
+    if sheet.get('autofit') is not None:
+        _validate_autofit(path + '.autofit', sheet['autofit'])
+
+    if sheet.get('styles') is not None:
+        _validate_styles(path + '.styles', sheet['styles'], formats)
+
+    return sheet
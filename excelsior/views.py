@@ -1,24 +1,80 @@
+import os
 import six
 import json
+import shutil
+import tempfile
 import xlsxwriter
 from six.moves import urllib
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
 
+from .schema import ExportError
 from .serializers import ExcelExportSerializer
+from .validators import validate_schema
 from .builder import create_sheet
+from .parallel import create_sheet_parallel
+from .cache import schema_digest
+from .jobs import get_default_backend, DONE
+from .parsers import parse_export_request
+from .templates import get_default_registry
+from .instrumentation import ExportTrace, null_trace
+from .admission import BACKGROUND, REFUSE
+from .delimited import OUTPUT_FORMATS, iter_delimited
 
 
-def write_schema_to_file_object(schema, file_object):
-    workbook = xlsxwriter.Workbook(file_object, {
-        'in_memory': True,
-        'constant_memory': True
-    })
-    workbook = create_sheet(workbook, schema)
-    workbook.close()
-    file_object.seek(0)
+def write_schema_to_file_object(schema, file_object, in_memory=True,
+                                progress=None, trace=None, processes=None,
+                                shared_strings=None):
+    """
+        Renders the schema into the file object.
+        Pass in_memory=False to let XlsxWriter keep its XML parts in
+            temp files on disk instead of worker RAM.
+        `progress` is called with the number of rows written so far.
+        `trace` (an instrumentation.ExportTrace) gets `formats`,
+            `images`, `create_sheet`, `close` and
+            `write_schema_to_file_object` phase records, the latter two
+            with the file size in `bytes_out`. The last one spans the
+            others.
+        Pass `processes` to render worksheets on that many worker
+            processes, see excelsior.parallel.
+        Pass `shared_strings` (True or a dict of StringInterner options)
+            to write repeated strings once, see excelsior.sharedstrings.
+    """
+    if trace is None:
+        trace = null_trace
+
+    tmpdir = tempfile.mkdtemp() if processes else None
+    try:
+        with trace.phase('write_schema_to_file_object') as record:
+            workbook = xlsxwriter.Workbook(file_object, {
+                'in_memory': in_memory,
+                'constant_memory': True
+            })
+            if processes:
+                workbook = create_sheet_parallel(
+                    workbook, schema, processes, progress=progress,
+                    trace=trace, tmpdir=tmpdir, shared_strings=shared_strings
+                )
+            else:
+                workbook = create_sheet(
+                    workbook, schema, progress=progress, trace=trace,
+                    shared_strings=shared_strings
+                )
+
+            with trace.phase('close') as close_record:
+                workbook.close()
+                file_object.seek(0, 2)
+                close_record['bytes_out'] = file_object.tell()
+
+            record['bytes_out'] = close_record.get('bytes_out')
+            file_object.seek(0)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
     return file_object
 
@@ -27,26 +83,319 @@ class ExportToExcelMixin(object):
     """
         This Mixin will help you make file object from your exporting schema
             and stream that file object back to the client
+        Set `streaming = True` to build the file in a spooled temp file
+            (kept in memory up to `spool_max_size` bytes, then moved to disk)
+            and serve it in `stream_chunk_size` chunks. The temp file is
+            removed once the response is closed.
+        Set `result_cache` to a cache backend (see excelsior.cache) to serve
+            repeated identical schemas without rendering them again,
+            hit/miss is reported in the `result_cache_header` header.
+        Set `trace_hooks` to callables taking a phase record (see
+            excelsior.instrumentation) to collect per-phase timings,
+            and/or `server_timing = True` to send them in the
+            Server-Timing response header.
+        Set `render_processes` to render the worksheets of multi-sheet
+            exports on a pool of that many processes.
+        Set `shared_strings` to True (or a dict of StringInterner options)
+            to write repeated strings as shared strings, which shrinks
+            exports of repetitive labels.
+        Set `admission` to an admission.AdmissionController to estimate
+            the cost of every export first: exports past its budgets are
+            refused (413) or handed off to a job on `job_backend`
+            (202 with the job status, see ExportJobView), the others
+            wait at its gate for a rendering slot (503 past its timeout).
+            Jobs wait at the same gate before they render, cached
+            results are served without asking it.
+        Schemas with `output` set to 'csv' or 'tsv', or requests that
+            accept text/csv or text/tab-separated-values, get the values
+            of one worksheet (`output_worksheet`, the first by default)
+            as delimited text instead, streamed while it's rendered
+            (see excelsior.delimited). Those skip the result cache and
+            the admission gate. Errors in lazily parsed worksheets (see
+            ExportToExcelView.incremental_parsing) only show once the
+            response has started, they truncate it. Lazily parsed
+            requests whose `filename` (or request `cookie`) doesn't
+            precede the worksheets are spooled like `streaming` files
+            first, so those keys are read before the headers are set.
     """
-    def write_schema_to_file_object(self, schema, file_object):
-        return write_schema_to_file_object(schema, file_object)
+    streaming = False
+    spool_max_size = 10 * 1024 * 1024
+    stream_chunk_size = 64 * 1024
+    result_cache = None
+    result_cache_header = 'X-Excelsior-Cache'
+    trace_hooks = ()
+    server_timing = False
+    trace = None
+    render_processes = None
+    shared_strings = None
+    admission = None
+    export_cost = None
+    job_backend = None
+
+    def get_trace(self):
+        if self.trace is None and (self.trace_hooks or self.server_timing):
+            self.trace = ExportTrace(self.trace_hooks)
+
+        return self.trace
+
+    def get_job_backend(self):
+        return self.job_backend or get_default_backend()
+
+    def get_request_body_size(self):
+        request = getattr(self, 'request', None)
+        if request is None:
+            return None
+
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return None
+
+    def get_export_cost(self, schema):
+        if self.export_cost is None:
+            self.export_cost = self.admission.estimate(
+                schema, self.get_request_body_size()
+            )
+
+        return self.export_cost
+
+    def get_job_gate(self, schema):
+        """
+            Callable entering the admission gate around a job's rendering,
+                None without `admission`. Jobs wait at the gate for as
+                long as it takes.
+        """
+        if self.admission is None:
+            return None
+
+        cost = self.get_export_cost(schema)
+        return lambda: self.admission.admit(cost, blocking=True)
+
+    def hand_off(self, schema):
+        """ Renders the export in a background job instead. """
+        job = self.get_job_backend().submit(
+            schema, admit=self.get_job_gate(schema)
+        )
+
+        return Response(job.as_dict(), status=status.HTTP_202_ACCEPTED)
+
+    def write_schema_to_file_object(self, schema, file_object, **kwargs):
+        kwargs.setdefault('trace', self.get_trace())
+        kwargs.setdefault('processes', self.render_processes)
+        kwargs.setdefault('shared_strings', self.shared_strings)
+        if self.admission is None:
+            return write_schema_to_file_object(schema, file_object, **kwargs)
+
+        cost = self.get_export_cost(schema)
+        with self.admission.admit(cost, kwargs['trace']):
+            return write_schema_to_file_object(schema, file_object, **kwargs)
+
+    def get_file_object(self, schema):
+        if self.streaming:
+            file_object = tempfile.SpooledTemporaryFile(
+                max_size=self.spool_max_size
+            )
+            return self.write_schema_to_file_object(
+                schema, file_object, in_memory=False
+            )
+
+        return self.write_schema_to_file_object(schema, six.BytesIO())
+
+    def get_cache_key(self, schema):
+        """ Result cache key of the schema, None when it isn't cached. """
+        if (self.result_cache is None
+                or getattr(schema['worksheets'], 'streamed', False)):
+            return None
+
+        return schema_digest(schema)
+
+    def get_cached_file_object(self, schema, key):
+        """
+            Renders the schema and stores the file under the cache `key`
+                (see get_cache_key), the file is rewound.
+        """
+        file_object = self.get_file_object(schema)
+        self.result_cache.set(key, file_object)
+        file_object.seek(0)
+
+        return file_object
+
+    def admit_export(self, schema):
+        """
+            Response of a handed off export, None when the export is
+                rendered in the request. Raises ExportTooLarge when
+                it's refused.
+        """
+        cost = self.get_export_cost(schema)
+        decision = self.admission.decide(cost)
+        # NOTE: Lazily parsed schemas live as long as the request
+        if decision == BACKGROUND and getattr(
+                schema['worksheets'], 'streamed', False):
+            decision = REFUSE
+
+        if decision == REFUSE:
+            self.admission.refuse(cost)
+        if decision == BACKGROUND:
+            return self.hand_off(schema)
+
+        return None
+
+    def get_output_format(self, schema):
+        """
+            'xlsx', 'csv' or 'tsv': the schema's `output` flag, otherwise
+                the first known media type of the Accept header.
+        """
+        output = schema.get('output')
+        if output is not None:
+            return output
+
+        request = getattr(self, 'request', None)
+        if request is None:
+            return 'xlsx'
+
+        return self.get_accepted_output(request) or 'xlsx'
+
+    def get_accepted_output(self, request):
+        """ 'csv' or 'tsv' if the Accept header names it, otherwise None. """
+        accept = request.META.get('HTTP_ACCEPT') or ''
+        for media_range in accept.split(','):
+            media_type = media_range.split(';', 1)[0].strip()
+            for output, (_, content_type, _) in six.iteritems(OUTPUT_FORMATS):
+                if media_type == content_type:
+                    return output
+
+        return None
+
+    def perform_content_negotiation(self, request, force=False):
+        # NOTE: Delimited exports are streamed past the renderers, none
+        #   has to match their Accept header. Error responses fall back
+        #   to the first renderer.
+        if self.get_accepted_output(request) is not None:
+            force = True
+
+        return super(ExportToExcelMixin, self).perform_content_negotiation(
+            request, force
+        )
+
+    def delimited_response(self, schema, output, **extra_params):
+        _, content_type, extension = OUTPUT_FORMATS[output]
+        content_type = u'%s; charset=utf-8' % content_type
+
+        # NOTE: Resolve the worksheet before the response starts, errors
+        #   raised while the rows stream can only cut the body short
+        try:
+            chunks = iter_delimited(
+                schema, schema.get('output_worksheet'), output
+            )
+        except ExportError as e:
+            raise ValidationError({'output_worksheet': [six.text_type(e)]})
+
+        if self.attachment_pending(schema, **extra_params):
+            # NOTE: The filename or cookie may follow the worksheets, they
+            #   are only read once the body is spooled
+            response = FileResponse(
+                self.spool_delimited(schema, chunks),
+                content_type=content_type
+            )
+            response.block_size = self.stream_chunk_size
+        else:
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+
+        filename = schema.get('filename') or 'export'
+        filename = os.path.splitext(filename)[0] + extension
+        self.set_attachment(response, filename, **extra_params)
+
+        return response
+
+    def attachment_pending(self, schema, **extra_params):
+        """
+            Whether the attachment filename may still follow the
+                worksheets of a lazily parsed schema.
+        """
+        return (getattr(schema['worksheets'], 'streamed', False)
+                and 'filename' not in schema)
+
+    def spool_delimited(self, schema, chunks):
+        """
+            Writes the delimited chunks into a spooled temp file, then
+                reads what's left of a lazily parsed schema. The file is
+                rewound.
+        """
+        file_object = tempfile.SpooledTemporaryFile(
+            max_size=self.spool_max_size
+        )
+        try:
+            for chunk in chunks:
+                file_object.write(chunk)
+            for _ in schema['worksheets']:
+                pass
+        except Exception:
+            file_object.close()
+            raise
+        file_object.seek(0)
+
+        return file_object
 
     def stream_as_file(self, schema, **extra_params):
-        file_object = self.write_schema_to_file_object(schema, six.BytesIO())
+        output = self.get_output_format(schema)
+        if output != 'xlsx':
+            return self.delimited_response(schema, output, **extra_params)
+
+        # NOTE: Hash before rendering, create_sheet updates some options in place
+        key = self.get_cache_key(schema)
+        file_object = None
+        if key is not None:
+            file_object = self.result_cache.get(key)
+
+        # Cache hits render nothing, they skip admission
+        if file_object is None and self.admission is not None:
+            response = self.admit_export(schema)
+            if response is not None:
+                return response
+
+        cache_hit = file_object is not None
+        if file_object is None:
+            if key is None:
+                file_object = self.get_file_object(schema)
+            else:
+                file_object = self.get_cached_file_object(schema, key)
+
+        response = self.file_response(file_object, schema['filename'], **extra_params)
+        if key is not None:
+            response[self.result_cache_header] = 'HIT' if cache_hit else 'MISS'
+
+        trace = self.get_trace()
+        if self.server_timing and trace is not None:
+            response['Server-Timing'] = trace.server_timing()
+
+        return response
+
+    def file_response(self, file_object, filename, **extra_params):
         response = FileResponse(file_object, status=status.HTTP_200_OK)
-        filename = urllib.parse.quote(schema['filename'].encode('utf-8'))
+        if self.streaming:
+            # NOTE: FileResponse closes (and so removes) the file on close()
+            response.block_size = self.stream_chunk_size
+        self.set_attachment(response, filename, **extra_params)
+        response['Content-Type'] = u'application/vnd.ms-excel'
+
+        return response
+
+    def set_attachment(self, response, filename, **extra_params):
+        filename = urllib.parse.quote(filename.encode('utf-8'))
         # NOTE: Gory details http://greenbytes.de/tech/tc2231/
         filename_fallback = u'filename*=UTF-8\'\'{}'.format(filename)
         response['Content-Disposition'] = u'attachment; filename="{}"; {}'.format(filename, filename_fallback)
-        response['Content-Type'] = u'application/vnd.ms-excel'
 
         cookie = (extra_params.get('cookie') or
-                        self.request.data.get('cookie'))
+                        self.get_request_cookie())
         if cookie:
             response.set_cookie(cookie, 'true')
 
         return response
 
+    def get_request_cookie(self):
+        return self.request.data.get('cookie')
+
 
 class ExportToExcelView(ExportToExcelMixin, APIView):
     """
@@ -54,19 +403,136 @@ class ExportToExcelView(ExportToExcelMixin, APIView):
             from request body and turns it into the .xlsx file.
         Same does Excelsior API, so you can use this view in case you don't
             want to spent any time on API calls.
+        Schemas are checked by the fast path validator, set
+            `strict_validation = True` to run the DRF serializers instead.
+        Set `incremental_parsing = True` to parse JSON bodies as a stream
+            (see excelsior.parsers): cells are decoded, validated and
+            written one at a time, so huge payloads are never held in
+            memory as a whole. Combine with `streaming = True` to keep the
+            workbook itself off the heap as well.
+        Schemas with a `template` key are template requests: only their
+            worksheet data is validated, and merged into the registered
+            template (see excelsior.templates) from `template_registry`,
+            the process wide registry by default.
     """
+    strict_validation = False
+    incremental_parsing = False
+    request_envelope = None
+    template_registry = None
 
     parser_classes = (JSONParser, MultiPartParser, FormParser)
     form_media_types = (FormParser.media_type, MultiPartParser.media_type)
 
     def post(self, request, *args, **kwargs):
-        # Notice: We allow submitting both types - ajax and form based
-        schema = request.data['data']
-        if (request.content_type in self.form_media_types
-                and isinstance(schema, six.string_types)):
-            schema = json.loads(schema)
+        trace = self.get_trace() or null_trace
+
+        if self.incremental_parsing and self.is_json_request(request):
+            # NOTE: Only the schema head is parsed here, worksheets are
+            #   parsed while create_sheet writes them
+            with trace.phase('parse'):
+                self.request_envelope = parse_export_request(
+                    request.stream, templates=self.get_template_registry()
+                )
+            return self.stream_as_file(self.request_envelope['data'])
+
+        return self.stream_as_file(self.get_schema(request))
+
+    def get_template_registry(self):
+        return self.template_registry or get_default_registry()
+
+    def is_json_request(self, request):
+        return (request.content_type or '').startswith(JSONParser.media_type)
+
+    def attachment_pending(self, schema, **extra_params):
+        if super(ExportToExcelView, self).attachment_pending(
+                schema, **extra_params):
+            return True
+
+        # The cookie is a request key, it may follow `data`
+        return (self.request_envelope is not None
+                and 'cookie' not in self.request_envelope
+                and not extra_params.get('cookie'))
+
+    def get_request_cookie(self):
+        if self.request_envelope is not None:
+            return self.request_envelope.get('cookie')
+
+        return super(ExportToExcelView, self).get_request_cookie()
+
+    def get_schema(self, request):
+        # NOTE: Parsing and validation are traced as separate phases,
+        #   neither includes the other
+        trace = self.get_trace() or null_trace
+        with trace.phase('parse'):
+            # Notice: We allow submitting both types - ajax and form based
+            schema = request.data['data']
+            if (request.content_type in self.form_media_types
+                    and isinstance(schema, six.string_types)):
+                schema = json.loads(schema)
+
+        with trace.phase('validate'):
+            return self.validate_schema(schema)
+
+    def validate_schema(self, schema):
+        if isinstance(schema, dict) and 'template' in schema:
+            template = self.get_template_registry().resolve(schema['template'])
+            return template.merge(schema)
+
+        if self.strict_validation:
+            serializer = ExcelExportSerializer(data=schema)
+            serializer.is_valid(raise_exception=True)
+            return serializer.data
+
+        return validate_schema(schema)
+
+
+class ExportJobView(ExportToExcelView):
+    """
+        Asynchronous counterpart of ExportToExcelView.
+            POST schema        -> 202 with the job status, `id` included
+            GET <job_id>       -> job status, rows written out of total
+            GET <job_id>?download=1 -> the finished file
+            DELETE <job_id>    -> cancels the job (or drops a finished one)
+        Route it with a `job_id` URL kwarg for the detail methods.
+        Jobs run on `job_backend`, the process wide
+            jobs.LocalJobBackend by default. Its jobs only exist in the
+            process they were submitted to and expire after a while,
+            see excelsior.jobs.
+        Jobs outlive the request, so payloads are always parsed as a whole.
+    """
+    incremental_parsing = False
+
+    def get_job(self, job_id):
+        job = self.get_job_backend().get(job_id)
+        if job is None:
+            raise NotFound('Export job %s does not exist.' % job_id)
+        return job
+
+    def post(self, request, *args, **kwargs):
+        schema = self.get_schema(request)
+        job = self.get_job_backend().submit(
+            schema, admit=self.get_job_gate(schema)
+        )
+
+        return Response(job.as_dict(), status=status.HTTP_202_ACCEPTED)
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = self.get_job(job_id)
+        if not request.query_params.get('download'):
+            return Response(job.as_dict())
+
+        if job.status != DONE:
+            return Response(job.as_dict(), status=status.HTTP_409_CONFLICT)
+
+        file_object = self.get_job_backend().open_result(job_id)
+        return self.file_response(file_object, job.filename)
 
-        serializer = ExcelExportSerializer(data=schema)
-        serializer.is_valid(raise_exception=True)
+    def delete(self, request, job_id, *args, **kwargs):
+        backend = self.get_job_backend()
+        job = self.get_job(job_id)
+        if job.finished:
+            backend.discard(job_id)
+        else:
+            backend.cancel(job_id)
 
-        return self.stream_as_file(serializer.data)
+        return Response(job.as_dict())
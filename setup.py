@@ -34,6 +34,6 @@ def parse_requirements(filename, parent=None):
 setup(
     name="excelsior-lib",
     version="0.0.11",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     install_requires=list(parse_requirements('requirements.txt'))
 )